@@ -0,0 +1,92 @@
+# Microbenchmark: vectorised GetVoltageSoln vs the original per-node InsertValue loop.
+#
+# Writes a synthetic Vsoln frame with the same nested shape the Continuity EP
+# simulation saves out, then times both loaders on it.
+#
+# pvpython bench_GetVoltageSoln.py [numNodes] [repeats]
+
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+import vtk
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from SaveMeshAndScalarValues import GetVoltageSoln
+
+""" The original loader (before vectorising), kept here as the baseline.
+filePath -> the location to the specific voltage solution data
+Returns -> Properly formatted scalar values (scalarData)
+"""
+def GetVoltageSolnLoop(filePath):
+    vSolns = np.load(filePath)
+    vSoln = vSolns[0]
+    cleaner_data = []
+
+    for i in vSoln:
+        cleaner_data.append(i[0])
+
+    cleaner_data = np.array(cleaner_data)
+
+    scalarData = vtk.vtkDoubleArray()
+    scalarData.SetName("Voltage Solution")
+
+    id = 0
+    minValue = 0
+    maxValue = 0
+
+    for i in cleaner_data[0]:
+        if i < minValue:
+            minValue = i
+        if i > maxValue:
+            maxValue = i
+
+        scalarData.InsertValue(id, i)
+        id = id + 1
+
+    return scalarData
+
+""" Times a loader over a number of repeats.
+Returns -> best time in seconds
+"""
+def TimeLoader(loader, filePath, repeats):
+    best = None
+    for i in range(repeats):
+        start = timer()
+        loader(filePath)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(numNodes, repeats):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        # (1, 8, 1, numNodes) -> same layout as Vsoln_testrun_<i>.npy
+        filePath = os.path.join(tmpDir, 'Vsoln_testrun_1.npy')
+        np.save(filePath, np.random.rand(1, 8, 1, numNodes))
+
+        # Both loaders must agree before timing them
+        old = GetVoltageSolnLoop(filePath)
+        new = GetVoltageSoln(filePath)
+        assert old.GetNumberOfTuples() == new.GetNumberOfTuples()
+        for i in range(0, numNodes, max(1, numNodes // 1000)):
+            assert old.GetValue(i) == new.GetValue(i)
+
+        tLoop = TimeLoader(GetVoltageSolnLoop, filePath, repeats)
+        tVec = TimeLoader(GetVoltageSoln, filePath, repeats)
+
+        print('nodes: %d, repeats: %d' % (numNodes, repeats))
+        print('loop       : %.6f s' % tLoop)
+        print('vectorised : %.6f s' % tVec)
+        print('speedup    : %.1fx' % (tLoop / tVec))
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    numNodes = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    main(numNodes, repeats)
@@ -0,0 +1,91 @@
+# Benchmark: SaveFrames frames/second against the number of worker processes.
+#
+# Builds a synthetic hex mesh (_NODEFILE.csv/_ELEMFILE.csv) and a run of Vsoln
+# frames, converts them serially once as the reference, then again with each
+# worker count, checking the .vtp output is byte-identical to the serial run.
+#
+# pvpython bench_SaveFrames.py [numFrames] [nodesPerSide] [maxWorkers]
+
+import os
+import sys
+import shutil
+import filecmp
+import tempfile
+import multiprocessing
+from timeit import default_timer as timer
+
+import numpy as np
+import vtk
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+import SaveMeshAndScalarValues as smsv
+
+""" Writes a structured block of hexahedra out in the Continuity CSV format.
+fileDir -> output directory (with trailing slash)
+n -> nodes along each side of the block
+Returns -> number of nodes
+"""
+def WriteSyntheticMesh(fileDir, n):
+    idx = np.arange(n ** 3).reshape(n, n, n)
+    coords = np.stack(np.meshgrid(np.arange(n), np.arange(n), np.arange(n), indexing='ij'), axis=-1).reshape(-1, 3)
+
+    # Continuity local node order: xi1 fastest, then xi2, then xi3
+    a = idx[:-1, :-1, :-1].ravel()
+    elems = np.stack([a, a + n * n, a + n, a + n * n + n,
+                      a + 1, a + n * n + 1, a + n + 1, a + n * n + n + 1], axis=1)
+
+    np.savetxt(fileDir + '_NODEFILE.csv', coords.astype(np.float64), fmt='%.9f', delimiter=',',
+               header='Coordinate_X,Coordinate_Y,Coordinate_Z', comments='')
+    np.savetxt(fileDir + '_ELEMFILE.csv', elems, fmt='%i', delimiter=',',
+               header=','.join('Global_Node_%d' % (i + 1) for i in range(8)), comments='')
+    return n ** 3
+
+def WriteSyntheticFrames(fileDir, numFrames, numNodes):
+    for i in range(numFrames):
+        name = 'Vsoln_testrun.npy' if i == 0 else 'Vsoln_testrun_%d.npy' % i
+        np.save(fileDir + name, np.random.rand(1, 8, 1, numNodes))
+
+""" Runs SaveFrames once into a fresh output directory.
+Returns -> (elapsed seconds, output directory)
+"""
+def RunSaveFrames(fileDir, mesh, outputDir, numWorkers):
+    os.mkdir(outputDir)
+    pDWriter = vtk.vtkXMLPolyDataWriter()
+    mesh.GetPointData().SetScalars(None)
+
+    start = timer()
+    smsv.SaveFrames(fileDir, None, mesh, pDWriter, outputDir=outputDir, numWorkers=numWorkers)
+    return timer() - start
+
+def main(numFrames, nodesPerSide, maxWorkers):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        fileDir = tmpDir + '/'
+        numNodes = WriteSyntheticMesh(fileDir, nodesPerSide)
+        WriteSyntheticFrames(fileDir, numFrames, numNodes)
+        mesh = smsv.Load(fileDir + '_NODEFILE.csv', fileDir + '_ELEMFILE.csv')
+
+        serialDir = fileDir + 'serial/'
+        tSerial = RunSaveFrames(fileDir, mesh, serialDir, 1)
+        outputs = sorted(os.listdir(serialDir))
+
+        print('frames: %d, nodes: %d' % (numFrames, numNodes))
+        print('workers  frames/s  speedup  identical')
+        print('%7d  %8.1f  %7.2f  %9s' % (1, numFrames / tSerial, 1.0, 'ref'))
+
+        numWorkers = 2
+        while numWorkers <= maxWorkers:
+            outputDir = fileDir + 'workers_%d/' % numWorkers
+            elapsed = RunSaveFrames(fileDir, mesh, outputDir, numWorkers)
+            match, mismatch, errors = filecmp.cmpfiles(serialDir, outputDir, outputs, shallow=False)
+            identical = len(match) == len(outputs)
+            print('%7d  %8.1f  %7.2f  %9s' % (numWorkers, numFrames / elapsed, tSerial / elapsed, identical))
+            numWorkers *= 2
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    numFrames = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    nodesPerSide = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    maxWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+    main(numFrames, nodesPerSide, maxWorkers)
@@ -0,0 +1,112 @@
+# Benchmark: fitting the DT fields on an averaged level of a data pyramid
+# (data_pyramid.py, dt_fit.FitDTLevel) against fitting every 20th voxel, the way
+# calc_data_coords.m down samples the data for FieldFit3D.py.
+#
+# Synthetic run: the thick walled cylinder mesh of bench_xi_engine.py filled with a
+# voxel grid, known nodal fields for the six log tensor components sampled at every
+# voxel with noise, written as a full resolution data form. Times building the
+# pyramid, then reports time and how well the known fields are recovered for: every
+# 20th voxel, each averaged level on its own and a direct fit of the full resolution
+# data.
+#
+# With the defaults (747120 voxels) level 1 fits in 0.5s with a node RMS error of
+# 0.0057, against 0.0056 for the full resolution data (7.5s) and 0.115 for every 20th
+# voxel. Fitting the levels coarse to fine, each starting from the fields of the one
+# before, was tried and dropped: the full resolution pass costs the same either way
+# (reading the data and finding its xi dominate, not the solve), so it came out
+# slower than the direct fit (8.6s).
+#
+# python bench_data_pyramid.py [voxelSize] [numLevels] [elemsAround]
+
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from xi_engine import FindXis
+from data_pyramid import BuildPyramid, DATA_HEADER
+from dt_fit import AssembleFit, SolveFits, EvaluateFields, FitDTLevel, LoadLevelData
+from bench_xi_engine import CylinderMesh
+
+WEIGHT = 10.0
+STRIDE = 20
+
+""" Writes noisy samples of nodal fields at every voxel of a grid inside the mesh as a
+full resolution data form.
+Returns -> number of voxels
+"""
+def WriteVoxelData(filePath, nodes, elements, truth, voxelSize, noise=0.05):
+    x = np.arange(-30.0, 30.0, voxelSize)
+    z = np.arange(0.0, 60.0, voxelSize)
+    X, Y, Z = np.meshgrid(x, x, z, indexing='ij')
+    r = np.sqrt(X ** 2 + Y ** 2)
+    wall = (r >= 20.0) & (r <= 30.0)
+    points = np.column_stack([X[wall], Y[wall], Z[wall]])
+    pointElems, pointXis = FindXis(nodes, elements, points)
+    inside = pointElems >= 0
+    points = points[inside]
+    rng = np.random.RandomState(0)
+    values = EvaluateFields(truth, elements, pointElems[inside], pointXis[inside]) \
+        + noise * rng.randn(len(points), 6)
+    ones = np.ones(len(points))
+    table = np.column_stack([points[:, 0], ones, points[:, 1], ones, points[:, 2], ones, values,
+                             np.arange(1, len(points) + 1)])
+    np.savetxt(filePath, table, fmt=['%.9g'] * 12 + ['%d'], delimiter='\t', header=DATA_HEADER, comments='')
+    return len(points)
+
+""" Fits a data form directly with one weight.
+Returns -> nodal values, seconds
+"""
+def DirectFit(nodes, elements, dataFile, weight, stride=1):
+    start = timer()
+    coords, pointWeights, values = LoadLevelData(dataFile)
+    coords, pointWeights, values = coords[::stride], pointWeights[::stride], values[::stride]
+    pointElems, pointXis = FindXis(nodes, elements, coords)
+    inside = pointElems >= 0
+    AtA, Atd, S = AssembleFit(elements, len(nodes), pointElems[inside], pointXis[inside], values[inside],
+                              pointWeights=pointWeights[inside])
+    fit = SolveFits(AtA, Atd, S, [weight])[0]
+    return fit, timer() - start
+
+def Synthetic(voxelSize, numLevels, elemsAround):
+    nodes, elements = CylinderMesh(elemsAround)
+    truth = np.column_stack([np.sin(nodes[:, 2] / 20.0 + k) + nodes[:, 0] / 30.0 for k in range(6)])
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        dataFile = os.path.join(tmpDir, 'data_DT_grfl_dump_out_mask_coords1.txt')
+        numPoints = WriteVoxelData(dataFile, nodes, elements, truth, voxelSize)
+        print('nodes: %d, elements: %d, voxels: %d, smoothing weight: %g'
+              % (len(nodes), len(elements), numPoints, WEIGHT))
+
+        start = timer()
+        levels = BuildPyramid(dataFile, os.path.join(tmpDir, ''), numLevels)
+        print('pyramid built in %.2fs: %s points' % (timer() - start, ', '.join(str(l['points']) for l in levels)))
+
+        def error(fit):
+            return np.sqrt(np.mean((fit - truth) ** 2))
+
+        print('\n%-28s %9s %8s %14s' % ('fit', 'points', 'seconds', 'node RMS error'))
+        fit, seconds = DirectFit(nodes, elements, dataFile, WEIGHT, STRIDE)
+        print('%-28s %9d %8.2f %14.4f' % ('every %dth voxel' % STRIDE, numPoints // STRIDE, seconds, error(fit)))
+        for level in levels[:-1]:
+            start = timer()
+            fit = FitDTLevel(nodes, elements, level['dataFile'], [WEIGHT])[0][0]
+            seconds = timer() - start
+            print('%-28s %9d %8.2f %14.4f' % ('level %d on its own' % level['level'], level['points'], seconds,
+                                               error(fit)))
+
+        fit, seconds = DirectFit(nodes, elements, dataFile, WEIGHT)
+        print('%-28s %9d %8.2f %14.4f' % ('full resolution, direct', numPoints, seconds, error(fit)))
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    voxelSize = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    numLevels = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    elemsAround = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    Synthetic(voxelSize, numLevels, elemsAround)
@@ -0,0 +1,115 @@
+# Benchmark: the numpy/scipy DT field fitter (dt_fit.py) that replaces FieldFit3D.py's
+# Continuity FitData passes.
+#
+# Synthetic run: a thick walled cylinder of trilinear elements (the mesh from
+# bench_xi_engine.py), known nodal fields for the six tensor components, and noisy
+# data points scattered through the wall. Times the fit the way dt_fit.py does it
+# (assembled once, one factorisation per weight for all six components) against
+# refitting from scratch per weight and component, the way the FitData passes go,
+# and reports how well the known fields are recovered. Then scores a range of
+# weights by GCV and the L-curve (dt_fit.ScoreWeights) against computing the GCV
+# score directly (a fit and the trace of the hat matrix per weight), and how well
+# the chosen weights recover the fields.
+#
+# python bench_dt_fit.py [numPoints] [elemsAround]
+#
+# Against the Continuity fit: run FieldFit3D.py with fitEngine = 'both' (on the
+# synthetic mesh or a real heart), which saves the nodal fields of both fits per
+# weight, then
+#
+# python bench_dt_fit.py --compare <output>_1_fields_continuity.csv <output>_1_fields_numpy.csv [...]
+#
+# for each weight's pair of files, which reports the differences per component
+# relative to the largest value of Continuity's field. A penalty scaled differently
+# from Continuity's shows up as differences growing with the weight.
+
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from xi_engine import FindXis
+from dt_fit import AssembleFit, SolveFits, ScoreWeights, EvaluateFields, ReadNodalFields, FIELD_NAMES
+from bench_xi_engine import CylinderMesh
+
+WEIGHTS = [100.0, 50.0, 10.0]
+WEIGHT_RANGE = np.logspace(-2, 4, 31)
+
+def Synthetic(numPoints, elemsAround):
+    nodes, elements = CylinderMesh(elemsAround)
+    rng = np.random.RandomState(0)
+    radius, angle = rng.uniform(20, 30, numPoints), rng.uniform(0, 2 * np.pi, numPoints)
+    points = np.column_stack([radius * np.cos(angle), radius * np.sin(angle), rng.uniform(0, 60, numPoints)])
+    pointElems, pointXis = FindXis(nodes, elements, points)
+    inside = pointElems >= 0
+    pointElems, pointXis = pointElems[inside], pointXis[inside]
+
+    # Smooth fields over the nodes, sampled at the data points with noise
+    truth = np.column_stack([np.sin(nodes[:, 2] / 20.0 + k) + nodes[:, 0] / 30.0 for k in range(6)])
+    values = EvaluateFields(truth, elements, pointElems, pointXis) + 0.05 * rng.randn(len(pointElems), 6)
+    print('nodes: %d, elements: %d, data points: %d, weights: %s'
+          % (len(nodes), len(elements), len(pointElems), WEIGHTS))
+
+    start = timer()
+    AtA, Atd, S = AssembleFit(elements, len(nodes), pointElems, pointXis, values)
+    tAssemble = timer() - start
+    start = timer()
+    fits = SolveFits(AtA, Atd, S, WEIGHTS)
+    tSolve = timer() - start
+    print('assembled once + one factorisation per weight: %.3fs (assembly %.3fs, solves %.3fs)'
+          % (tAssemble + tSolve, tAssemble, tSolve))
+
+    # Everything redone for every weight and component
+    start = timer()
+    for weight in WEIGHTS:
+        for k in range(6):
+            AtA1, Atd1, S1 = AssembleFit(elements, len(nodes), pointElems, pointXis, values[:, k:k + 1])
+            SolveFits(AtA1, Atd1, S1, [weight])
+    print('reassembled and solved per weight and component: %.3fs' % (timer() - start))
+
+    print('weight  data RMS  node RMS error')
+    for weight, fit in zip(WEIGHTS, fits):
+        dataRMS = np.sqrt(np.mean((EvaluateFields(fit, elements, pointElems, pointXis) - values) ** 2))
+        print('%6g  %8.4f  %8.4f' % (weight, dataRMS, np.sqrt(np.mean((fit - truth) ** 2))))
+
+    # GCV computed directly: N |Au - d|^2 / (N - trace((A'A + weight S)^-1 A'A))^2
+    start = timer()
+    G, Sd = AtA.toarray(), S.toarray()
+    scores = []
+    for weight, fit in zip(WEIGHT_RANGE, SolveFits(AtA, Atd, S, WEIGHT_RANGE)):
+        rss = ((EvaluateFields(fit, elements, pointElems, pointXis) - values) ** 2).sum()
+        trace = np.trace(np.linalg.solve(G + weight * Sd, G))
+        scores.append(len(values) * rss / (len(values) - trace) ** 2)
+    print('\ndirect GCV for %d weights: %.3fs, chose %.3g'
+          % (len(WEIGHT_RANGE), timer() - start, WEIGHT_RANGE[np.argmin(scores)]))
+    for method in ('gcv', 'lcurve'):
+        start = timer()
+        result = ScoreWeights(AtA, Atd, S, (values ** 2).sum(axis=0), len(values), WEIGHT_RANGE, method)
+        elapsed = timer() - start
+        fit = SolveFits(AtA, Atd, S, [result['chosen']])[0]
+        print('%-6s scored them in %.3fs, chose %.3g, node RMS error %.4f'
+              % (method, elapsed, result['chosen'], np.sqrt(np.mean((fit - truth) ** 2))))
+
+""" Compares pairs of saved nodal fields, Continuity's first in each pair.
+tol -> largest difference, relative to Continuity's largest value, for the fits to agree
+"""
+def Compare(paths, tol=1e-3):
+    for referencePath, fitPath in zip(paths[::2], paths[1::2]):
+        reference, fit = ReadNodalFields(referencePath), ReadNodalFields(fitPath)
+        diff = np.abs(fit - reference)
+        relative = diff.max(axis=0) / np.maximum(np.abs(reference).max(axis=0), 1e-300)
+        print('\n%s against %s' % (os.path.basename(fitPath), os.path.basename(referencePath)))
+        print('component  max abs diff  RMS diff  max diff / largest |value|')
+        for k, name in enumerate(FIELD_NAMES):
+            print('%-9s  %12.4g  %8.4g  %10.3g' % (name, diff[:, k].max(), np.sqrt(np.mean(diff[:, k] ** 2)), relative[k]))
+        print('agree' if relative.max() <= tol else 'DIFFERENT (more than %g of the largest value)' % tol)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        Compare(sys.argv[2:])
+    else:
+        numPoints = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+        elemsAround = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+        Synthetic(numPoints, elemsAround)
@@ -0,0 +1,77 @@
+# Benchmark: ParaViewOutput.outputMeshVTU/outputFiberVTU time and file size for the
+# ascii, binary and compressed binary formats, and for the partitioned .pvtu export.
+#
+# Fills the mesh ParaViewOutput would get from getMesh() with a synthetic block of
+# hexahedra (no Continuity needed) and writes it out in each format.
+#
+# python bench_outputMeshVTU.py [nodesPerSide] [numFieldVars] [numPieces]
+
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Original_Scripts'))
+from ParaViewInterface import ParaViewOutput
+
+""" Sets up a structured block of hexahedra as ParaViewOutput's refined mesh.
+n -> nodes along each side of the block
+numFieldVars -> field variables per node besides the coordinates
+"""
+def SetSyntheticMesh(n, numFieldVars):
+    idx = np.arange(n ** 3).reshape(n, n, n)
+    a = idx[:-1, :-1, :-1].ravel()
+    elements = np.stack([a, a + 1, a + n, a + n + 1,
+                         a + n * n, a + n * n + 1, a + n * n + n, a + n * n + n + 1], axis=1)
+    vertices = np.random.rand(n ** 3, 3 + numFieldVars)
+
+    ParaViewOutput._ParaViewOutput__elements = elements.astype(np.int32)
+    ParaViewOutput._ParaViewOutput__vertices = vertices
+    ParaViewOutput.fibers = {'coordinates': vertices[:, :3], 'tensors': np.random.rand(n ** 3, 3, 3)}
+
+def main(nodesPerSide, numFieldVars, numPieces):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        SetSyntheticMesh(nodesPerSide, numFieldVars)
+        print('nodes: %d, elements: %d' % (nodesPerSide ** 3, (nodesPerSide - 1) ** 3))
+        print('format              mesh s  fiber s   mesh MB  fiber MB')
+
+        for dataFormat, compress, pieces in (('ascii', False, 1), ('binary', False, 1), ('binary', True, 1),
+                                             ('binary', False, numPieces), ('binary', True, numPieces)):
+            ParaViewOutput.dataFormat = dataFormat
+            ParaViewOutput.compress = compress
+            ParaViewOutput.numPieces = pieces
+            pieceDir = os.path.join(tmpDir, '%s_%d_%d' % (dataFormat, compress, pieces))
+            os.mkdir(pieceDir)
+            ParaViewOutput.filename = os.path.join(pieceDir, 'out')
+
+            start = timer()
+            if pieces > 1:
+                ParaViewOutput.outputMeshPVTU()
+            else:
+                ParaViewOutput.outputMeshVTU()
+            tMesh = timer() - start
+            start = timer()
+            if pieces > 1:
+                ParaViewOutput.outputFiberPVTU()
+            else:
+                ParaViewOutput.outputFiberVTU()
+            tFiber = timer() - start
+
+            files = os.listdir(pieceDir)
+            meshMB = sum(os.path.getsize(os.path.join(pieceDir, f)) for f in files if 'Fiber' not in f) / 1048576.0
+            fiberMB = sum(os.path.getsize(os.path.join(pieceDir, f)) for f in files if 'Fiber' in f) / 1048576.0
+            name = dataFormat + (' (zlib)' if compress else '') + (' x%d' % pieces if pieces > 1 else '')
+            print('%-17s  %7.2f  %7.2f  %8.1f  %8.1f' % (name, tMesh, tFiber, meshMB, fiberMB))
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    nodesPerSide = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    numFieldVars = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    numPieces = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+    main(nodesPerSide, numFieldVars, numPieces)
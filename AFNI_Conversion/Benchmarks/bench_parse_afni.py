@@ -0,0 +1,129 @@
+# Benchmark: the streaming 3dmaskdump parser (parse_afni_dump.py) against reading the
+# whole dump into memory and masking it afterwards, the way Parse_AFNI_v4_G1.m and
+# Parse_AFNI_v4_GRPS.m textscan it.
+#
+# Writes a synthetic dump (a voxel image with an ellipsoid of tissue, the rest MD = 0
+# as in a masked 3dmaskdump), runs both in their own process to measure time and peak
+# memory, then checks the streamed MAT-file holds the same D, DT, coords, es, vs and
+# d_nz as the whole-file version (which follows the MATLAB code line by line).
+#
+# python bench_parse_afni.py [sizeX sizeY sizeZ] [chunkRows]
+
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+import h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from ep_sweep import CallAndMeasure
+from parse_afni_dump import ParseAFNIDump
+
+""" Writes a dump of the given image size, chunk by chunk.
+Returns -> number of voxels inside the mask
+"""
+def WriteDump(filePath, size, tissue=0.2):
+    sx, sy, sz = size
+    rng = np.random.RandomState(0)
+    numKept = 0
+    of = open(filePath, 'w')
+    try:
+        for k in range(sz):
+            j, i = np.meshgrid(np.arange(sy), np.arange(sx), indexing='ij')
+            i, j = i.ravel(), j.ravel()
+            n = len(i)
+            d = np.zeros((n, 25))
+            d[:, 0] = k * sx * sy + j * sx + i
+            d[:, 1], d[:, 2], d[:, 3] = -0.1 * i, -0.1 * j, 0.1 * k
+            r = ((i - sx / 2.0) / (sx / 2.0)) ** 2 + ((j - sy / 2.0) / (sy / 2.0)) ** 2 + ((k - sz / 2.0) / (sz / 2.0)) ** 2
+            inside = r < tissue * 4
+            m = int(inside.sum())
+            d[inside, 4:22] = rng.randn(m, 18)
+            d[inside, 22] = np.where(rng.rand(m) < 0.01, 1.0, rng.rand(m)) # A few FA == 1 voxels
+            d[inside, 23] = rng.rand(m) + 0.1
+            numKept += int((inside & (d[:, 22] != 1)).sum())
+            np.savetxt(of, d, fmt=['%d'] + ['%g'] * 24, delimiter=' ')
+    finally:
+        of.close()
+    return numKept
+
+""" Parse_AFNI_v4 in numpy: the whole dump in memory, then masked.
+Returns -> dict of the variables, in MATLAB's shapes
+"""
+def ParseWhole(dumpFile):
+    d = np.loadtxt(dumpFile, ndmin=2)
+    ind_nzs = (d[:, 23] != 0) & (d[:, 22] != 1)
+    d[:, 1] = -d[:, 1]
+    d[:, 2] = -d[:, 2]
+    d_nz = d[ind_nzs, :]
+    n = len(d_nz)
+    c = lambda k: d_nz[:, k - 1] # MATLAB's 1 based columns
+
+    D = np.column_stack([c(5), c(7), c(10), c(6), c(8), c(9)])
+    DT = np.zeros((3, 3, n))
+    DT[0, 0], DT[0, 1], DT[0, 2] = c(5), c(6), c(8)
+    DT[1, 0], DT[1, 1], DT[1, 2] = c(6), c(7), c(9)
+    DT[2, 0], DT[2, 1], DT[2, 2] = c(8), c(9), c(10)
+    coords = np.column_stack([c(2), c(3), c(4)])
+    es = np.column_stack([c(13), c(12), c(11)])
+    vs = np.zeros((3, 3, n))
+    vs[0, 2], vs[1, 2], vs[2, 2] = c(14), c(15), c(16)
+    vs[0, 1], vs[1, 1], vs[2, 1] = c(17), c(18), c(19)
+    vs[0, 0], vs[1, 0], vs[2, 0] = c(20), c(21), c(22)
+    return {'D': D, 'DT': DT, 'coords': coords, 'es': es, 'vs': vs, 'd_nz': d_nz}
+
+""" Reads a MAT-file written by parse_afni_dump.py back into MATLAB's shapes.
+"""
+def ReadMatFile(filePath):
+    f = h5py.File(filePath, 'r')
+    try:
+        return dict((name, np.asarray(f[name]).T) for name in f)
+    finally:
+        f.close()
+
+def Run(size, chunkRows):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        dumpFile = os.path.join(tmpDir, 'DT_grfl_msk_dump.txt')
+        start = timer()
+        numKept = WriteDump(dumpFile, size)
+        print('dump of %d x %d x %d voxels (%.0f MB), %d inside the mask, written in %.1fs'
+              % (size + (os.path.getsize(dumpFile) / 1048576.0, numKept, timer() - start)))
+
+        log = open(os.path.join(tmpDir, 'log.txt'), 'w')
+        try:
+            for mode in ('--whole', '--stream'):
+                start = timer()
+                returncode, peakRSS = CallAndMeasure([sys.executable, os.path.abspath(__file__), mode, dumpFile,
+                                                      str(chunkRows)], log, tmpDir)
+                if returncode:
+                    raise RuntimeError('%s run failed, see %s' % (mode, log.name))
+                print('%-8s %6.1fs  peak RSS %s MB' % (mode[2:], timer() - start, peakRSS))
+        finally:
+            log.close()
+
+        streamed = ReadMatFile(os.path.join(tmpDir, 'DT_grfl_msk_dump_out_mask.mat'))
+        whole = ParseWhole(dumpFile)
+        for name in ('D', 'DT', 'coords', 'es', 'vs', 'd_nz'):
+            same = streamed[name].shape == whole[name].shape and np.array_equal(streamed[name], whole[name])
+            print('%-6s %-14s %s' % (name, 'x'.join(str(s) for s in whole[name].shape),
+                                     'same' if same else 'DIFFERENT'))
+        f = open(os.path.join(tmpDir, 'DT_grfl_msk_dump_out_mask.mat'), 'rb')
+        print('header: %s' % f.read(40).decode('ascii'))
+        f.close()
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--whole':
+        ParseWhole(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == '--stream':
+        outputPath = os.path.splitext(sys.argv[2])[0] + '_out_mask.mat'
+        ParseAFNIDump(sys.argv[2], outputPath, chunkRows=int(sys.argv[3]))
+    else:
+        size = tuple(int(s) for s in sys.argv[1:4]) if len(sys.argv) > 3 else (96, 96, 96)
+        chunkRows = int(sys.argv[4]) if len(sys.argv) > 4 else 1 << 16
+        Run(size, chunkRows)
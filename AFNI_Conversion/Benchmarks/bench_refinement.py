@@ -0,0 +1,232 @@
+# Benchmark: cost and accuracy of the EP simulation against the refinement of the
+# fitted mesh (elemsPerElem in SetupEPSimulation.py).
+#
+# Runs setup and simulation once per refinement level as an ep_sweep.py sweep, then
+# compares every level with the finest one. Per level the table has the wall time
+# and peak RSS of the Continuity job, the number of frames, the size of the frame
+# .npy files, of the packed store (Vsoln_testrun.vstore, the same frames again) and
+# of the mesh CSVs, and how far its voltage traces are from the finest level's:
+#
+# actRMS/actMax  RMS/largest difference in activation time (first time a node's
+#                voltage crosses the threshold), in the simulation's time units
+# vRMS           RMS voltage difference over all nodes and frames
+# activated      percentage of the nodes that activated
+#
+# Nodes are matched to the nearest node of the finest mesh by their coordinates.
+# The table is printed and saved as benchDir/refinement.csv.
+#
+# python bench_refinement.py mDir benchDir 3,3,2 6,6,3 9,9,4 [--params params.json]
+# python bench_refinement.py mDir benchDir --compare-only
+#
+# params.json fixes the other parameters for every level (see ep_sweep.py), e.g.
+#   {"tlen": 50.0, "pacedNodes": {"3,3,2": [120, 121], "6,6,3": [494, 495, 500, 501]}}
+# The paced nodes are node numbers in the refined mesh, so they change with the
+# level; a value given as an object is picked per level like this.
+#
+# --continuity 'python /path/to/fake_continuity.py' tries it out without Continuity.
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from ep_sweep import RunSweep
+from mesh_io import LoadMeshArrays
+from vsoln_io import VoltageSolnFrames
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+TABLE_FIELDS = ['level', 'nodes', 'elements', 'status', 'seconds', 'peakRSSMB', 'frames',
+                'frameMB', 'storeMB', 'meshMB', 'actRMS', 'actMax', 'vRMS', 'activated']
+
+""" Returns -> the level name of an elemsPerElem list, e.g. [6, 6, 3] -> '6,6,3'
+"""
+def LevelName(elemsPerElem):
+    return ','.join(str(v) for v in elemsPerElem)
+
+""" One sweep case per refinement level.
+levels -> list of elemsPerElem lists
+params -> parameters shared by every level; an object value is picked per level by level name
+Returns -> list of cases for ep_sweep.RunSweep
+"""
+def LevelCases(levels, params):
+    cases = []
+    for elemsPerElem in levels:
+        case = {'elemsPerElem': list(elemsPerElem)}
+        for name, value in params.items():
+            if isinstance(value, dict):
+                if LevelName(elemsPerElem) not in value:
+                    raise ValueError('No %s given for level %s' % (name, LevelName(elemsPerElem)))
+                value = value[LevelName(elemsPerElem)]
+            case[name] = value
+        cases.append(case)
+    return cases
+
+""" Finds the nearest fine mesh node to every node of a coarser mesh, with scipy's
+k-d tree when it is there and in blocks of brute force distances otherwise.
+points -> node coordinates of the coarser mesh (N x 3)
+finePoints -> node coordinates of the finest mesh (M x 3)
+Returns -> index into finePoints per node
+"""
+def NearestNodes(points, finePoints):
+    if cKDTree is not None:
+        return cKDTree(finePoints).query(points)[1]
+    nearest = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), 1024):
+        block = points[start:start + 1024]
+        dist = ((block[:, None, :] - finePoints[None, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + 1024] = dist.argmin(axis=1)
+    return nearest
+
+""" Returns -> the smallest and largest voltage over every frame of a run
+"""
+def VoltageRange(fileDir):
+    vMin, vMax = np.inf, -np.inf
+    for frameNum, values in VoltageSolnFrames(fileDir):
+        vMin, vMax = min(vMin, values.min()), max(vMax, values.max())
+    return vMin, vMax
+
+""" Works out when every node activates, reading the frames one at a time.
+fileDir -> directory holding the Vsoln frames (with trailing slash)
+threshold -> voltage a node has to reach to count as activated
+dtout -> output time step of the run
+Returns -> activation time per node, NaN for nodes that never activate
+"""
+def ActivationTimes(fileDir, threshold, dtout):
+    activation = None
+    for frameNum, values in VoltageSolnFrames(fileDir):
+        if activation is None:
+            activation = np.full(len(values), np.nan)
+        activation[np.isnan(activation) & (values >= threshold)] = frameNum * dtout
+    return activation
+
+""" RMS difference between a run's voltages and the finest run's voltages at the
+matched nodes, over the frames both runs have.
+fileDir -> the run's Vsoln directory (with trailing slash)
+fineDir -> the finest run's Vsoln directory (with trailing slash)
+nearest -> from NearestNodes
+"""
+def TraceRMS(fileDir, fineDir, nearest):
+    sumSq, count = 0.0, 0
+    for (frameNum, values), (fineNum, fineValues) in zip(VoltageSolnFrames(fileDir), VoltageSolnFrames(fineDir)):
+        diff = values - fineValues[nearest]
+        sumSq += np.dot(diff, diff)
+        count += len(diff)
+    return np.sqrt(sumSq / count) if count else np.nan
+
+""" Returns -> total size in MB of the files in a directory whose names start with one of
+prefixes and end with one of suffixes
+"""
+def FilesSize(dirPath, prefixes, suffixes=('',)):
+    return sum(os.path.getsize(dirPath + file) for file in os.listdir(dirPath)
+               if file.startswith(prefixes) and file.endswith(suffixes)) / 1048576.0
+
+""" Builds the table rows from the sweep's index entries, comparing every level
+that ran to the finest one (the one with the most nodes).
+entries -> index entries from ep_sweep.RunSweep (or index.json)
+threshold -> activation threshold, by default halfway up the finest run's voltage range
+Returns -> list of rows (field -> value), coarsest level first
+"""
+def CompareLevels(entries, threshold=None):
+    rows = []
+    meshes = {}
+    for entry in entries:
+        outputDir = entry['outputDir']
+        row = dict((field, entry.get(field)) for field in ('status', 'seconds', 'peakRSSMB', 'frames'))
+        row['level'] = LevelName(entry['parameters']['elemsPerElem'])
+        row['nodes'], row['elements'] = None, None
+        if entry['status'] == 'done':
+            points, elements = LoadMeshArrays(outputDir + '_NODEFILE.csv', outputDir + '_ELEMFILE.csv')
+            meshes[entry['case']] = points
+            row['nodes'], row['elements'] = len(points), len(elements)
+            row['frameMB'] = round(FilesSize(outputDir, ('Vsoln_',), ('.npy',)), 3)
+            row['storeMB'] = round(FilesSize(outputDir, ('Vsoln_',), ('.vstore',)), 3)
+            row['meshMB'] = round(FilesSize(outputDir, ('_NODEFILE', '_ELEMFILE')), 3)
+        row['entry'] = entry
+        rows.append(row)
+    if not meshes:
+        return rows
+
+    fine = max((row for row in rows if row['entry']['case'] in meshes), key=lambda row: row['nodes'])
+    fineDir, finePoints = fine['entry']['outputDir'], meshes[fine['entry']['case']]
+    if threshold is None:
+        vMin, vMax = VoltageRange(fineDir)
+        threshold = 0.5 * (vMin + vMax)
+    fineActivation = ActivationTimes(fineDir, threshold, fine['entry']['parameters']['dtout'])
+
+    for row in rows:
+        entry = row['entry']
+        if entry['case'] not in meshes:
+            continue
+        nearest = NearestNodes(meshes[entry['case']], finePoints)
+        activation = ActivationTimes(entry['outputDir'], threshold, entry['parameters']['dtout'])
+        both = ~np.isnan(activation) & ~np.isnan(fineActivation[nearest])
+        actDiff = activation[both] - fineActivation[nearest][both]
+        row['actRMS'] = round(float(np.sqrt(np.mean(actDiff ** 2))), 4) if both.any() else None
+        row['actMax'] = round(float(np.abs(actDiff).max()), 4) if both.any() else None
+        row['vRMS'] = round(float(TraceRMS(entry['outputDir'], fineDir, nearest)), 5)
+        row['activated'] = round(100.0 * np.mean(~np.isnan(activation)), 1)
+
+    rows.sort(key=lambda row: (row['nodes'] is None, row['nodes'] or 0))
+    return rows
+
+""" Saves the rows as CSV (via a temporary file) and prints them as a table.
+"""
+def WriteTable(benchDir, rows):
+    of = open(benchDir + 'refinement.csv.part', 'w')
+    try:
+        of.write(','.join(TABLE_FIELDS) + '\n')
+        for row in rows:
+            of.write(','.join('"%s"' % row[field] if field == 'level' else ('' if row.get(field) is None else str(row[field]))
+                              for field in TABLE_FIELDS) + '\n')
+    finally:
+        of.close()
+    os.rename(benchDir + 'refinement.csv.part', benchDir + 'refinement.csv')
+
+    print(' '.join('%10s' % field for field in TABLE_FIELDS))
+    for row in rows:
+        print(' '.join('%10s' % ('-' if row.get(field) is None else row[field]) for field in TABLE_FIELDS))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the EP simulation over mesh refinement levels')
+    parser.add_argument('mDir', help='dataset directory, as given to SetupEPSimulation.py')
+    parser.add_argument('benchDir', help='directory for the runs and the table')
+    parser.add_argument('levels', nargs='*', help='elemsPerElem per level, e.g. 6,6,3')
+    parser.add_argument('--params', help='JSON file of the other parameters for every level')
+    parser.add_argument('--threshold', type=float, default=None, help='activation threshold voltage')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='simulations running at once (more than 1 skews the timings)')
+    parser.add_argument('--continuity', default='continuity', help='command that starts Continuity')
+    parser.add_argument('--compare-only', action='store_true',
+                        help='rebuild the table from the runs already in benchDir')
+    args = parser.parse_args()
+
+    benchDir = os.path.join(args.benchDir, '')
+    if args.compare_only:
+        f = open(benchDir + 'index.json')
+        try:
+            entries = json.load(f)
+        finally:
+            f.close()
+    else:
+        if not args.levels:
+            parser.error('give at least one refinement level')
+        params = {}
+        if args.params:
+            f = open(args.params)
+            try:
+                params = json.load(f)
+            finally:
+                f.close()
+        cases = LevelCases([[int(v) for v in level.split(',')] for level in args.levels], params)
+        if not os.path.isdir(benchDir):
+            os.makedirs(benchDir)
+        entries = RunSweep(args.mDir, benchDir, cases, args.workers, args.continuity)
+
+    WriteTable(benchDir, CompareLevels(entries, args.threshold))
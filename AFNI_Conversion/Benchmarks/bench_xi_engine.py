@@ -0,0 +1,125 @@
+# Benchmark: the numpy xi engine (xi_engine.py) that replaces the FitData 'in 3D
+# volume' call in CalcXis.py.
+#
+# Synthetic run: builds a thick walled cylinder of trilinear elements (no Continuity
+# needed), scatters data points over its bounding box, times the engine and checks
+# every found point maps back onto itself and, on a sample, that the points left
+# out really are outside every element.
+#
+# python bench_xi_engine.py [numPoints] [elemsAround]
+#
+# Against the current path: run CalcXis.py with xiEngine = 'both', which prints the
+# time of both calculations and writes the numpy table next to Continuity's, then
+#
+# python bench_xi_engine.py --compare <model>_NODEFILE.csv <model>_ELEMFILE.csv cont_DT_coords_mask_aligned.txt XiTable_<model>_DT_maskcoords.txt
+#
+# times the engine on the same mesh and data, reports how its elements and xi agree
+# with Continuity's table and prints the table's header and separator next to the
+# provisional ones xi_engine.py writes without a Continuity table to copy.
+
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from mesh_io import LoadMeshArrays
+from xi_engine import FindXis, CalcXiTable, ReadXiTable, ReadXiTableLayout, LoadDataPoints, TrilinearMap, NewtonXi, \
+    XI_TABLE_HEADER
+
+""" Builds a thick walled cylinder of hexahedra, nodes in Continuity's local order.
+elemsAround -> elements around the circumference (and half as many along the axis, 2 through the wall)
+Returns -> nodes (M x 3), elements (E x 8)
+"""
+def CylinderMesh(elemsAround):
+    nr, nt, nz = 3, elemsAround, elemsAround // 2 + 1
+    r, t, z = np.meshgrid(np.linspace(20.0, 30.0, nr), np.arange(nt) * 2 * np.pi / nt,
+                          np.linspace(0.0, 60.0, nz), indexing='ij')
+    nodes = np.stack([r * np.cos(t), r * np.sin(t), z], axis=-1).reshape(-1, 3)
+
+    idx = np.arange(nr * nt * nz).reshape(nr, nt, nz)
+    i, j, k = np.meshgrid(np.arange(nr - 1), np.arange(nt), np.arange(nz - 1), indexing='ij')
+    i, j, k = i.ravel(), j.ravel(), k.ravel()
+    j1 = (j + 1) % nt # Wraps around
+    elements = np.stack([idx[i, j, k], idx[i + 1, j, k], idx[i, j1, k], idx[i + 1, j1, k],
+                         idx[i, j, k + 1], idx[i + 1, j, k + 1], idx[i, j1, k + 1], idx[i + 1, j1, k + 1]], axis=1)
+    return nodes, elements
+
+""" Checks the engine's answer: found points have to map back onto themselves, and a
+sample of the points left out is tried against every element.
+Returns -> largest distance between a found point and its mapped xi, number of sampled points wrongly left out
+"""
+def CheckXis(nodes, elements, points, pointElems, pointXis, numSample=50):
+    found = np.nonzero(pointElems >= 0)[0]
+    x, J = TrilinearMap(nodes[elements[pointElems[found]]], pointXis[found])
+    maxError = np.sqrt(((x - points[found]) ** 2).sum(axis=1)).max() if len(found) else 0.0
+
+    missed = 0
+    notFound = np.nonzero(pointElems < 0)[0]
+    for p in notFound[:numSample]:
+        corners = nodes[elements]
+        xi, converged = NewtonXi(corners, np.tile(points[p], (len(elements), 1)), (0.5, 0.5, 0.5))
+        inside = converged & np.all((xi >= -1e-6) & (xi <= 1 + 1e-6), axis=1)
+        missed += int(inside.any())
+    return maxError, missed
+
+def Synthetic(numPoints, elemsAround):
+    nodes, elements = CylinderMesh(elemsAround)
+    rng = np.random.RandomState(0)
+    points = np.column_stack([rng.uniform(-32, 32, numPoints), rng.uniform(-32, 32, numPoints),
+                              rng.uniform(-2, 62, numPoints)])
+    print('nodes: %d, elements: %d, data points: %d' % (len(nodes), len(elements), numPoints))
+
+    start = timer()
+    pointElems, pointXis = FindXis(nodes, elements, points)
+    elapsed = timer() - start
+    maxError, missed = CheckXis(nodes, elements, points, pointElems, pointXis)
+    numFound = int((pointElems >= 0).sum())
+    print('found %d inside in %.2fs (%.0f points/s)' % (numFound, elapsed, numPoints / elapsed))
+    print('largest mapping error: %.2e, sampled points wrongly left out: %d' % (maxError, missed))
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        dataFile = os.path.join(tmpDir, 'cont_DT_coords_mask_aligned.txt')
+        data = np.column_stack([points[:, 0], np.ones(numPoints), points[:, 1], np.ones(numPoints),
+                                points[:, 2], np.ones(numPoints), np.zeros(numPoints), np.arange(1, numPoints + 1)])
+        np.savetxt(dataFile, data, delimiter='\t', comments='',
+                   header='coord1_val\tcoord1_weight\tcoord2_val\tcoord2_weight\tcoord3_val\tcoord3_weight\tLabel\tData')
+        start = timer()
+        CalcXiTable(nodes, elements, dataFile, os.path.join(tmpDir, 'XiTable.txt'))
+        print('with reading the data form and writing the table: %.2fs' % (timer() - start))
+    finally:
+        shutil.rmtree(tmpDir)
+
+def Compare(nodesFile, elemsFile, dataFile, referencePath):
+    nodes, elements = LoadMeshArrays(nodesFile, elemsFile)
+    points, dataNumbers = LoadDataPoints(dataFile)
+    start = timer()
+    pointElems, pointXis = FindXis(nodes, elements, points)
+    print('numpy engine: %d of %d data points inside in %.2fs' % ((pointElems >= 0).sum(), len(points), timer() - start))
+
+    header, delimiter = ReadXiTableLayout(referencePath) or ('', None)
+    print('reference header: %r, separator %r (provisional: %r, %r)' % (header, delimiter, XI_TABLE_HEADER, '\t'))
+    refData, refElems, refXis = ReadXiTable(referencePath)
+    row = dict((d, i) for i, d in enumerate(dataNumbers))
+    ref = np.array([row[d] for d in refData], dtype=np.int64)
+    inBoth = pointElems[ref] >= 0
+    sameElem = inBoth & (pointElems[ref] + 1 == refElems)
+    print('reference: %d data points, %d also found by the engine, %d in the same element'
+          % (len(refData), inBoth.sum(), sameElem.sum()))
+    if sameElem.any():
+        xiDiff = np.abs(pointXis[ref[sameElem]] - refXis[sameElem]).max(axis=1)
+        print('xi difference in the same element: mean %.2e, max %.2e' % (xiDiff.mean(), xiDiff.max()))
+    onlyEngine = np.setdiff1d(np.nonzero(pointElems >= 0)[0], ref)
+    print('found only by the engine: %d' % len(onlyEngine))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        Compare(*sys.argv[2:6])
+    else:
+        numPoints = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+        elemsAround = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+        Synthetic(numPoints, elemsAround)
@@ -5,7 +5,15 @@
 # Date: March 21, 2017
 # This script will compute xi coordinates of loaded data points within the volume of a 3D FE mesh
 import sys
+import os
+import time
 import pdb
+import numpy as np
+
+# Shared helpers (xi_engine.py) sit next to this script, [4] is the script path
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[4])))
+from xi_engine import CalcXiTable, CheckTrilinearGeometry
+from xi_cache import XiCacheKey, FetchXiTable, StoreXiTable
 
 # USER INPUT=============================================================================
 mDir = sys.argv[5] # if set up like this: ./continuity --full --no-threads --batch $script $mDir $modelFile
@@ -35,6 +43,22 @@ subdiv = '10'
 # list of elements to calculate xis in
 ellist = 'all'
 
+# How the xi coordinates are calculated:
+# 'continuity' -> Continuity's FitData 'in 3D volume' calculation
+# 'numpy' -> xi_engine.py, from the model's nodes and elements (trilinear models only,
+#            others are refused)
+# 'both' -> Continuity's table as output, the numpy one next to it (_numpy.txt, in the
+#           layout of Continuity's), to compare them with bench_xi_engine.py --compare
+# Stays 'continuity' until the numpy engine has been compared on a real model.
+xiEngine = 'continuity'
+
+# Reuse the xi table of an earlier run with the same mesh geometry, data coordinates
+# and xi options (not for 'both'); the least recently used tables are removed once
+# the cache is over its disk budget
+useXiCache = True
+xiCacheDir = os.path.join(os.path.expanduser('~'), '.cardiac_xitables', '')
+xiCacheBytes = 2 * 1024 ** 3
+
 # USER INPUT=============================================================================
 # for this one mdir -> datadir
 print 'Loading model %s'%(datadir + modelFile + '.cont6')
@@ -50,8 +74,58 @@ self.Send(None, log=0)
 
 self.CalcMeshFast([('Calculate', None), ('Do not Calculate', None), ('Calculate', None), ('Angle change scale factors (for nodal derivs wrt angle change)', None)], log=1)
 
-# 3D volume fit to output Xi coordinates of data file
-self.FitData({'preapplyConstraints':0,'calcErrorStr':'error = (data-x)*weight\n','geomDataIsCart':1,'err':'1.00e-006','selections':{'Coordinate 2': 'coord2', 'Coordinate 3': 'coord3', 'Coordinate 1': 'coord1'},'initializeFields':0,'iterationLimit':'10','fit_selections':(),'xi_options':{'dpError': '50.0', 'errorType': 'sd', 'datalist': 'all', 'sdError': '50.0', 'optimizeVars': 1, 'filterData': True, 'calcType': 'in 3D volume', 'showTable': True, 'subdivisions': subdiv, 'itmax': '50', 'vmax': '1.5', 'elemlist': ellist, 'ignorePoints': 1, 'tolerance': '1e-006', 'dpErrorType': 'sd', 'newtonUpdate': 1, 'outputPath':output},'output_type':'Update nodal variable'}, log=0)
+# Model nodes (coordinates are field variables 1-3) and zero-indexed elements
+nodeList = self.stored_data.nodes.obj
+nodes = np.array([(nodeList.nodes[i].derivs[0][0], nodeList.nodes[i].derivs[1][0], nodeList.nodes[i].derivs[2][0])
+                  for i in range(len(nodeList))], dtype=np.float64).reshape(-1, 3)
+elements = np.asarray(self.stored_data.elem.obj.elements, dtype=np.int64)[:, :8] - 1
+
+# Continuity's xi follow the full (e.g. cubic Hermite) geometry, not just the node positions:
+# every nodal derivative of the coordinates and the basis of each field. The scale factors
+# are recalculated from these by CalcMeshFast above.
+nodeDerivs = [np.asarray(nodeList.nodes[i].derivs[c], dtype=np.float64).ravel()
+              for i in range(len(nodeList)) for c in (0, 1, 2)]
+geometry = [np.concatenate(nodeDerivs), [len(d) for d in nodeDerivs], nodeList.getGeomBasisValues()]
+if xiEngine in ('numpy', 'both'):
+    CheckTrilinearGeometry(geometry[2])
+
+# Options the table depends on, as passed to FitData below (the numpy engine uses the same tolerance and itmax)
+xiOptions = {'engine': 'numpy' if xiEngine == 'numpy' else 'continuity', 'subdivisions': subdiv,
+             'elemlist': ellist, 'tolerance': '1e-006', 'itmax': '50', 'vmax': '1.5'}
+cacheKey = None
+cacheHit = False
+if useXiCache and xiEngine != 'both':
+    cacheKey = XiCacheKey(nodes, elements, mDir + data_file, xiOptions, geometry)
+    cacheHit = FetchXiTable(xiCacheDir, cacheKey, output)
+    if cacheHit:
+        print 'xi table %s taken from the cache (%s), skipping the xi calculation'%(output, cacheKey)
+    elif os.path.exists(output):
+        # May be linked to a cached table, which Continuity would otherwise write through
+        os.remove(output)
+
+if not cacheHit and xiEngine in ('continuity', 'both'):
+    start = time.time()
+    # 3D volume fit to output Xi coordinates of data file
+    self.FitData({'preapplyConstraints':0,'calcErrorStr':'error = (data-x)*weight\n','geomDataIsCart':1,'err':'1.00e-006','selections':{'Coordinate 2': 'coord2', 'Coordinate 3': 'coord3', 'Coordinate 1': 'coord1'},'initializeFields':0,'iterationLimit':'10','fit_selections':(),'xi_options':{'dpError': '50.0', 'errorType': 'sd', 'datalist': 'all', 'sdError': '50.0', 'optimizeVars': 1, 'filterData': True, 'calcType': 'in 3D volume', 'showTable': True, 'subdivisions': subdiv, 'itmax': '50', 'vmax': '1.5', 'elemlist': ellist, 'ignorePoints': 1, 'tolerance': '1e-006', 'dpErrorType': 'sd', 'newtonUpdate': 1, 'outputPath':output},'output_type':'Update nodal variable'}, log=0)
+    print 'Continuity xi calculation: %.1fs, written to %s'%(time.time() - start, output)
+
+if not cacheHit and xiEngine in ('numpy', 'both'):
+    # Also saved out so xi_engine.py can be rerun on them without Continuity
+    np.savetxt(datadir + modelFile + '_NODEFILE.csv', nodes, fmt='%.9f', delimiter=',',
+               header='Coordinate_X,Coordinate_Y,Coordinate_Z', comments='')
+    np.savetxt(datadir + modelFile + '_ELEMFILE.csv', elements, fmt='%i', delimiter=',',
+               header=','.join('Global_Node_%d' % (i + 1) for i in range(8)), comments='')
+
+    numpyOutput = output if xiEngine == 'numpy' else output[:-4] + '_numpy.txt'
+    start = time.time()
+    # With 'both' the layout is copied from the table Continuity just wrote
+    numFound, numPoints = CalcXiTable(nodes, elements, mDir + data_file, numpyOutput,
+                                      referencePath=output if xiEngine == 'both' and os.path.exists(output) else None)
+    print 'numpy xi engine: %d of %d data points inside the mesh in %.1fs, written to %s'%(numFound, numPoints, time.time() - start, numpyOutput)
+
+if cacheKey is not None and not cacheHit and os.path.exists(output):
+    StoreXiTable(xiCacheDir, cacheKey, output, xiCacheBytes,
+                 {'model': modelFile, 'dataFile': mDir + data_file, 'options': xiOptions})
 
 ##################################################################################
 # ERROR HERE IN BATCH MODE, MIGHT NOT NEED THIS
@@ -11,9 +11,14 @@ from time import localtime, strftime
 import shutil
 import time
 import pdb
+import os
 
 import sys
 
+# Shared helpers (dt_fit.py) sit next to this script, [4] is the script path
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[4])))
+from dt_fit import FitDTFields, WriteNodalFields, SelectDTWeight, WriteWeightScores, WeightReport, FitDTLevel
+
 # [5] if set up like this: ./continuity --full --no-threads --batch $script $mDir $modelName
 fDir = sys.argv[5]
 mDir = fDir + 'ContinuityFiles/'
@@ -82,6 +87,38 @@ initializeField = 0
 # subdivisions if calculating Xis
 subdivs = '5'
 
+# How the DT fields are fitted (both need the xi table):
+# 'continuity' -> Continuity's FitData, one pass per weight
+# 'numpy' -> dt_fit.py, assembled once and one sparse factorisation per weight for all six fields
+# 'both' -> Continuity's fit into the saved models, and the nodal fields of both fits saved
+#           per weight (<output>_<j>_fields_continuity.csv / _numpy.csv) to compare with bench_dt_fit.py
+# Stays 'continuity' until 'both' has shown the two agree on a real model: dt_fit.py
+# integrates the smoothing terms over the unit xi cube, which may not be how
+# Continuity scales its Sobolev terms.
+fitEngine = 'continuity'
+
+# Nodal fields the DT components are fitted into (Fields 1-6: dxx, dyy, dzz, dxy, dxz, dyz)
+dtFields = [6, 7, 8, 9, 10, 11]
+
+# Choose the smoothing weight from the data instead of the weights above (needs the xi table
+# and fitEngine = 'numpy')?
+# None -> fit with the weights above
+# 'gcv' / 'lcurve' -> score every weight in weightRange (dt_fit.py, generalised cross
+#                     validation or the L-curve corner) and fit once with the chosen one
+# The scores come from dt_fit.py's smoothing terms, which aren't calibrated against
+# Continuity's, so a chosen weight means nothing to Continuity's FitData.
+selectWeights = None
+weightRange = list(numpy.logspace(-2, 4, 31))
+
+# Fit an averaged level of a data pyramid (data_pyramid.py) instead of data_file (numpy engine only)?
+# None -> fit data_file
+# 'data_DT_grfl_dump_out_mask_coords_pyr1.txt' (in fDir) -> fit that level, each point weighted by
+#                             the number of voxels averaged into it. Its xi are found by
+#                             xi_engine.py, the xi table isn't needed
+# (bench_data_pyramid.py: level 1 fits in 0.5s with about the node error of the full
+# resolution data, every 20th voxel has 20 times that error)
+pyramidLevel = None
+
 #########################################################################
 ########################## FUNCTION DEFINITIONS #########################
 #########################################################################
@@ -98,6 +135,27 @@ def setFieldBasis(self,derivs,fields,nb):
     nodes.setEnabledDerivs(eds)
     self.stored_data.store(nodes)
     
+# Model node coordinates (field variables 1-3) and zero-indexed elements
+def getMeshArrays(self):
+    nodes = self.stored_data.nodes.obj
+    coords = numpy.array([(nodes.nodes[i].derivs[0][0], nodes.nodes[i].derivs[1][0], nodes.nodes[i].derivs[2][0])
+                          for i in range(len(nodes))], dtype=numpy.float64).reshape(-1, 3)
+    elements = numpy.asarray(self.stored_data.elem.obj.elements, dtype=numpy.int64)[:, :8] - 1
+    return coords, elements
+
+# Nodal values (nodes x len(fields)) of the given field variables
+def getNodalFields(self,fields):
+    nodes = self.stored_data.nodes.obj
+    return numpy.array([[nodes.nodes[i].derivs[j][0] for j in fields] for i in range(len(nodes))], dtype=numpy.float64)
+
+# Writes nodal values (nodes x len(fields)) into the given field variables
+def setNodalFields(self,values,fields):
+    nodes = self.stored_data.nodes.obj
+    for i in range(len(nodes)):
+        for k, j in enumerate(fields):
+            nodes.nodes[i].derivs[j][0] = values[i][k]
+    self.stored_data.store(nodes)
+
 #########################################################################
 ########################## DOOOOOOOOOOOOOOOOOOO #########################
 #########################################################################
@@ -142,9 +200,39 @@ self.CalcMeshFast([('Calculate', None), ('Do not Calculate', None), ('Calculate'
 
 # pdb.set_trace()
 
-# Load data file
-print 'Loading fitting data file %s'%(fDir+data_file)
-self.LoadFittingData(fDir + data_file, log=0)
+if pyramidLevel:
+    if fitEngine != 'numpy' or selectWeights:
+        raise ValueError("pyramidLevel needs fitEngine = 'numpy' and no selectWeights")
+elif fitEngine != 'continuity' and not xit:
+    raise ValueError("fitEngine '%s' needs the precalculated xi table (xit = 1)"%fitEngine)
+
+if selectWeights:
+    if fitEngine != 'numpy':
+        raise ValueError("selectWeights needs fitEngine = 'numpy': the weight is scored with dt_fit.py's smoothing terms")
+    if not xit:
+        raise ValueError("selectWeights needs the precalculated xi table (xit = 1)")
+    time_selectstart = time.time()
+    meshNodes, meshElements = getMeshArrays(self)
+    selection = SelectDTWeight(meshNodes, meshElements, fDir + data_file, xipath, weightRange, selectWeights)
+    WriteWeightScores(md + output + '_weights.csv', selection)
+    print WeightReport(selection, selectWeights)
+    print "Weights scored in %s seconds, saved to %s"%(time.time()-time_selectstart, md + output + '_weights.csv')
+    weights = [float(selection['chosen'])]
+    its = 1
+
+if fitEngine in ('continuity', 'both'):
+    # Load data file
+    print 'Loading fitting data file %s'%(fDir+data_file)
+    self.LoadFittingData(fDir + data_file, log=0)
+
+if fitEngine in ('numpy', 'both'):
+    time_numpystart = time.time()
+    meshNodes, meshElements = getMeshArrays(self)
+    if pyramidLevel:
+        numpyFits, numpyRMS, numPoints = FitDTLevel(meshNodes, meshElements, fDir + pyramidLevel, weights)
+    else:
+        numpyFits, numpyRMS, numPoints = FitDTFields(meshNodes, meshElements, fDir + data_file, xipath, weights)
+    print "numpy fit of %d data points for weights %s in %s seconds, RMS residuals %s"%(numPoints, weights, time.time()-time_numpystart, numpyRMS)
 
 # pdb.set_trace()
 
@@ -188,7 +276,7 @@ for j in range(its):
     self.auto_update_dimensions()
     self.Send(None, log=0)
 	
-    if xit:
+    if xit and fitEngine in ('continuity', 'both'):
 	# self.FitData({'preapplyConstraints':0,'calcErrorStr':'error = (data-x)*weight\n','geomDataIsCart':1,'err':'1.00e-006',
  #        'selections':{'Field 3': 'dzz', 'Field 2': 'dyy', 'Field 1': 'dxx', 'Field 6': 'dyz', 'Field 5': 'dxz', 'Field 4': 'dxy', 'Coordinate 2': 'coord_2', 'Coordinate 3': 'coord_3', 'Coordinate 1': 'coord_1'},
  #        'fit_selections':('Field 1','Field 2','Field 3','Field 4','Field 5','Field 6',),
@@ -206,6 +294,12 @@ for j in range(its):
             'selections':{'Field 3': 'dzz', 'Field 2': 'dyy', 'Field 1': 'dxx', 'Field 6': 'dyz', 'Field 5': 'dxz', 'Field 4': 'dxy', 'Coordinate 2': 'coord2', 'Coordinate 3': 'coord3', 'Coordinate 1': 'coord1'},\
             'preapplyConstraints':0,'output_type':'Update nodal variable','initializeFields':0,'geomDataIsCart':1}, log=0) #Modified redraw=0 to log=0, batch mode
         
+    if fitEngine == 'numpy':
+        setNodalFields(self, numpyFits[j], dtFields)
+    if fitEngine == 'both':
+        WriteNodalFields(md + output + '_%d_fields_continuity.csv'%(j+1), getNodalFields(self, dtFields))
+        WriteNodalFields(md + output + '_%d_fields_numpy.csv'%(j+1), numpyFits[j])
+
     self.auto_update_dimensions()
     self.Send(None, log=0)
     
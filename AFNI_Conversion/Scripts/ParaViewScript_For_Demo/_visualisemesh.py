@@ -7,93 +7,55 @@
 # Script restructured into functions + rewritten to be run from command line by Hoang
 
 import vtk
+from vtk.util import numpy_support
 import sys
+import os
 import numpy as np
 from paraview.simple import *
 
+# Shared helpers live one directory up, next to SaveMeshAndScalarValues.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mesh_io import LoadMeshArrays, BoundaryFaces, ElementFaces
+from vsoln_io import LoadVoltageSoln, ListVoltageSolnFrames, ReadVoltageSolnFrame
+from frame_cache import FrameCache
+
 """ Recreates a 3D mesh from data captured from the output of the Continuity EP 
 simulation. In this particular case, the mesh is a reconstruction from nodes/elements 
 information from a left ventricle heart model that was saved out.
 nodesFile -> the file where the nodes information of the heart mesh were saved
 elemsFile -> the file where the elems information of the heart mesh were saved
+meshType -> 'surface': exterior quads of the hex mesh
+            'faces': inner, outer and one horizontal face of every element
 Returns -> the reconstructed mesh (polyData)
 """
-def Load(nodesFile, elemsFile):
+def Load(nodesFile, elemsFile, meshType='surface'):
   polyData = vtk.vtkPolyData() # Mesh to be constructed
   pDPoints = vtk.vtkPoints() # Points of the mesh 
   pDCells = vtk.vtkCellArray() # Cells of the mesh
-  LVMeshPoints = None # Nodes information for LV mesh
-  LVMeshElems = None # Elements information for LV mesh
-  
-  ## Insert Coords 
-  try:
-
-      # Import nodes file
-      LVMeshPoints = open(nodesFile)
-
-      id = 0 # ID # for points
-      line = LVMeshPoints.readline() # Read the header
-      
-      for coords in LVMeshPoints:
-
-          # Get coord values by row
-          coordValues = coords.strip().split(',')
 
-          # Insert coords into points
-          pDPoints.InsertPoint(id, (float(coordValues[0]),
-                                  float(coordValues[1]),
-                                  float(coordValues[2])))
-          id = id + 1 # Increment Id
-  finally:
-      if LVMeshPoints is not None:
-
-          # Close opened file
-          LVMeshPoints.close()
+  # Nodes + elems as whole arrays (from the binary cache when the CSVs are unchanged)
+  LVMeshPoints, LVMeshElems = LoadMeshArrays(nodesFile, elemsFile)
 
+  ## Insert Coords
+  pDPoints.SetData(numpy_support.numpy_to_vtk(LVMeshPoints.astype(np.float32), deep=1)) # vtkPoints default precision
   print 'Added nodes info to points'
 
   ## Insert Elems
-  try:
-
-      # Import elems file
-      LVMeshElems = open(elemsFile)
-
-      # Number of points per cell
-      numPoints = 4
-      line = LVMeshElems.readline() # Reading the header
-      
-      for elems in LVMeshElems:
-
-          # Get elems values by row
-          elemsValues = elems.strip().split(',')
-          
-          ## insert elems into cells   
-          # Elems need to be reordered from the Continuity format
-          # -> [hex[0],hex[1],hex[3],hex[2],hex[4],hex[5],hex[7],hex[6]]
-	  # From: HEXBLENDER_OT_import_pickle(bpy.types.Operator) function
-	  
-	  # Inner Plane
-          pDCells.InsertNextCell(numPoints, (int(elemsValues[0]),
-                                     int(elemsValues[1]),
-                                     int(elemsValues[3]),
-                                     int(elemsValues[2])))
-	  
-	  # Outer Plane
-          pDCells.InsertNextCell(numPoints, (int(elemsValues[4]),
-                                     int(elemsValues[5]),
-                                     int(elemsValues[7]),
-                                     int(elemsValues[6])))
-	  
-	  # Horizontal Planes
-          pDCells.InsertNextCell(numPoints, (int(elemsValues[6]),
-                                     int(elemsValues[7]),
-                                     int(elemsValues[3]),
-                                     int(elemsValues[2])))
-  finally:
-      if LVMeshElems is not None:
-
-          # Close opened file
-          LVMeshElems.close()
+  # Elems need to be reordered from the Continuity format
+  # -> [hex[0],hex[1],hex[3],hex[2],hex[4],hex[5],hex[7],hex[6]]
+  # From: HEXBLENDER_OT_import_pickle(bpy.types.Operator) function
+  if meshType == 'faces':
+    quads = ElementFaces(LVMeshElems)
+  elif meshType == 'surface':
+    quads = BoundaryFaces(LVMeshElems)
+  else:
+    raise ValueError("Unknown meshType '%s'" % meshType)
+
+  # Legacy cell layout [4, id0, id1, id2, id3, 4, ...] understood by every vtk version
+  cellData = np.empty((quads.shape[0], 5), dtype=numpy_support.ID_TYPE_CODE)
+  cellData[:, 0] = 4 # Number of points per cell
+  cellData[:, 1:] = quads
+  pDCells.SetCells(quads.shape[0], numpy_support.numpy_to_vtkIdTypeArray(cellData.ravel(), deep=1))
   
   print 'Added elems info to cells'
   
@@ -111,36 +73,34 @@ filePath -> the location to the specific voltage solution data
 Returns -> Properly formatted scalar values (scalarData)  
 """  
 def GetVoltageSoln(filePath):
-  vSolns = np.load(filePath) # Location of the voltage solutions
-  vSoln = vSolns[0] # The voltage solution data
-  cleaner_data = [] # Holds the cleaned up voltage solution data
+  # Nodal values + per frame range, reshaped with array operations
+  values, minValue, maxValue = LoadVoltageSoln(filePath)
 
-  # Clean up the shape of the data [Modified from Roy's heart_reader code]
-  for i in vSoln:
-      cleaner_data.append(i[0])
-    
-  # Convert back into numpy array [From Roy's heart_reader code]         
-  cleaner_data = np.array(cleaner_data) 
+  return VoltageScalars(values)
 
+""" Wraps an array of nodal voltage values as the mesh's scalar information.
+values -> contiguous float64 array with one value per node
+Returns -> Properly formatted scalar values (scalarData)
+"""
+def VoltageScalars(values):
   ## Format scalar information
-  scalarData = vtk.vtkDoubleArray() # Scalar object
+  # Hands the numpy buffer straight to vtk rather than inserting each value
+  scalarData = numpy_support.numpy_to_vtk(values, deep=0, array_type=vtk.VTK_DOUBLE)
   scalarData.SetName("Voltage Solution")
 
-  id = 0; # Position of data
-  minValue = 0;
-  maxValue = 0;
-  # Insert voltage solution values into scalar object
-  for i in cleaner_data[0]:
-      if i < minValue:
-          minValue = i
-      if i > maxValue:
-          maxValue = i
-
-      scalarData.InsertValue(id, i)
-      id = id + 1
-
   return scalarData
 
+""" Reads a frame for the frame cache. Rows of the packed store are copied out of the
+memory map, so that a cache hit never has to go back to disk.
+frameNum -> frame number as used in the Vsoln file names
+Returns -> the frame's nodal values
+"""
+def LoadFrameIntoMemory(frameNum):
+  values = ReadVoltageSolnFrame(fileDir, frameNum)
+  if isinstance(values, np.memmap):
+      values = np.array(values)
+  return values
+
 # Modified from the function: MakeLUTFromCTF() from
 # https://www.vtk.org/Wiki/VTK/Examples/Python/Visualization/AssignColorsCellFromLUT
 """ Recreates the colour mapping to mirror the results from the EP Continuity simulation.
@@ -231,6 +191,13 @@ class vtkSliderCallback():
        self.val = 0
        self.scalarInformation = ''
        self.vsolFile = fileDir + fileName
+
+       # Frames are read from the packed run if it has been consolidated, and kept
+       # in memory with the ones either side of the slider prefetched
+       self.frameNums = set(ListVoltageSolnFrames(fileDir))
+       frameRange = (min(self.frameNums), max(self.frameNums)) if self.frameNums else None
+       self.cache = FrameCache(LoadFrameIntoMemory, cacheBudgetMB * 1024 * 1024,
+                               prefetchRadius=2, frameRange=frameRange)
    
    def execute(self,obj,event):
        sliderWidget = obj
@@ -239,11 +206,11 @@ class vtkSliderCallback():
        if int(round(sliderWidget.GetRepresentation().GetValue())) > self.val or int(round(sliderWidget.GetRepresentation().GetValue())) < self.val:
 	   self.val = int(round(sliderWidget.GetRepresentation().GetValue()))
 	   
-	   # Update Scalar Values
-	   if (self.val == 0):
-            self.scalarInformation = None
+	   # Update Scalar Values (frame 0 too, when the run wrote it, as SaveFrames does)
+	   if self.val in self.frameNums:
+	       self.scalarInformation = VoltageScalars(self.cache.Get(self.val))
 	   else:
-	       self.scalarInformation = GetVoltageSoln(self.vsolFile + "_%d.npy" % self.val)
+	       self.scalarInformation = None
 	       
 	   # Update scalar values here
 	   self.mesh.GetPointData().SetScalars(self.scalarInformation)
@@ -265,8 +232,14 @@ def init(nodesFile, elemsFile, initVsolFile):
     # Load mesh information
     polyData = Load(nodesFile, elemsFile)
     
-    # Get voltage solution data
+    # Frames are read through the slider callback's cache
+    sliderCallback = vtkSliderCallback()
+    sliderCallback.mesh = polyData
+
+    # Get voltage solution data: frame 0, where the slider starts
     scalarInformation = None
+    if 0 in sliderCallback.frameNums:
+        scalarInformation = VoltageScalars(sliderCallback.cache.Get(0))
     
     # Set scalars
     polyData.GetPointData().SetScalars(scalarInformation)
@@ -304,8 +277,6 @@ def init(nodesFile, elemsFile, initVsolFile):
     # Setup slider behaviours + enable display + interaction
     sliderWidget = vtk.vtkSliderWidget()
     sliderWidget.SetInteractor(iren)
-    sliderCallback = vtkSliderCallback()
-    sliderCallback.mesh = polyData
     sliderWidget.AddObserver("InteractionEvent", sliderCallback.execute)
     sliderWidget.SetRepresentation(sliderRep)
     sliderWidget.EnabledOn()
@@ -316,6 +287,10 @@ def init(nodesFile, elemsFile, initVsolFile):
     renWin.SetWindowName(fileDir[64:73]) # Title of the window
     iren.Start()
 
+    # Viewer closed
+    sliderCallback.cache.Close()
+    print sliderCallback.cache.Report()
+
 # pypython script fileDir fileName
 #fileDir = sys.argv[1]
 #fileName = sys.argv[2]
@@ -343,6 +318,7 @@ directoryList.append("/Users/dayakern/Desktop/4801_Testing/AFNI_Conversion/ucsd_
 directoryList.append("/Users/dayakern/Desktop/4801_Testing/AFNI_Conversion/ucsd_mri_4/24-6_sham/ContinuityFiles/Vsolns/")
 
 fileDir = directoryList[int(sys.argv[1]) - 1]
+cacheBudgetMB = float(sys.argv[2]) if len(sys.argv) > 2 else 256 # Memory for cached frames
 init(fileDir + '_NODEFILE.csv', fileDir + '_ELEMFILE.csv', fileDir + fileName)
 
 
@@ -7,102 +7,107 @@
 # Script restructured into functions + rewritten to be run from command line by Hoang
 
 import vtk
+from vtk.util import numpy_support
 import sys
 import numpy as np
 import os
-import glob
+import multiprocessing
+import argparse
+import time
+
+from mesh_io import LoadMeshArrays, BoundaryFaces, ElementFaces, HexCells
+from vsoln_io import LoadVoltageSoln, ListVoltageSolnFrames, ReadVoltageSolnFrame
+from vsoln_io import ListVoltageSolnFiles, FrameNumber, IsFrameComplete
+from vsoln_io import OpenVoltageSolnStore, StorePath
+from frame_manifest import FrameManifest, FileHash
+from run_dirs import ReadCurrentRunInfo
+
+# Only needed for the single-file VTKHDF output
+try:
+	import h5py
+except ImportError:
+	h5py = None
+
+""" Builds a vtkCellArray from a block of cells that all have the same number of points.
+cells -> C x k array of point ids
+Returns -> vtkCellArray
+"""
+def CellArray(cells):
+	# Legacy cell layout [k, id0, .., idk-1, k, ...] understood by every vtk version
+	cellData = np.empty((cells.shape[0], cells.shape[1] + 1), dtype=numpy_support.ID_TYPE_CODE)
+	cellData[:, 0] = cells.shape[1] # Number of points per cell
+	cellData[:, 1:] = cells
+
+	pDCells = vtk.vtkCellArray()
+	pDCells.SetCells(cells.shape[0], numpy_support.numpy_to_vtkIdTypeArray(cellData.ravel(), deep=1))
+	return pDCells
 
 """ Recreates a 3D mesh from data captured from the output of the Continuity EP 
 simulation. In this particular case, the mesh is a reconstruction from nodes/elements 
 information from a left ventricle heart model that was saved out.
 nodesFile -> the file where the nodes information of the heart mesh were saved
 elemsFile -> the file where the elems information of the heart mesh were saved
-Returns -> the reconstructed mesh (polyData)
+meshType -> 'surface': exterior quads of the hex mesh (polyData)
+			'faces': inner, outer and one horizontal face of every element (polyData)
+			'hex': every element as a hexahedron (unstructuredGrid)
+Returns -> the reconstructed mesh (polyData or unstructuredGrid)
 """
-def Load(nodesFile, elemsFile):
-	polyData = vtk.vtkPolyData() # Mesh to be constructed
+def Load(nodesFile, elemsFile, meshType='surface'):
 	pDPoints = vtk.vtkPoints() # Points of the mesh 
-	pDCells = vtk.vtkCellArray() # Cells of the mesh
-	LVMeshPoints = None # Nodes information for LV mesh
-	LVMeshElems = None # Elements information for LV mesh
-	
-	## Insert Coords 
-	try:
-		# Import nodes file
-		LVMeshPoints = open(nodesFile)
-		id = 0 # ID # for points
-		line = LVMeshPoints.readline() # Read the header
-			
-		for coords in LVMeshPoints:
-
-			# Get coord values by row
-			coordValues = coords.strip().split(',')
-
-			# Insert coords into points
-			pDPoints.InsertPoint(id, (float(coordValues[0]),
-																float(coordValues[1]),
-																float(coordValues[2])))
-			
-			id = id + 1 # Increment Id
-	
-	finally:
-		if LVMeshPoints is not None:
 
-			# Close opened file
-			LVMeshPoints.close()
+	# Nodes + elems as whole arrays (from the binary cache when the CSVs are unchanged)
+	LVMeshPoints, LVMeshElems = LoadMeshArrays(nodesFile, elemsFile)
 
-	# print 'Added nodes info to points'
+	## Insert Coords
+	pDPoints.SetData(numpy_support.numpy_to_vtk(LVMeshPoints.astype(np.float32), deep=1)) # vtkPoints default precision
 
 	## Insert Elems
-	try:
-		# Import elems file
-		LVMeshElems = open(elemsFile)
-
-		# Number of points per cell
-		numPoints = 4
-		line = LVMeshElems.readline() # Reading the header
-			
-		for elems in LVMeshElems:
-
-			# Get elems values by row
-			elemsValues = elems.strip().split(',')
-					
-			## Insert elems into cells   
-			# Elems need to be reordered from the Continuity format
-			# -> [hex[0],hex[1],hex[3],hex[2],hex[4],hex[5],hex[7],hex[6]]
-			# From: HEXBLENDER_OT_import_pickle(bpy.types.Operator) function
-			
-			# Inner Plane
-			pDCells.InsertNextCell(numPoints, (int(elemsValues[0]),
-																				int(elemsValues[1]),
-																				int(elemsValues[3]),
-																				int(elemsValues[2])))
-			# Outer Plane
-			pDCells.InsertNextCell(numPoints, (int(elemsValues[4]),
-																				int(elemsValues[5]),
-																				int(elemsValues[7]),
-																				int(elemsValues[6])))
-
-			# Horizontal Planes
-			pDCells.InsertNextCell(numPoints, (int(elemsValues[6]),
-																				int(elemsValues[7]),
-																				int(elemsValues[3]),
-																				int(elemsValues[2])))
-	finally:
-		if LVMeshElems is not None:
+	# Elems need to be reordered from the Continuity format
+	# -> [hex[0],hex[1],hex[3],hex[2],hex[4],hex[5],hex[7],hex[6]]
+	# From: HEXBLENDER_OT_import_pickle(bpy.types.Operator) function
+	if meshType == 'hex':
+		unstructuredGrid = vtk.vtkUnstructuredGrid() # Mesh to be constructed
+		unstructuredGrid.SetPoints(pDPoints)
+		unstructuredGrid.SetCells(vtk.VTK_HEXAHEDRON, CellArray(HexCells(LVMeshElems)))
+		return unstructuredGrid
 
-			# Close opened file
-			LVMeshElems.close()
+	if meshType == 'faces':
+		quads = ElementFaces(LVMeshElems)
+	elif meshType == 'surface':
+		quads = BoundaryFaces(LVMeshElems)
+	else:
+		raise ValueError("Unknown meshType '%s'" % meshType)
 	
 	# print 'Added elems info to cells'
 	
 	# Add points and cells to polydata
+	polyData = vtk.vtkPolyData() # Mesh to be constructed
 	polyData.SetPoints(pDPoints)
-	polyData.SetPolys(pDCells)
+	polyData.SetPolys(CellArray(quads))
 	
 	# print 'Recreation of LV Mesh completed'
 	return polyData
 
+""" Makes the XML writer that matches the type of mesh Load() returned.
+"""
+def MakeWriter(mesh):
+	if mesh.IsA('vtkUnstructuredGrid'):
+		return vtk.vtkXMLUnstructuredGridWriter()
+	return vtk.vtkXMLPolyDataWriter()
+
+""" File extension of the frames saved out for a meshType.
+"""
+def FrameExtension(meshType):
+	if meshType == 'hex':
+		return 'vtu'
+	return 'vtp'
+
+""" What the converted frames depend on besides the Vsoln values: the contents of the
+mesh CSVs and the kind of mesh built from them.
+"""
+def MeshKey(nodesFile, elemsFile, meshType):
+	return FileHash([nodesFile, elemsFile]) + '-' + meshType
+
 """ Formats the voltage solution results that were outputted from the Continuity 
 EP simulation. In this particular case, the data is cleaned up to be used as the
 scalar information to determine the colour mapping of the mesh.
@@ -110,82 +115,386 @@ filePath -> the location to the specific voltage solution data
 Returns -> Properly formatted scalar values (scalarData)  
 """  
 def GetVoltageSoln(filePath):
-	vSolns = np.load(filePath) # Location of the voltage solutions
-	vSoln = vSolns[0] # The voltage solution data
-	cleaner_data = [] # Holds the cleaned up voltage solution data
+	# Nodal values + per frame range, reshaped with array operations
+	values, minValue, maxValue = LoadVoltageSoln(filePath)
 
-	# Clean up the shape of the data [Modified from Roy's heart_reader code]
-	for i in vSoln:
-		cleaner_data.append(i[0])
-		
-	# Convert back into numpy array [From Roy's heart_reader code]         
-	cleaner_data = np.array(cleaner_data) 
+	#  print minValue, maxValue
+	return VoltageScalars(values)
 
+""" Wraps an array of nodal voltage values as the mesh's scalar information.
+values -> contiguous float64 array with one value per node
+Returns -> Properly formatted scalar values (scalarData)
+"""
+def VoltageScalars(values):
 	## Format scalar information
-	scalarData = vtk.vtkDoubleArray() # Scalar object
+	# Hands the numpy buffer straight to vtk rather than inserting each value;
+	# numpy_to_vtk keeps a reference to 'values' so the buffer stays alive
+	scalarData = numpy_support.numpy_to_vtk(values, deep=0, array_type=vtk.VTK_DOUBLE)
 	scalarData.SetName("Voltage Solution")
 
-	id = 0; # Position of data
-	minValue = 0;
-	maxValue = 0;
-
-	# Insert voltage solution values into scalar object
-	for i in cleaner_data[0]:
-		if i < minValue:
-			minValue = i
-		if i > maxValue:
-			maxValue = i
-
-		scalarData.InsertValue(id, i)
-		id = id + 1
-
-	#  print minValue, maxValue
 	return scalarData
 
-## there are probs better ways to do this, but oh well.
-def SaveFrames(fileDir, scalarInformation, mesh, pDWriter):
-	frameNum = 0
+# Where the converted .vtp frames are saved out
+outputDir = '/Users/dayakern/Desktop/_PARAVIEW_THINGS/Vsolns/'
 
-	relevantFiles = glob.glob(fileDir + 'Vsoln_testrun_*')
-
-	## Save out scalar value for 0
+""" Writes the mesh out as a single .vtp frame with the given scalar information.
+"""
+def WriteFrame(mesh, pDWriter, scalarInformation, fileName, outputDir):
+	# # Update scalar values here
 	mesh.GetPointData().SetScalars(scalarInformation)
+
+	## Save out files
 	pDWriter.SetInputData(mesh)
-	fileName = "Vsoln_testrun_0"
-	pDWriter.SetFileName('/Users/dayakern/Desktop/_PARAVIEW_THINGS/Vsolns/%s.vtp' % fileName)
+	pDWriter.SetFileName(outputDir + '%s.%s' % (fileName, pDWriter.GetDefaultFileExtension()))
 	pDWriter.SetDataModeToBinary()
 	pDWriter.Write()
-	
-	for file in relevantFiles:
-		scalarInformation = GetVoltageSoln(file)
 
-		# # Update scalar values here
-		mesh.GetPointData().SetScalars(scalarInformation)
+## there are probs better ways to do this, but oh well.
+""" Saves out every frame of a run as a .vtp file.
+frameNums -> only save these frames (0 is saved without scalars unless the run has a
+			 first frame, Vsoln_testrun.npy), all if None
+manifest -> FrameManifest to record each saved frame in, optional
+"""
+def SaveFrames(fileDir, scalarInformation, mesh, pDWriter, outputDir=outputDir, numWorkers=1,
+			   frameNums=None, manifest=None):
+	if frameNums is None:
+		frameNums = ListVoltageSolnFrames(fileDir)
+		if 0 not in frameNums:
+			frameNums.insert(0, 0)
 
-		## Save out files
-		pDWriter.SetInputData(mesh)
-		baseFileName = os.path.basename(file) # get filename without the file path
-		fileName = baseFileName[:-4] # get filename without the extension
-		pDWriter.SetFileName('/Users/dayakern/Desktop/_PARAVIEW_THINGS/Vsolns/%s.vtp' % fileName)
-		pDWriter.SetDataModeToBinary()
-		pDWriter.Write()
+	try:
+		## Save out scalar value for 0, from the run's first frame when it has one
+		if 0 in frameNums:
+			if 0 in ListVoltageSolnFrames(fileDir):
+				scalarInformation = VoltageScalars(ReadVoltageSolnFrame(fileDir, 0))
+			WriteFrame(mesh, pDWriter, scalarInformation, "Vsoln_testrun_0", outputDir)
+			if manifest is not None:
+				manifest.Record(fileDir, 0)
+		frameNums = [f for f in frameNums if f != 0]
+
+		if numWorkers > 1:
+			SaveFramesParallel(fileDir, mesh, outputDir, numWorkers, frameNums, manifest)
+		else:
+			# Frames come from the packed Vsoln_testrun.vstore when it exists
+			for frameNum in frameNums:
+				scalarInformation = VoltageScalars(ReadVoltageSolnFrame(fileDir, frameNum))
+				WriteFrame(mesh, pDWriter, scalarInformation, "Vsoln_testrun_%d" % frameNum, outputDir)
+				if manifest is not None:
+					manifest.Record(fileDir, frameNum)
+	finally:
+		# Keep whatever was converted, even if a frame failed part way through
+		if manifest is not None:
+			manifest.Save()
 
 	print('All States Saved')
 
-def init(nodesFile, elemsFile, fileDir):
-	pDWriter = vtk.vtkXMLPolyDataWriter()
-		
+## PARALLEL CONVERSION *********************************************************
+# The workers are forked from this process, so they inherit the mesh that Load()
+# built instead of each re-parsing the CSVs. vtk objects can't be pickled, so the
+# mesh is handed over through these globals rather than as a task argument.
+_workerMesh = None
+_workerWriter = None
+_workerFileDir = None
+_workerOutputDir = None
+
+def _InitWorker():
+	global _workerWriter
+	_workerWriter = MakeWriter(_workerMesh) # One writer per worker process
+
+def _ConvertFrame(frameNum):
+	values = ReadVoltageSolnFrame(_workerFileDir, frameNum)
+	WriteFrame(_workerMesh, _workerWriter, VoltageScalars(values), "Vsoln_testrun_%d" % frameNum, _workerOutputDir)
+	return frameNum
+
+""" Converts every frame (apart from 0) of a run with a pool of worker processes.
+Each frame is independent, so the output is identical to the serial loop.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+mesh -> the reconstructed mesh (polyData) from Load()
+outputDir -> where the .vtp frames are saved out
+numWorkers -> number of worker processes
+frameNums -> only convert these frames, all if None
+manifest -> FrameManifest to record each converted frame in, optional
+Returns -> the number of frames converted
+"""
+def SaveFramesParallel(fileDir, mesh, outputDir, numWorkers, frameNums=None, manifest=None):
+	global _workerMesh, _workerFileDir, _workerOutputDir
+	_workerMesh = mesh
+	_workerFileDir = fileDir
+	_workerOutputDir = outputDir
+
+	if frameNums is None:
+		frameNums = [f for f in ListVoltageSolnFrames(fileDir) if f != 0]
+
+	# Fork explicitly, spawned workers wouldn't inherit the mesh
+	if hasattr(multiprocessing, 'get_context'):
+		pool = multiprocessing.get_context('fork').Pool(numWorkers, _InitWorker)
+	else:
+		pool = multiprocessing.Pool(numWorkers, _InitWorker)
+	try:
+		chunkSize = max(1, len(frameNums) // (numWorkers * 4))
+		for frameNum in pool.imap_unordered(_ConvertFrame, frameNums, chunkSize):
+			if manifest is not None:
+				manifest.Record(fileDir, frameNum)
+	finally:
+		pool.close()
+		pool.join()
+
+	return len(frameNums)
+
+## TRANSIENT OUTPUT ************************************************************
+# Every .vtp written by SaveFrames repeats the points and polygons of the mesh even
+# though only the "Voltage Solution" scalars change. The VTKHDF format (ParaView
+# 5.12+) can store a time series where all steps share one copy of the geometry,
+# so the mesh is written once followed by one scalar block per frame. ParaView
+# opens the .vtkhdf file directly with the time slider set from the frame times.
+
+""" Pulls the points and the polygon connectivity out of the reconstructed mesh.
+mesh -> the reconstructed mesh (polyData) from Load()
+Returns -> points (N x 3), cell offsets, connectivity
+"""
+def MeshArrays(mesh):
+	points = numpy_support.vtk_to_numpy(mesh.GetPoints().GetData())
+	polys = mesh.GetPolys()
+
+	if hasattr(polys, 'GetOffsetsArray'):
+		# VTK 9+ keeps offsets and connectivity as separate arrays
+		offsets = numpy_support.vtk_to_numpy(polys.GetOffsetsArray())
+		connectivity = numpy_support.vtk_to_numpy(polys.GetConnectivityArray())
+	else:
+		# Older VTK: legacy [n, id0, .., idn-1, n, ...] layout, Load() only makes quads
+		legacy = numpy_support.vtk_to_numpy(polys.GetData()).reshape(-1, 5)
+		connectivity = legacy[:, 1:].ravel()
+		offsets = np.arange(0, len(connectivity) + 1, 4)
+
+	return points, offsets.astype(np.int64), connectivity.astype(np.int64)
+
+""" Saves every frame of a run into a single transient VTKHDF file, with the mesh
+geometry stored once and only the voltage scalars stored per frame.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+mesh -> the reconstructed mesh (polyData) from Load()
+outputPath -> the .vtkhdf file to write
+dtout -> output time step, only used when the run hasn't been packed into a store
+Returns -> the number of frames saved
+"""
+def SaveFramesVTKHDF(fileDir, mesh, outputPath, dtout=0.1):
+	if h5py is None:
+		raise ImportError('h5py is required to save frames as VTKHDF')
+	if not mesh.IsA('vtkPolyData'):
+		raise ValueError('VTKHDF output needs a surface mesh (meshType surface or faces)')
+
+	points, offsets, connectivity = MeshArrays(mesh)
+	numPoints = points.shape[0]
+	numCells = len(offsets) - 1
+
+	frameNums = ListVoltageSolnFrames(fileDir)
+	storePath = StorePath(fileDir)
+	if os.path.exists(storePath):
+		dtout = OpenVoltageSolnStore(storePath).dtout
+	numSteps = len(frameNums)
+
+	of = h5py.File(outputPath, 'w')
+	try:
+		root = of.create_group('VTKHDF')
+		root.attrs.create('Version', np.array([2, 0], dtype=np.int64))
+		root.attrs.create('Type', b'PolyData', dtype='S8')
+
+		## Geometry, written once (one part shared by every step)
+		root.create_dataset('NumberOfPoints', data=np.array([numPoints], dtype=np.int64))
+		root.create_dataset('Points', data=points.astype(np.float64))
+		for topology in ('Vertices', 'Lines', 'Polygons', 'Strips'):
+			group = root.create_group(topology)
+			if topology == 'Polygons':
+				group.create_dataset('NumberOfCells', data=np.array([numCells], dtype=np.int64))
+				group.create_dataset('NumberOfConnectivityIds', data=np.array([len(connectivity)], dtype=np.int64))
+				group.create_dataset('Offsets', data=offsets)
+				group.create_dataset('Connectivity', data=connectivity)
+			else:
+				group.create_dataset('NumberOfCells', data=np.zeros(1, dtype=np.int64))
+				group.create_dataset('NumberOfConnectivityIds', data=np.zeros(1, dtype=np.int64))
+				group.create_dataset('Offsets', data=np.zeros(1, dtype=np.int64))
+				group.create_dataset('Connectivity', data=np.zeros(0, dtype=np.int64))
+
+		## Voltage scalars, one block of numPoints values per frame
+		root.create_group('CellData')
+		root.create_group('FieldData')
+		voltage = root.create_group('PointData').create_dataset(
+			'Voltage Solution', (numSteps * numPoints,), dtype=np.float64)
+		for step, frameNum in enumerate(frameNums):
+			voltage[step * numPoints:(step + 1) * numPoints] = ReadVoltageSolnFrame(fileDir, frameNum)
+
+		## Time steps, every step points back at the same geometry
+		steps = root.create_group('Steps')
+		steps.attrs.create('NSteps', numSteps, dtype=np.int64)
+		steps.create_dataset('Values', data=np.array(frameNums, dtype=np.float64) * dtout)
+		steps.create_dataset('PartOffsets', data=np.zeros(numSteps, dtype=np.int64))
+		steps.create_dataset('NumberOfParts', data=np.ones(numSteps, dtype=np.int64))
+		steps.create_dataset('PointOffsets', data=np.zeros(numSteps, dtype=np.int64))
+		steps.create_dataset('CellOffsets', data=np.zeros((numSteps, 4), dtype=np.int64))
+		steps.create_dataset('ConnectivityIdOffsets', data=np.zeros((numSteps, 4), dtype=np.int64))
+		steps.create_group('PointDataOffsets').create_dataset(
+			'Voltage Solution', data=np.arange(numSteps, dtype=np.int64) * numPoints)
+		steps.create_group('CellDataOffsets')
+		steps.create_group('FieldDataOffsets')
+	finally:
+		of.close()
+
+	print('All States Saved')
+	return numSteps
+
+## FOLLOW MODE *****************************************************************
+# Converts frames while the EP simulation is still writing them, so post-processing
+# overlaps the simulation instead of starting after it. SintElectrophys writes into
+# a private run directory under the Continuity workDir (named in Vsolns/current_run.txt)
+# and SetupEPSimulation.py publishes everything into Vsolns/ once it finishes, so both
+# directories are watched. SetupEPSimulation.py drops the sentinel file into Vsolns/
+# after publishing.
+
+""" Watches for Vsoln frames and converts each one once its file is complete.
+fileDir -> directory the frames end up in (with trailing slash), also watched
+watchDirs -> other directories the frames are written into while the simulation runs
+			(the current run directory recorded in fileDir is watched as well)
+mesh -> the reconstructed mesh (polyData) from Load()
+outputDir -> where the .vtp frames are saved out
+expectedFrames -> stop once this many frames have been converted (frames 0..tlen/dtout, so tlen/dtout + 1)
+sentinelPath -> stop once this file exists (after converting what's left)
+pollInterval -> seconds between directory scans
+manifest -> FrameManifest to record each saved frame in, optional
+Returns -> the number of frames converted
+"""
+def FollowFrames(fileDir, watchDirs, mesh, outputDir, expectedFrames=None, sentinelPath=None,
+				 pollInterval=1.0, manifest=None):
+	pDWriter = MakeWriter(mesh)
+	converted = set()
+
+	## Save out scalar value for 0, replaced below if the run writes a first frame
+	WriteFrame(mesh, pDWriter, None, "Vsoln_testrun_0", outputDir)
+	if manifest is not None:
+		manifest.Record(fileDir, 0)
+
+	try:
+		while True:
+			# Decide before scanning, so the last scan still picks up every frame
+			# that was written before the sentinel appeared
+			finished = (sentinelPath is not None and os.path.exists(sentinelPath)) or \
+					   (expectedFrames is not None and len(converted) >= expectedFrames)
+
+			dirs = list(watchDirs)
+			offsets = {}
+			runInfo = ReadCurrentRunInfo(fileDir)
+			if runInfo is not None and runInfo['runDir'] not in dirs:
+				dirs.append(runInfo['runDir'])
+				# A resumed run numbers its frames from 0 at the checkpoint it started from
+				offsets[runInfo['runDir']] = runInfo['frameOffset'] or 0
+			for dir in dirs + [fileDir]:
+				offset = offsets.get(dir, 0)
+				for file in ListVoltageSolnFiles(dir):
+					sourceFrame = FrameNumber(file)
+					frameNum = sourceFrame + offset
+					if (offset and sourceFrame == 0) or frameNum in converted or not IsFrameComplete(file):
+						continue
+
+					try:
+						values = LoadVoltageSoln(file)[0]
+					except (IOError, OSError, ValueError):
+						continue # Moved while reading, found again in fileDir
+					WriteFrame(mesh, pDWriter, VoltageScalars(values), "Vsoln_testrun_%d" % frameNum, outputDir)
+					if manifest is not None:
+						# Recorded by the frame's values, so it still matches once the run is packed
+						manifest.Record(dir, frameNum, sourceFrame)
+
+					converted.add(frameNum)
+					print('Converted frame %d' % frameNum)
+
+			if finished:
+				break
+			time.sleep(pollInterval)
+	finally:
+		if manifest is not None:
+			manifest.Save()
+
+	print('All States Saved')
+	return len(converted)
+
+def init(nodesFile, elemsFile, fileDir, numWorkers=1, outputFormat='vtp', incremental=True,
+		 meshType='surface'):
+	# Single transient file instead of one .vtp per frame
+	if outputFormat == 'vtkhdf':
+		SaveFramesVTKHDF(fileDir, Load(nodesFile, elemsFile, meshType), outputDir + 'Vsoln_testrun.vtkhdf')
+		return
+
+	frameNums = ListVoltageSolnFrames(fileDir)
+	if 0 not in frameNums:
+		frameNums.insert(0, 0)
+
+	# Only convert frames that are missing or whose source changed since the last
+	# run; the manifest throws everything away if the mesh CSVs changed
+	manifest = FrameManifest(outputDir + 'Vsoln_testrun_manifest.json', MeshKey(nodesFile, elemsFile, meshType))
+	if incremental:
+		if manifest.meshChanged:
+			print('No manifest for this mesh, converting all frames')
+		frameNums = manifest.StaleFrames(fileDir, frameNums, outputDir, FrameExtension(meshType))
+		if len(frameNums) == 0:
+			print('All States Up To Date')
+			return
+		print('Converting %d frames' % len(frameNums))
+
 	# Load mesh information
-	polyData = Load(nodesFile, elemsFile)
+	polyData = Load(nodesFile, elemsFile, meshType)
+	pDWriter = MakeWriter(polyData)
 		
 	# Set initial scalar information
 	scalarInformation = None
 	polyData.GetPointData().SetScalars(scalarInformation)
 
 	# Save out all scalar information
-	SaveFrames(fileDir, scalarInformation, polyData, pDWriter)
+	SaveFrames(fileDir, scalarInformation, polyData, pDWriter, outputDir, numWorkers,
+			   frameNums=frameNums, manifest=manifest)
+
+""" Follow mode entry point: waits for the mesh CSVs that SetupEPSimulation.py saves
+out before the simulation starts, then converts frames as they are written.
+"""
+def initFollow(nodesFile, elemsFile, fileDir, watchDirs, expectedFrames, sentinelPath, pollInterval,
+			   meshType='surface'):
+	while not (os.path.exists(nodesFile) and os.path.exists(elemsFile)):
+		if os.path.exists(sentinelPath):
+			print('Simulation finished without saving out a mesh')
+			return
+		time.sleep(pollInterval)
+
+	manifest = FrameManifest(outputDir + 'Vsoln_testrun_manifest.json', MeshKey(nodesFile, elemsFile, meshType))
+	polyData = Load(nodesFile, elemsFile, meshType)
+	FollowFrames(fileDir, watchDirs, polyData, outputDir, expectedFrames, sentinelPath,
+				 pollInterval, manifest)
+
+if __name__ == '__main__':
+	# pypython script fileDir [numWorkers] [vtp|vtkhdf] [--full]
+	# pypython script fileDir --follow workDir [--tlen 30 --dtout 0.1]
+	parser = argparse.ArgumentParser(description='Convert Vsoln frames into .vtp files')
+	parser.add_argument('fileDir')
+	parser.add_argument('numWorkers', nargs='?', type=int, default=1)
+	parser.add_argument('outputFormat', nargs='?', default='vtp', choices=['vtp', 'vtkhdf'])
+	parser.add_argument('--mesh', default='surface', choices=['surface', 'faces', 'hex'],
+						help='exterior quads, the old three faces per element, or hexahedra (.vtu)')
+	parser.add_argument('--full', action='store_true', help='reconvert every frame, not only new/changed ones')
+	parser.add_argument('--follow', metavar='WATCHDIR', action='append',
+						help='convert frames as the simulation writes them into WATCHDIR')
+	parser.add_argument('--tlen', type=float, default=None, help='simulation length (follow mode)')
+	parser.add_argument('--dtout', type=float, default=0.1, help='output time step (follow mode)')
+	parser.add_argument('--sentinel', default=None, help='stop following once this file exists '
+						'(default: fileDir/Vsoln_testrun.done)')
+	parser.add_argument('--poll', type=float, default=1.0, help='seconds between scans (follow mode)')
+	args = parser.parse_args()
 
-# pypython script fileDir
-fileDir = sys.argv[1]
-# fileName = sys.argv[2] - no longer required
-init(fileDir + '_NODEFILE.csv', fileDir + '_ELEMFILE.csv', fileDir)
+	fileDir = args.fileDir
+	# fileName = sys.argv[2] - no longer required
+	if args.follow:
+		expectedFrames = None
+		if args.tlen is not None:
+			# Frames 0..tlen/dtout, frame 0 included
+			expectedFrames = int(round(args.tlen / args.dtout)) + 1
+		sentinelPath = args.sentinel or fileDir + 'Vsoln_testrun.done'
+		initFollow(fileDir + '_NODEFILE.csv', fileDir + '_ELEMFILE.csv', fileDir, args.follow,
+				   expectedFrames, sentinelPath, args.poll, args.mesh)
+	else:
+		init(fileDir + '_NODEFILE.csv', fileDir + '_ELEMFILE.csv', fileDir, args.numWorkers,
+			 args.outputFormat, not args.full, args.mesh)
@@ -6,10 +6,21 @@
 #************************************************************
 
 import sys
-import shutil
 import os
+import time
+import numpy as np
 from client.PrefsManager import * # Get existing working dir where vsolns are saved
 
+# Shared helpers (vsoln_io.py) sit next to this script, [4] is the script path
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[4])))
+from vsoln_io import PackVoltageSolns, StorePath
+from mesh_io import SaveMeshSidecar
+from run_dirs import NewRunId, MakeRunDir, PublishRunFiles, WriteRunManifest
+from run_dirs import WriteCurrentRun, ReadCurrentRunInfo, IsRunAlive, ClearCurrentRun, CURRENT_RUN_NAME
+from restart_io import SalvageRun, FindResumePoint, StageRestartFile, PublishResumedFrames
+from restart_io import WriteCheckpointParams, ReadCheckpointParams, ChangedParams, RemoveRunFiles
+from ep_sweep import LoadCaseConfig
+
 ################################################################################
 # MODIFIED FROM ParaViewInterface.py [convertToLists() function, line 285] &   #
 # ******cont6_template.py.txt [modified structure and code]                    #
@@ -28,34 +39,56 @@ modelDir = mDir
 inputFileName = 'EDC_fitted_trilinear_DTfit_3_mat_mod.cont6'
 modelOutputName = 'EDC_mod_EP.cont6'
 
+# Simulation parameters, defaults in ep_sweep.DEFAULT_PARAMETERS
+# [6] optional case config from ep_sweep.py that overrides them
+caseParams = LoadCaseConfig(sys.argv[6] if len(sys.argv) > 6 else None)
+f11Value = caseParams['f11Value'] # Conductivity along the fibres
+f22Value = caseParams['f22Value'] # Conductivity across the fibres (f22 and f33)
+pacedNodes = caseParams['pacedNodes'] # Zero-indexed nodes that pace the LV
+stimValue = caseParams['stimValue']
+odeStepSize = caseParams['odeStepSize']
+dtout = caseParams['dtout'] # Output time step
+tlen = caseParams['tlen'] # Simulation length
+elemsPerElem = caseParams['elemsPerElem']
+
+# A sweep case keeps everything it produces in its own directory
+if caseParams['outputDir']:
+    vSolnDir = caseParams['outputDir']
+    modelOutputPath = vSolnDir + modelOutputName
+else:
+    modelOutputPath = modelDir + modelOutputName
+
+writeMeshSidecar = True # Binary copy of the mesh CSVs (_MESHCACHE.npz) for the loaders downstream
+# Carry on from the last restart checkpoint of a run that died part way; freshRun in
+# the case config (ep_sweep.py --fresh) starts over instead
+resumeFromRestart = not caseParams['freshRun']
+
 ### PART ZERO *******************************************************************
 # Saves out element information (zero-indexed global node numbers)
 # Arguments:
 # mesh -> instance of Mesh class
 # dir -> output file directory
 # file -> output filename
-def elementOutput( mesh, dir=vSolnDir, file='_ELEMFILE.csv'):
-    output = ''
-    
+# echo -> also print the file to the console
+# Returns -> the zero-indexed elements that were saved
+def elementOutput( mesh, dir=vSolnDir, file='_ELEMFILE.csv', echo=False ):
     ## Header
-    output = 'Global_Node_1,Global_Node_2,Global_Node_3,Global_Node_4,Global_Node_5,Global_Node_6,Global_Node_7,Global_Node_8\n'
+    header = 'Global_Node_1,Global_Node_2,Global_Node_3,Global_Node_4,Global_Node_5,Global_Node_6,Global_Node_7,Global_Node_8'
     
     ## Zero-indexed elements data (for Paraview)
-    elements_array = mesh.obj.elements - 1
-
-    ## Elements
-    for i in range(len(elements_array)):
-        
-        # Global node numbers
-        elements = elements_array[i]
-        output = output + '%i,%i,%i,%i,%i,%i,%i,%i\n' % (elements[0], elements[1], elements[2], elements[3], elements[4], elements[5], elements[6], elements[7])
-
-    print output  # Output to console
-            
-    ## Write output to file
+    elements_array = np.asarray(mesh.obj.elements, dtype=np.int64)[:, :8] - 1
+
+    ## Write output to file, all elements in one pass
     f = dir + file
     of = open( f , 'w' )
-    of.write( output )
+    try:
+        np.savetxt(of, elements_array, fmt='%i', delimiter=',', header=header, comments='')
+    finally:
+        of.close()
+
+    if echo:
+        np.savetxt(sys.stdout, elements_array, fmt='%i', delimiter=',', header=header, comments='')  # Output to console
+    return elements_array
 #end def elementOutput
 
 # Saves out nodes information (x,y,z coordinates)
@@ -63,26 +96,31 @@ def elementOutput( mesh, dir=vSolnDir, file='_ELEMFILE.csv'):
 # mesh -> instance of Mesh class
 # dir -> output file directory
 # file -> output filename
-def nodeOutput( mesh, dir=vSolnDir, file='_NODEFILE.csv' ):
-    output = ''
-        
+# echo -> also print the file to the console
+# Returns -> the coordinates that were saved
+def nodeOutput( mesh, dir=vSolnDir, file='_NODEFILE.csv', echo=False ):
     ## Header
-    output = 'Coordinate_X,Coordinate_Y,Coordinate_Z\n'
+    header = 'Coordinate_X,Coordinate_Y,Coordinate_Z'
     
     ## Nodes (x,y,z coordinates of nodes)
-    for i in range(len(mesh.obj)):
-        
-        # x, y, z stored in field variable 1, 2, 3 which is stored at
-        # index 0-2, and the value is the first index of the field
-        # variable's array
-        nodeDerivs = mesh.obj.nodes[i].derivs
-        output = output + '%.9f,%.9f,%.9f\n' % (nodeDerivs[0][0], nodeDerivs[1][0], nodeDerivs[2][0])
-
-    print output  # Output to console
-    # Write output to file
+    # x, y, z stored in field variable 1, 2, 3 which is stored at
+    # index 0-2, and the value is the first index of the field
+    # variable's array
+    nodes = mesh.obj.nodes
+    coords = np.array([(nodes[i].derivs[0][0], nodes[i].derivs[1][0], nodes[i].derivs[2][0])
+                       for i in range(len(mesh.obj))], dtype=np.float64).reshape(-1, 3)
+
+    # Write output to file, all nodes in one pass
     f = dir + file
     of = open( f, 'w' )
-    of.write( output )
+    try:
+        np.savetxt(of, coords, fmt='%.9f', delimiter=',', header=header, comments='')
+    finally:
+        of.close()
+
+    if echo:
+        np.savetxt(sys.stdout, coords, fmt='%.9f', delimiter=',', header=header, comments='')  # Output to console
+    return coords
 #end def nodeOuput function
 
 ## PART ONE ********************************************************************
@@ -91,7 +129,7 @@ def nodeOutput( mesh, dir=vSolnDir, file='_NODEFILE.csv' ):
 self.Load_File(modelDir + inputFileName, log=0)
 
 # Refine mesh
-self.RefineMesh({'customXi3s':[],'autostoreBM':0,'newScaleFactor':'Arc lengths','autostore':1,'useCustoms':0,'customXi1s':[],'preserveNodeNumbers':0,'subdivide':False,'customXi2s':[],'nodesPerElem':[2, 2, 2],'intermediate':0,'doAveraging':1,'elemlist':[0],'elemsPerElem':[6, 6, 3],'convertToDegree':0,'gen_labels':[1, 1, 1, 1],'computeDerivatives':1}, log=0)
+self.RefineMesh({'customXi3s':[],'autostoreBM':0,'newScaleFactor':'Arc lengths','autostore':1,'useCustoms':0,'customXi1s':[],'preserveNodeNumbers':0,'subdivide':False,'customXi2s':[],'nodesPerElem':[2, 2, 2],'intermediate':0,'doAveraging':1,'elemlist':[0],'elemsPerElem':elemsPerElem,'convertToDegree':0,'gen_labels':[1, 1, 1, 1],'computeDerivatives':1}, log=0)
 
 # Send/Calc
 self.auto_update_dimensions()
@@ -130,22 +168,17 @@ nd.setEnabledDerivs([hderv, hderv, hderv, lderv, lderv, lderv,
                         lderv, lderv, lderv, lderv, lderv, lderv,
                         hderv, lderv, nderv, nderv, nderv, nderv])
 
-# Set the 495, 496, 501, 502 nodes to pace the LV from one spot
+# Set the pacedNodes (by default 495, 496, 501, 502) to pace the LV from one spot
 # [13] = Field Vector 3, Field Variable 8
 # [0] = 'Value' deriv
-nd.nodes[494].derivs[13][0] = 10.0
-nd.nodes[495].derivs[13][0] = 10.0
-nd.nodes[500].derivs[13][0] = 10.0
-nd.nodes[501].derivs[13][0] = 10.0
+for node in pacedNodes:
+    nd.nodes[node].derivs[13][0] = stimValue
 
 self.stored_data.store(nd, modified = True)
 
 # Set-up Conductivity
 self.Load_File({'model_id':'1277', 'username':'guest', 'password':'tests', 'keep_existing_data':True }, log=0)
 
-f11Value = 0.009
-f22Value = 0.001
-
 mat = self.stored_data.conductivityEquations.obj
 mat['variables'].setIcByName("f11",[['value', f11Value]])
 mat['variables'].setIcByName("f22",[['value', f22Value]])
@@ -160,28 +193,119 @@ self.Send(None, log=0)
 self.CalcMesh([('Calculate', None), ('Do not Calculate', None), ('Calculate', None), ('Global arc length scale factors (for nodal derivs wrt arc lengths)', None)], log=0)
 
 # Save model out with material coords
-self.Save(modelDir + modelOutputName, log=0)
+self.Save(modelOutputPath, log=0)
 
 # Save out refined mesh nodes/elems as separate files, to be used in visualisation
-elementOutput(self.stored_data.elem)
-nodeOutput(self.stored_data.nodes)
+elements = elementOutput(self.stored_data.elem)
+coords = nodeOutput(self.stored_data.nodes)
+if writeMeshSidecar:
+    SaveMeshSidecar(vSolnDir + '_NODEFILE.csv', vSolnDir + '_ELEMFILE.csv', coords, elements)
 
 ## PART FOUR *******************************************************************
-# Initialise EP Simulation
-self.SinitElectrophys(log=0)
-
-# Run Simulation, save out solutions
-# Note: TO RUN IN BATCH MODE -> renderResult = 0;
-isRendered = 0
+# The follow mode of SaveMeshAndScalarValues.py stops once this file appears
+sentinelPath = vSolnDir + 'Vsoln_testrun.done'
 outputFileName = 'testrun'
-self.SintElectrophys({'numGpuThreads':64,'odeStepSize':0.01,'plicitType':'Implicit','parallelLinearSolver':False,'solutions':{'tableResult': 0, 'counter': 10, 'writeFile': 1, 'saveSolutionFrequency': '1', 'saveRestartFrequency': '100', 'restartFile': 0, 'renderResult': isRendered},'stateVarInputSelections':[],'stateVarDoTable':0,'stateVarElemList':'all','parallelODESolver':False,'tstart':0.0,'useCuda':0,'stateVarOutputSelections':[],'serverKeyname':'electromech_exchange','useMultigpus':0,'stateVarList':'1','fileName': outputFileName,'useTrilinos':0,'aps':{'tableResult': 0, 'counter': 10, 'node_list': 'all', 'writeFile': 0, 'restartFile': 0, 'renderResult': 0},'stateVarListType':'collocation points','stateVarFrequency':1,'stateVarSelections':[],'dtout':0.1,'tlen':30.0,'reassemble_lhs':1,'ecgs':{'restartFile': 0, 'writeFile': 0, 'counter': 10, 'tableResult': 0, 'renderResult': 0}}, log=0)
+
+# What the restart files of this dataset belong to, a run only resumes from the
+# checkpoints of a run with the same parameters and input model
+checkpointParams = dict((name, value) for name, value in caseParams.items() if name not in ('outputDir', 'freshRun'))
+checkpointParams['model'] = modelDir + inputFileName
+if os.path.exists(modelDir + inputFileName):
+    checkpointParams['modelSize'] = os.path.getsize(modelDir + inputFileName)
+    checkpointParams['modelMTime'] = os.path.getmtime(modelDir + inputFileName)
+
+# A run that may still be writing into this dataset is left alone
+currentRun = ReadCurrentRunInfo(vSolnDir)
+if currentRun is not None and IsRunAlive(currentRun) is not False:
+    raise RuntimeError('Run %s (pid %s on %s) may still be writing into %s; remove %s if it is no longer running'
+                       % (currentRun['runDir'], currentRun['pid'], currentRun['host'], vSolnDir, vSolnDir + CURRENT_RUN_NAME))
+
+# No sentinel means the last run of this dataset never finished: publish what it
+# left behind and resume from its latest complete restart checkpoint
+restartPath, resumeFrame = None, 0
+if resumeFromRestart and not os.path.exists(sentinelPath):
+    savedParams = ReadCheckpointParams(vSolnDir, outputFileName)
+    if savedParams is None:
+        print 'No parameters saved with the restart files in %s, starting over' % vSolnDir
+    elif ChangedParams(savedParams, checkpointParams):
+        print 'The restart files in %s are of a run with other %s, starting over' % (vSolnDir, ', '.join(ChangedParams(savedParams, checkpointParams)))
+    else:
+        if currentRun is not None and os.path.isdir(currentRun['runDir']):
+            deadRunDir = currentRun['runDir']
+            salvaged = SalvageRun(deadRunDir, vSolnDir, os.path.basename(deadRunDir.rstrip('/')))
+            print 'Salvaged %d files from %s' % (len(salvaged), deadRunDir)
+        restartPath, resumeFrame = FindResumePoint(vSolnDir, outputFileName)
+# Starting over: the frames, store and restart files of an earlier run go first, so
+# only this run's frames are published and packed
+if restartPath is None:
+    removed = RemoveRunFiles(vSolnDir, outputFileName)
+    if removed:
+        print 'Removed %d files of an earlier run from %s' % (len(removed), vSolnDir)
+WriteCheckpointParams(vSolnDir, outputFileName, checkpointParams)
+
+if os.path.exists(sentinelPath):
+    os.remove(sentinelPath)
+
+# This run writes its solutions into a private directory under the shared workDir,
+# so simulations running at the same time don't pick up each other's files
+runId = NewRunId()
+runWorkDir = MakeRunDir(workDir, runId)
+started = time.time()
+# The shared preference is pointed back at workDir however the run ends, a later
+# script in the same Continuity session would otherwise write into this run's directory
+allPrefs['workDir']['defVal'] = runWorkDir
+try:
+    WriteCurrentRun(vSolnDir, runWorkDir, resumeFrame) # For the follow mode of SaveMeshAndScalarValues.py
+    print 'Run %s writing into %s' % (runId, runWorkDir)
+
+    tstart = 0.0
+    if restartPath is not None:
+        StageRestartFile(restartPath, runWorkDir)
+        # Frame i is the solution at t = i * dtout and restart file i was saved with
+        # frame i, so the checkpoint is at resumeFrame * dtout; tlen stays the end
+        # time of the whole simulation (see restart_io.py)
+        tstart = resumeFrame * dtout
+        print 'Resuming from %s at t = %g (frame %d)' % (restartPath, tstart, resumeFrame)
+
+    # Initialise EP Simulation
+    self.SinitElectrophys(log=0)
+
+    # Run Simulation, save out solutions
+    # Note: TO RUN IN BATCH MODE -> renderResult = 0;
+    isRendered = 0
+    # restartFile: start from the restart file staged in the run directory (resuming)
+    isRestarted = int(restartPath is not None)
+    self.SintElectrophys({'numGpuThreads':64,'odeStepSize':odeStepSize,'plicitType':'Implicit','parallelLinearSolver':False,'solutions':{'tableResult': 0, 'counter': 10, 'writeFile': 1, 'saveSolutionFrequency': '1', 'saveRestartFrequency': '100', 'restartFile': isRestarted, 'renderResult': isRendered},'stateVarInputSelections':[],'stateVarDoTable':0,'stateVarElemList':'all','parallelODESolver':False,'tstart':tstart,'useCuda':0,'stateVarOutputSelections':[],'serverKeyname':'electromech_exchange','useMultigpus':0,'stateVarList':'1','fileName': outputFileName,'useTrilinos':0,'aps':{'tableResult': 0, 'counter': 10, 'node_list': 'all', 'writeFile': 0, 'restartFile': 0, 'renderResult': 0},'stateVarListType':'collocation points','stateVarFrequency':1,'stateVarSelections':[],'dtout':dtout,'tlen':tlen,'reassemble_lhs':1,'ecgs':{'restartFile': 0, 'writeFile': 0, 'counter': 10, 'tableResult': 0, 'renderResult': 0}}, log=0)
+finally:
+    allPrefs['workDir']['defVal'] = workDir
+
+# Files in the shared workDir can't be told apart from another run's, so if the
+# solutions didn't go where the preference pointed Continuity, stop here
+if not [file for file in os.listdir(runWorkDir) if file.startswith('Vsoln')]:
+    raise RuntimeError('The simulation wrote no Vsoln files into its run directory %s (the workDir '
+                       'preference may not have taken effect); nothing was published' % runWorkDir)
 
 # Move voltage solution files to the rat data specific directory
 # Modified from http://www.pythonforbeginners.com/os/python-the-shutil-module
-print workDir
+print runWorkDir
 print vSolnDir
-for file in os.listdir(workDir):
-    if file.startswith('Vsoln') or file.startswith('restart'):
-        shutil.move(workDir + file, vSolnDir)
+if restartPath is not None:
+    # Appended after the frames that are already there, under their numbers in the whole run
+    published = PublishResumedFrames(runWorkDir, vSolnDir, runId, restartPath, resumeFrame,
+                                     int(round(tlen / dtout)), outputFileName)
+else:
+    published = PublishRunFiles(runWorkDir, vSolnDir, runId, ('Vsoln', 'restart'))
+WriteRunManifest(vSolnDir, runId, {'files': published, 'workDir': runWorkDir, 'model': modelOutputPath,
+                                   'outputFileName': outputFileName, 'dtout': dtout, 'tlen': tlen,
+                                   'resumedFrom': restartPath, 'resumeFrame': resumeFrame,
+                                   'started': started, 'published': time.time()})
+ClearCurrentRun(vSolnDir)
+
+# Pack the frames into one memory-mappable store for the readers downstream
+numFrames = PackVoltageSolns(vSolnDir, StorePath(vSolnDir, outputFileName), dtout, tlen, outputFileName)
+print 'Packed %d frames into %s' % (numFrames, StorePath(vSolnDir, outputFileName))
+
+# Every frame is in vSolnDir now, let any follow mode converter finish up
+open(sentinelPath, 'w').close()
 
 print "All Done!"
@@ -0,0 +1,149 @@
+# Builds a multiresolution pyramid of the aligned DT data, so that an averaged level
+# can be fitted instead of every 20th voxel (calc_data_coords.m's downsample). Each coarser
+# level averages the voxels falling in each cell of a voxel grid, in log tensor
+# space (the data form already holds log tensors, so it is the mean of the
+# components), and records how many voxels went into each average in the weight
+# columns so the fit can weight them accordingly.
+#
+# Input is the full resolution FieldFit3D data form (calc_data_coords.m with a down
+# sampling value of 1 writes it); it is streamed in chunks. Writes, into outDir:
+#
+# data_DT_grfl_dump_out_mask_coords_pyr<k>.txt   averaged data form of level k (k >= 1)
+# pyramid.json                                  the levels, coarsest first, the last
+#                                               one being the full resolution input
+#
+# python data_pyramid.py data_DT_grfl_dump_out_mask_coords1.txt outDir [numLevels] [cellSize]
+
+import os
+import sys
+import json
+import itertools
+
+import numpy as np
+
+PYRAMID_NAME = 'pyramid.json'
+LEVEL_FILE = 'data_DT_grfl_dump_out_mask_coords_pyr%d.txt'
+DATA_HEADER = ('coord1_val\tcoord1_weight\tcoord2_val\tcoord2_weight\tcoord3_val\tcoord3_weight\t'
+               'dxx_val\tdyy_val\tdzz_val\tdxy_val\tdxz_val\tdyz_val\tData')
+# Bits per axis of the packed cell index
+CELL_BITS = 21
+
+""" Reads a data form in blocks of rows, so the full resolution data never has to
+be in memory at once.
+Returns -> generator of arrays (rows x 13)
+"""
+def DataChunks(dataFile, chunkRows=1 << 20):
+    f = open(dataFile)
+    try:
+        f.readline() # Header
+        while True:
+            lines = list(itertools.islice(f, chunkRows))
+            if not lines:
+                break
+            yield np.loadtxt(lines, ndmin=2, dtype=np.float64)
+    finally:
+        f.close()
+
+""" Sums the rows of a chunk per grid cell.
+coords -> N x 3
+columns -> N x k values to sum (the voxel count included)
+Returns -> sorted packed cell keys, sums per cell (cells x k)
+"""
+def CellSums(coords, origin, cellSize, columns):
+    ijk = np.floor((coords - origin) / cellSize).astype(np.int64)
+    keys = (ijk[:, 0] << (2 * CELL_BITS)) | (ijk[:, 1] << CELL_BITS) | ijk[:, 2]
+    cellKeys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.zeros((len(cellKeys), columns.shape[1]))
+    np.add.at(sums, inverse.ravel(), columns)
+    return cellKeys, sums
+
+""" Merges two sets of cell sums.
+"""
+def MergeCellSums(keysA, sumsA, keysB, sumsB):
+    keys, inverse = np.unique(np.concatenate([keysA, keysB]), return_inverse=True)
+    sums = np.zeros((len(keys), sumsA.shape[1]))
+    np.add.at(sums, inverse.ravel(), np.concatenate([sumsA, sumsB]))
+    return keys, sums
+
+""" Saves averaged cells as a data form: mean coordinates, the number of voxels
+averaged as the weights, mean log tensor components, data numbers from 1.
+Written via a temporary file.
+"""
+def WriteLevel(filePath, sums):
+    counts = sums[:, -1:]
+    means = sums[:, :-1] / counts
+    n = len(sums)
+    table = np.column_stack([means[:, 0], counts[:, 0], means[:, 1], counts[:, 0], means[:, 2], counts[:, 0],
+                             means[:, 3:9], np.arange(1, n + 1)])
+    of = open(filePath + '.part', 'w')
+    try:
+        np.savetxt(of, table, fmt=['%.9g'] * 12 + ['%d'], delimiter='\t', header=DATA_HEADER, comments='')
+    finally:
+        of.close()
+    os.rename(filePath + '.part', filePath)
+
+""" Builds the pyramid.
+dataFile -> full resolution data form
+outDir -> where the levels and pyramid.json go (with trailing slash)
+numLevels -> number of levels, the full resolution one included
+cellSize -> cell size of level 1 (doubling with every level after it); by default
+            twice the mean voxel spacing, from the data's bounding box and count
+Returns -> the pyramid levels, coarsest first
+"""
+def BuildPyramid(dataFile, outDir, numLevels=3, cellSize=None, chunkRows=1 << 20):
+    # First pass: extent and number of voxels
+    lo, hi, numPoints = np.full(3, np.inf), np.full(3, -np.inf), 0
+    for chunk in DataChunks(dataFile, chunkRows):
+        coords = chunk[:, [0, 2, 4]]
+        lo, hi = np.minimum(lo, coords.min(axis=0)), np.maximum(hi, coords.max(axis=0))
+        numPoints += len(chunk)
+    if cellSize is None:
+        spacing = (np.prod(np.maximum(hi - lo, 1e-12)) / numPoints) ** (1.0 / 3)
+        cellSize = 2.0 * spacing
+    cellSizes = [cellSize * 2 ** k for k in range(numLevels - 1)]
+    if max(np.max(np.floor((hi - lo) / min(cellSizes))), 0) >= 1 << CELL_BITS:
+        raise ValueError('Cell size %g too small for the extent of the data' % min(cellSizes))
+
+    # Second pass: every level's cell sums at once
+    cells = [None] * len(cellSizes)
+    for chunk in DataChunks(dataFile, chunkRows):
+        coords = chunk[:, [0, 2, 4]]
+        columns = np.column_stack([coords, chunk[:, 6:12], np.ones(len(chunk))])
+        for k, size in enumerate(cellSizes):
+            keys, sums = CellSums(coords, lo, size, columns)
+            cells[k] = (keys, sums) if cells[k] is None else MergeCellSums(cells[k][0], cells[k][1], keys, sums)
+
+    levels = [{'level': 0, 'cellSize': None, 'points': numPoints, 'dataFile': os.path.abspath(dataFile)}]
+    for k, size in enumerate(cellSizes):
+        filePath = outDir + LEVEL_FILE % (k + 1)
+        WriteLevel(filePath, cells[k][1])
+        levels.append({'level': k + 1, 'cellSize': size, 'points': len(cells[k][0]), 'dataFile': filePath})
+    levels.reverse()
+
+    of = open(outDir + PYRAMID_NAME + '.part', 'w')
+    try:
+        json.dump({'source': os.path.abspath(dataFile), 'levels': levels}, of, indent=1)
+    finally:
+        of.close()
+    os.rename(outDir + PYRAMID_NAME + '.part', outDir + PYRAMID_NAME)
+    return levels
+
+""" Reads pyramid.json.
+Returns -> the levels, coarsest first (dicts of level, cellSize, points, dataFile)
+"""
+def LoadPyramid(pyramidPath):
+    f = open(pyramidPath)
+    try:
+        return json.load(f)['levels']
+    finally:
+        f.close()
+
+if __name__ == '__main__':
+    outDir = os.path.join(sys.argv[2], '')
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    numLevels = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    cellSize = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    for level in BuildPyramid(sys.argv[1], outDir, numLevels, cellSize):
+        print('level %d: %d points%s' % (level['level'], level['points'],
+                                         ', cells of %.4g' % level['cellSize'] if level['cellSize'] else ''))
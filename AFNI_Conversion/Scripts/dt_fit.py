@@ -0,0 +1,383 @@
+# Fits the six log diffusion tensor components (dxx, dyy, dzz, dxy, dxz, dyz) onto
+# trilinear nodal fields with numpy/scipy, instead of running Continuity's FitData
+# once per smoothing weight in FieldFit3D.py.
+#
+# With the xi of every data point fixed by the xi table the fit is linear least
+# squares: minimise |A u - d|^2 + weight * u'S u, where A holds the trilinear basis
+# values of each data point (one row per point, 8 non-zeros) and S is the smoothing
+# penalty, the integral over each element of the squared first and cross xi
+# derivatives of the field (the 9 Sobolev terms FieldFit3D.py weights in EWeights;
+# the pure second derivatives of a trilinear field are zero). S is integrated over the
+# unit xi cube of each element, without scale factors or element size; whether a
+# weight means the same as in Continuity's FitData is to be checked with
+# FieldFit3D.py's fitEngine = 'both'. A'A, S and A'd are
+# assembled once, then each weight costs one sparse factorisation of A'A + weight S,
+# solved for all six components together.
+#
+# The smoothing weight can also be chosen from the data (SelectDTWeight) by
+# generalised cross validation or the corner of the L-curve. One generalised
+# eigendecomposition of (A'A, A'A + S) diagonalises the system for every weight at
+# once, so scoring a whole range of weights costs about as much as a single fit.
+#
+# Or fitted on an averaged level of a data pyramid (data_pyramid.py, FitDTLevel)
+# instead of every 20th voxel: the xi of the level's points are found with the xi
+# engine and each point is weighted by the number of voxels averaged into it.
+#
+# python dt_fit.py _NODEFILE.csv _ELEMFILE.csv data_DT_grfl_dump_out_mask_coords20.txt XiTable.txt outDir [weight ...]
+# python dt_fit.py _NODEFILE.csv _ELEMFILE.csv data_DT_grfl_dump_out_mask_coords20.txt XiTable.txt outDir --select [gcv|lcurve]
+# python dt_fit.py _NODEFILE.csv _ELEMFILE.csv data_DT_grfl_dump_out_mask_coords_pyr1.txt outDir --level [weight ...]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from mesh_io import LoadMeshArrays
+from xi_engine import CORNER_XI, ReadXiTable, FindXis
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+    import scipy.linalg
+except ImportError: # Falls back to dense matrices, fine for the coarse fitting meshes
+    scipy = None
+
+FIELD_NAMES = ['dxx', 'dyy', 'dzz', 'dxy', 'dxz', 'dyz']
+# Smoothing terms in the order of EWeights' smoothing values: d/dxi1, d/dxi2, d/dxi3,
+# d2/dxi1^2, d2/dxi2^2, d2/dxi3^2, d2/dxi1dxi2, d2/dxi1dxi3, d2/dxi2dxi3
+SMOOTHING_TERMS = [(0,), (1,), (2,), (0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2)]
+
+""" Reads the FieldFit3D data form (coord1_val, coord1_weight, coord2_val,
+coord2_weight, coord3_val, coord3_weight, dxx..dyz, Data; one header line).
+Returns -> data point numbers (N), tensor components (N x 6)
+"""
+def LoadFitData(dataFile):
+    data = np.loadtxt(dataFile, skiprows=1, usecols=range(6, 13), ndmin=2, dtype=np.float64)
+    return data[:, 6].astype(np.int64), data[:, :6]
+
+""" Values of the 8 trilinear basis functions at each xi (N x 3).
+Returns -> N x 8, in Continuity's local node order
+"""
+def TrilinearBasis(xis):
+    return np.where(CORNER_XI[None] > 0, xis[:, None, :], 1.0 - xis[:, None, :]).prod(axis=2)
+
+""" A derivative of the 8 trilinear basis functions at one xi.
+dirs -> the xi directions to differentiate in, e.g. (0,) or (0, 2)
+Returns -> 8 values
+"""
+def BasisDerivative(xi, dirs):
+    result = np.ones(8)
+    for d in range(3):
+        n = dirs.count(d)
+        if n == 0:
+            result *= np.where(CORNER_XI[:, d] > 0, xi[d], 1.0 - xi[d])
+        elif n == 1:
+            result *= 2.0 * CORNER_XI[:, d] - 1.0
+        else: # Linear in each direction
+            result *= 0.0
+    return result
+
+""" The smoothing penalty of one element in xi space, integrated with 2 point Gauss
+quadrature in each direction (exact for trilinear fields).
+termWeights -> weight of each of the SMOOTHING_TERMS
+Returns -> 8 x 8 matrix
+"""
+def ElementSmoothingMatrix(termWeights):
+    gauss = [0.5 - 0.5 / np.sqrt(3.0), 0.5 + 0.5 / np.sqrt(3.0)]
+    K = np.zeros((8, 8))
+    for g1 in gauss:
+        for g2 in gauss:
+            for g3 in gauss:
+                for dirs, w in zip(SMOOTHING_TERMS, termWeights):
+                    if w:
+                        dN = BasisDerivative((g1, g2, g3), dirs)
+                        K += 0.125 * w * np.outer(dN, dN)
+    return K
+
+""" Adds up per element 8 x 8 blocks into a global matrix, sparse with scipy and
+dense without it.
+"""
+def AssembleBlocks(nodeIdx, blocks, numNodes):
+    rows = np.repeat(nodeIdx, 8, axis=1).ravel()
+    cols = np.tile(nodeIdx, (1, 8)).ravel()
+    if scipy is not None:
+        return scipy.sparse.coo_matrix((blocks.ravel(), (rows, cols)), shape=(numNodes, numNodes)).tocsc()
+    M = np.zeros((numNodes, numNodes))
+    np.add.at(M, (rows, cols), blocks.ravel())
+    return M
+
+""" Assembles what every fit shares: the normal matrix A'A, the right hand sides A'd
+and the smoothing matrix S.
+elements -> zero-indexed node numbers per element (E x 8)
+numNodes -> number of mesh nodes
+pointElems -> zero-indexed element of each data point (N)
+pointXis -> xi of each data point (N x 3)
+values -> data values (N x k)
+termWeights -> weight of each of the SMOOTHING_TERMS in S
+chunkSize -> data points added up at once without scipy, bounds the memory used
+pointWeights -> least squares weight of each data point (N), 1 by default
+Returns -> A'A, A'd (numNodes x k), S
+"""
+def AssembleFit(elements, numNodes, pointElems, pointXis, values, termWeights=(1.0,) * 9, chunkSize=1 << 16,
+                pointWeights=None):
+    pointNodes = elements[pointElems]
+    basis = TrilinearBasis(pointXis)
+    weighted = basis if pointWeights is None else basis * np.asarray(pointWeights, dtype=np.float64)[:, None]
+    if scipy is not None:
+        # The design matrix, 8 basis values per data point (and W A with point weights)
+        indptr = np.arange(0, 8 * len(basis) + 1, 8)
+        A = scipy.sparse.csr_matrix((basis.ravel(), pointNodes.ravel(), indptr), shape=(len(basis), numNodes))
+        WA = A if pointWeights is None else \
+            scipy.sparse.csr_matrix((weighted.ravel(), pointNodes.ravel(), indptr), shape=(len(basis), numNodes))
+        AtA = (A.T * WA).tocsc()
+        Atd = WA.T * values
+    else:
+        AtA = np.zeros((numNodes, numNodes))
+        Atd = np.zeros((numNodes, values.shape[1]))
+        for start in range(0, len(basis), chunkSize):
+            b, n, v = basis[start:start + chunkSize], pointNodes[start:start + chunkSize], values[start:start + chunkSize]
+            wb = weighted[start:start + chunkSize]
+            np.add.at(AtA, (np.repeat(n, 8, axis=1).ravel(), np.tile(n, (1, 8)).ravel()),
+                      (wb[:, :, None] * b[:, None, :]).ravel())
+            np.add.at(Atd, n.ravel(), (wb[:, :, None] * v[:, None, :]).reshape(-1, values.shape[1]))
+
+    K = ElementSmoothingMatrix(termWeights)
+    S = AssembleBlocks(elements, np.tile(K, (len(elements), 1, 1)), numNodes)
+    return AtA, Atd, S
+
+""" Solves the fit for each smoothing weight, all components at once.
+Returns -> list of nodal values (numNodes x k), one per weight
+"""
+def SolveFits(AtA, Atd, S, weights):
+    results = []
+    for weight in weights:
+        M = AtA + weight * S
+        if scipy is not None:
+            results.append(scipy.sparse.linalg.splu(M.tocsc()).solve(Atd))
+        else:
+            results.append(np.linalg.solve(M, Atd))
+    return results
+
+""" Interpolates nodal fields (M x k) at points given by element and xi.
+Returns -> N x k
+"""
+def EvaluateFields(nodalValues, elements, pointElems, pointXis):
+    basis = TrilinearBasis(pointXis)
+    pointNodes = elements[pointElems]
+    result = np.zeros((len(pointXis), nodalValues.shape[1]))
+    for a in range(8):
+        result += basis[:, a, None] * nodalValues[pointNodes[:, a]]
+    return result
+
+""" Reads the data points and their xi, leaving out the data points without an xi
+(outside the mesh), as with ignorePoints.
+dataFile -> FieldFit3D data form (data_DT_grfl_dump_out_mask_coords<ds>.txt)
+xiPath -> the xi table of the data points (from CalcXis.py), its columns found by
+          their header names where it has them (ReadXiTable)
+Returns -> zero-indexed element (N), xi (N x 3) and tensor components (N x 6) of each point
+"""
+def LoadFitPoints(dataFile, xiPath):
+    dataNumbers, values = LoadFitData(dataFile)
+    xiData, xiElems, xis = ReadXiTable(xiPath)
+
+    sorter = np.argsort(dataNumbers)
+    pos = np.minimum(np.searchsorted(dataNumbers, xiData, sorter=sorter), len(sorter) - 1)
+    keep = dataNumbers[sorter[pos]] == xiData
+    return xiElems[keep] - 1, xis[keep], values[sorter[pos[keep]]]
+
+""" Fits the DT components for each smoothing weight.
+nodes -> node coordinates (M x 3), only their number is used
+elements -> zero-indexed node numbers per element (E x 8)
+dataFile -> FieldFit3D data form (data_DT_grfl_dump_out_mask_coords<ds>.txt)
+xiPath -> the xi table of the data points (from CalcXis.py)
+weights -> smoothing weights, one fit each
+Returns -> list of nodal values (M x 6) per weight, RMS residual per weight, number of data points used
+"""
+def FitDTFields(nodes, elements, dataFile, xiPath, weights, termWeights=(1.0,) * 9):
+    pointElems, pointXis, pointValues = LoadFitPoints(dataFile, xiPath)
+    elements = np.asarray(elements, dtype=np.int64)
+    AtA, Atd, S = AssembleFit(elements, len(nodes), pointElems, pointXis, pointValues, termWeights)
+    fits = SolveFits(AtA, Atd, S, weights)
+
+    rms = [np.sqrt(np.mean((EvaluateFields(fit, elements, pointElems, pointXis) - pointValues) ** 2)) for fit in fits]
+    return fits, rms, len(pointElems)
+
+## PYRAMID LEVELS **************************************************************
+
+""" Reads a data form with its coordinates, e.g. a level of a data pyramid, where the
+coordinate weight is the number of voxels averaged into each point.
+Returns -> coordinates (N x 3), weights (N), tensor components (N x 6)
+"""
+def LoadLevelData(dataFile):
+    data = np.loadtxt(dataFile, skiprows=1, usecols=range(12), ndmin=2, dtype=np.float64)
+    return data[:, [0, 2, 4]], data[:, 1], data[:, 6:12]
+
+""" Fits the DT components to an averaged level of a data pyramid for each smoothing
+weight. The xi of the points are found with the xi engine, points outside the mesh
+are left out, and each point is weighted by the number of voxels averaged into it.
+nodes -> node coordinates (M x 3)
+elements -> zero-indexed node numbers per element (E x 8)
+dataFile -> the level's data form (data_pyramid.py)
+Returns -> list of nodal values (M x 6) per weight, RMS residual per weight, number of points fitted
+"""
+def FitDTLevel(nodes, elements, dataFile, weights, termWeights=(1.0,) * 9):
+    nodes = np.asarray(nodes, dtype=np.float64)
+    elements = np.asarray(elements, dtype=np.int64)
+    coords, pointWeights, values = LoadLevelData(dataFile)
+    pointElems, pointXis = FindXis(nodes, elements, coords)
+    inside = pointElems >= 0
+    pointElems, pointXis, values = pointElems[inside], pointXis[inside], values[inside]
+    AtA, Atd, S = AssembleFit(elements, len(nodes), pointElems, pointXis, values, termWeights,
+                              pointWeights=pointWeights[inside])
+    fits = SolveFits(AtA, Atd, S, weights)
+
+    rms = [np.sqrt(np.mean((EvaluateFields(fit, elements, pointElems, pointXis) - values) ** 2)) for fit in fits]
+    return fits, rms, len(pointElems)
+
+## WEIGHT SELECTION ************************************************************
+
+""" Diagonalises the fit for every weight at once: finds V with V'(A'A + S)V = I and
+V'A'A V = diag(gamma), so that A'A + weight S = V^-T diag(gamma + weight (1 - gamma)) V^-1.
+Dense, which is fine for the coarse fitting meshes.
+Returns -> gamma (M), V (M x M)
+"""
+def WeightSpectrum(AtA, S):
+    G = AtA.toarray() if hasattr(AtA, 'toarray') else np.asarray(AtA)
+    B = G + (S.toarray() if hasattr(S, 'toarray') else np.asarray(S))
+    if scipy is not None:
+        gamma, V = scipy.linalg.eigh(G, B)
+    else:
+        Linv = np.linalg.inv(np.linalg.cholesky(B))
+        gamma, W = np.linalg.eigh(Linv.dot(G).dot(Linv.T))
+        V = Linv.T.dot(W)
+    return np.clip(gamma, 0.0, 1.0), V
+
+""" Scores a range of smoothing weights from the assembled system, without solving
+the fit for any of them.
+AtA, Atd, S -> from AssembleFit
+dtd -> sum of the squared data values per component (k)
+numPoints -> number of data points
+weights -> the smoothing weights to score
+method -> 'gcv' (generalised cross validation, lowest score wins) or 'lcurve'
+          (corner of log residual against log penalty, highest curvature wins)
+Returns -> dict of 'weights', 'score' per weight, 'rss' and 'penalty' (weights x k),
+           'trace' (effective number of parameters per weight), 'chosen' (the weight),
+           'componentChoices' (the weight each component on its own would get, GCV only)
+"""
+def ScoreWeights(AtA, Atd, S, dtd, numPoints, weights, method='gcv'):
+    gamma, V = WeightSpectrum(AtA, S)
+    c2 = V.T.dot(Atd) ** 2 # Right hand sides in the diagonal basis, squared
+
+    weights = np.asarray(weights, dtype=np.float64)
+    rss = np.empty((len(weights), Atd.shape[1]))
+    penalty = np.empty_like(rss)
+    trace = np.empty(len(weights))
+    for i, weight in enumerate(weights):
+        den = np.maximum(gamma + weight * (1.0 - gamma), 1e-300)
+        # u = V diag(1/den) V'A'd: |Au - d|^2 = d'd - 2 u'A'd + u'A'Au, u'Su the penalty
+        rss[i] = dtd - 2.0 * (c2 / den[:, None]).sum(axis=0) + ((gamma / den ** 2)[:, None] * c2).sum(axis=0)
+        penalty[i] = (((1.0 - gamma) / den ** 2)[:, None] * c2).sum(axis=0)
+        trace[i] = (gamma / den).sum()
+    rss = np.maximum(rss, 0.0)
+
+    result = {'weights': weights, 'rss': rss, 'penalty': penalty, 'trace': trace, 'componentChoices': None}
+    if method == 'gcv':
+        dof = np.maximum(numPoints - trace, 1e-12) ** 2
+        result['score'] = numPoints * rss.sum(axis=1) / dof
+        result['chosen'] = weights[np.argmin(result['score'])]
+        result['componentChoices'] = weights[np.argmin(numPoints * rss / dof[:, None], axis=0)]
+    elif method == 'lcurve':
+        if len(weights) < 3:
+            raise ValueError('The L-curve needs at least 3 weights')
+        t = np.log(weights)
+        x, y = np.log(rss.sum(axis=1) + 1e-300), np.log(penalty.sum(axis=1) + 1e-300)
+        dx, dy = np.gradient(x, t), np.gradient(y, t)
+        ddx, ddy = np.gradient(dx, t), np.gradient(dy, t)
+        result['score'] = (dx * ddy - ddx * dy) / np.maximum(dx ** 2 + dy ** 2, 1e-300) ** 1.5
+        result['chosen'] = weights[np.argmax(result['score'])]
+    else:
+        raise ValueError("Unknown weight selection method '%s'" % method)
+    return result
+
+""" Chooses the smoothing weight for the DT fit from the data.
+nodes, elements, dataFile, xiPath -> as for FitDTFields
+weights -> the smoothing weights to choose from (default 10^-2 .. 10^4)
+method -> 'gcv' or 'lcurve', see ScoreWeights
+Returns -> the ScoreWeights result, plus 'rms' (RMS residual per component at the
+           chosen weight) and 'numPoints'
+"""
+def SelectDTWeight(nodes, elements, dataFile, xiPath, weights=None, method='gcv', termWeights=(1.0,) * 9):
+    if weights is None:
+        weights = np.logspace(-2, 4, 31)
+    pointElems, pointXis, pointValues = LoadFitPoints(dataFile, xiPath)
+    AtA, Atd, S = AssembleFit(np.asarray(elements, dtype=np.int64), len(nodes), pointElems, pointXis,
+                              pointValues, termWeights)
+    result = ScoreWeights(AtA, Atd, S, (pointValues ** 2).sum(axis=0), len(pointValues), weights, method)
+    chosen = list(result['weights']).index(result['chosen'])
+    result['rms'] = np.sqrt(result['rss'][chosen] / len(pointValues))
+    result['numPoints'] = len(pointValues)
+    return result
+
+""" Saves the score of every weight as CSV, with the residual sum of squares and
+penalty per component (via a temporary file).
+"""
+def WriteWeightScores(filePath, result, names=FIELD_NAMES):
+    table = np.column_stack([result['weights'], result['score'], result['trace'], result['rss'], result['penalty']])
+    header = ','.join(['weight', 'score', 'trace'] + ['rss_' + n for n in names] + ['penalty_' + n for n in names])
+    of = open(filePath + '.part', 'w')
+    try:
+        np.savetxt(of, table, fmt='%.9e', delimiter=',', header=header, comments='')
+    finally:
+        of.close()
+    os.rename(filePath + '.part', filePath)
+
+""" Returns -> a summary of the chosen weight and its per component residuals
+"""
+def WeightReport(result, method='gcv', names=FIELD_NAMES):
+    lines = ['%s chose smoothing weight %g (from %d weights, %g to %g, %d data points)'
+             % (method.upper(), result['chosen'], len(result['weights']), result['weights'].min(),
+                result['weights'].max(), result['numPoints'])]
+    for k, name in enumerate(names):
+        line = '  %s: RMS residual %.4g' % (name, result['rms'][k])
+        if result['componentChoices'] is not None:
+            line += ', best weight on its own %g' % result['componentChoices'][k]
+        lines.append(line)
+    return '\n'.join(lines)
+
+""" Saves nodal field values as CSV, one row per node (via a temporary file).
+"""
+def WriteNodalFields(filePath, values, names=FIELD_NAMES):
+    of = open(filePath + '.part', 'w')
+    try:
+        np.savetxt(of, values, fmt='%.9e', delimiter=',', header=','.join(names), comments='')
+    finally:
+        of.close()
+    os.rename(filePath + '.part', filePath)
+
+""" Reads nodal field values saved by WriteNodalFields.
+"""
+def ReadNodalFields(filePath):
+    return np.loadtxt(filePath, delimiter=',', skiprows=1, ndmin=2, dtype=np.float64)
+
+if __name__ == '__main__':
+    nodes, elements = LoadMeshArrays(sys.argv[1], sys.argv[2])
+    level = len(sys.argv) > 5 and sys.argv[5] == '--level'
+    outDir = os.path.join(sys.argv[4] if level else sys.argv[5], '')
+    start = time.time()
+    if len(sys.argv) > 6 and sys.argv[6] == '--select':
+        method = sys.argv[7] if len(sys.argv) > 7 else 'gcv'
+        result = SelectDTWeight(nodes, elements, sys.argv[3], sys.argv[4], method=method)
+        WriteWeightScores(outDir + 'dt_fit_weights.csv', result)
+        print(WeightReport(result, method))
+        print('%d weights scored in %.2fs' % (len(result['weights']), time.time() - start))
+    else:
+        weights = [float(w) for w in sys.argv[6:]] or [100.0, 50.0, 10.0]
+        if level:
+            fits, rms, numPoints = FitDTLevel(nodes, elements, sys.argv[3], weights)
+        else:
+            fits, rms, numPoints = FitDTFields(nodes, elements, sys.argv[3], sys.argv[4], weights)
+        for j, (weight, fit) in enumerate(zip(weights, fits)):
+            WriteNodalFields(outDir + 'dt_fit_%d.csv' % (j + 1), fit)
+            print('weight %g: RMS residual %.4g' % (weight, rms[j]))
+        print('%d data points fitted for %d weights in %.2fs' % (numPoints, len(weights), time.time() - start))
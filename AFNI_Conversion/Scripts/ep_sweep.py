@@ -0,0 +1,267 @@
+# Parameter sweeps of the EP simulation. Generates a case per parameter combination
+# (a full grid or a random sample), writes each case's parameters out as a JSON
+# config, and runs SetupEPSimulation.py on every case as a Continuity batch job
+# from a bounded pool of local processes. Each case gets its own directory:
+#
+# sweepDir/case_000/config.json   parameters SetupEPSimulation.py reads ([6])
+# sweepDir/case_000/log.txt       Continuity's output
+# sweepDir/case_000/Vsolns/       mesh CSVs, frames and the model of the case
+#
+# and the outcome of every case is collected into sweepDir/index.json (+ .csv).
+#
+# python ep_sweep.py mDir sweepDir --grid grid.json [--workers 4]
+# python ep_sweep.py mDir sweepDir --random ranges.json --samples 20 [--seed 1]
+#
+# grid.json lists the values to try per parameter, e.g.
+#   {"f11Value": [0.006, 0.009, 0.012], "tlen": [10.0]}
+# ranges.json gives [low, high] to sample uniformly from, or {"choices": [...]}, e.g.
+#   {"f11Value": [0.005, 0.015], "pacedNodes": {"choices": [[494, 495], [500, 501]]}}
+#
+# Rerunning a sweep into the same sweepDir resumes cases that died part way from
+# their restart files; --fresh starts every case over.
+#
+# --continuity 'python /path/to/fake_continuity.py' runs the sweep without Continuity
+# (jobs run inside their case directory, so give it an absolute path).
+
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import argparse
+import itertools
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from vsoln_io import ListVoltageSolnFiles
+
+# Parameters SetupEPSimulation.py runs with, unless a case config overrides them
+DEFAULT_PARAMETERS = {
+    'f11Value': 0.009, # Conductivity along the fibres
+    'f22Value': 0.001, # Conductivity across the fibres (f22 and f33)
+    'pacedNodes': [494, 495, 500, 501], # Zero-indexed nodes that pace the LV
+    'stimValue': 10.0, # Stimulus field value at the paced nodes
+    'odeStepSize': 0.01,
+    'dtout': 0.1, # Output time step
+    'tlen': 30.0, # Simulation length
+    'elemsPerElem': [6, 6, 3], # Refinement of the fitted mesh
+    'outputDir': None, # Where the case's files go (None: the dataset's Vsolns/)
+    'freshRun': False, # Start over instead of resuming from the restart files already there
+}
+
+INDEX_FIELDS = ['case', 'status', 'returncode', 'seconds', 'peakRSSMB', 'frames', 'outputMB', 'outputDir']
+
+""" Reads a case config written by WriteCaseConfigs.
+configPath -> the config.json of a case, None for the defaults
+Returns -> DEFAULT_PARAMETERS updated with the case's parameters
+"""
+def LoadCaseConfig(configPath=None):
+    params = dict(DEFAULT_PARAMETERS)
+    if configPath:
+        f = open(configPath)
+        try:
+            config = json.load(f)
+        finally:
+            f.close()
+        unknown = set(config) - set(DEFAULT_PARAMETERS)
+        if unknown:
+            raise ValueError('Unknown EP parameters in %s: %s' % (configPath, ', '.join(sorted(unknown))))
+        params.update(config)
+    return params
+
+""" Every combination of the values in a grid.
+grid -> parameter name -> list of values to try
+Returns -> list of cases (parameter name -> value)
+"""
+def GridCases(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+""" A random sample of cases.
+ranges -> parameter name -> [low, high] (uniform), {'choices': [...]}, or a fixed value
+numCases -> number of cases to draw
+seed -> random seed, so a sweep can be regenerated
+Returns -> list of cases (parameter name -> value)
+"""
+def RandomCases(ranges, numCases, seed=None):
+    rng = random.Random(seed)
+    cases = []
+    for i in range(numCases):
+        case = {}
+        for name in sorted(ranges):
+            spec = ranges[name]
+            if isinstance(spec, dict):
+                case[name] = rng.choice(spec['choices'])
+            elif isinstance(spec, list) and len(spec) == 2 and all(isinstance(v, (int, float)) for v in spec):
+                case[name] = rng.uniform(spec[0], spec[1])
+            else:
+                case[name] = spec
+        cases.append(case)
+    return cases
+
+""" Creates a directory per case with its config.json.
+sweepDir -> directory of the sweep (with trailing slash)
+cases -> list of cases from GridCases/RandomCases
+freshRun -> start every case over, even where an earlier sweep left restart files
+Returns -> list of (case name, case directory)
+"""
+def WriteCaseConfigs(sweepDir, cases, freshRun=False):
+    caseDirs = []
+    for i, case in enumerate(cases):
+        name = 'case_%03d' % i
+        caseDir = sweepDir + name + '/'
+        config = dict(case)
+        config['outputDir'] = caseDir + 'Vsolns/'
+        if freshRun:
+            config['freshRun'] = True
+        # Fail before anything runs rather than in every Continuity job
+        unknown = set(config) - set(DEFAULT_PARAMETERS)
+        if unknown:
+            raise ValueError('Unknown EP parameters: %s' % ', '.join(sorted(unknown)))
+
+        if not os.path.isdir(config['outputDir']):
+            os.makedirs(config['outputDir'])
+        of = open(caseDir + 'config.json', 'w')
+        try:
+            json.dump(config, of, indent=1, sort_keys=True)
+        finally:
+            of.close()
+        caseDirs.append((name, caseDir))
+    return caseDirs
+
+""" Runs a command to completion and measures the peak memory it used. Where
+os.wait4 isn't available (Windows) only the return code is reported.
+command -> argument list
+log -> open file for the command's output
+cwd -> directory to run it in
+Returns -> return code (negative signal number if killed), peak RSS in MB or None
+"""
+def CallAndMeasure(command, log, cwd):
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=cwd)
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+
+    pid, status, usage = os.wait4(process.pid, 0)
+    returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    process.returncode = returncode # Already reaped, stop Popen waiting on it again
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peakRSS = usage.ru_maxrss / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+    return returncode, round(peakRSS, 1)
+
+""" Returns -> total size of the files under a directory in MB
+"""
+def DirectorySize(dirPath):
+    total = 0
+    for root, dirs, files in os.walk(dirPath):
+        total += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+    return round(total / 1048576.0, 3)
+
+""" Runs one case as a Continuity batch job.
+job -> (case name, case directory, continuity command, script, mDir)
+Returns -> the case's index entry
+"""
+def RunCase(job):
+    name, caseDir, continuity, script, mDir = job
+    command = shlex.split(continuity) + ['--full', '--no-threads', '--batch', script, mDir, caseDir + 'config.json']
+
+    start = time.time()
+    log = open(caseDir + 'log.txt', 'w')
+    try:
+        try:
+            returncode, peakRSS = CallAndMeasure(command, log, caseDir)
+        except OSError as e: # Continuity not found etc.
+            log.write('Could not run %s: %s\n' % (command[0], e))
+            returncode, peakRSS = None, None
+    finally:
+        log.close()
+
+    outputDir = caseDir + 'Vsolns/'
+    entry = {'case': name, 'returncode': returncode, 'seconds': round(time.time() - start, 3),
+             'peakRSSMB': peakRSS, 'frames': len(ListVoltageSolnFiles(outputDir)),
+             'outputMB': DirectorySize(outputDir), 'outputDir': outputDir}
+    entry['status'] = 'done' if returncode == 0 and os.path.exists(outputDir + 'Vsoln_testrun.done') else 'failed'
+    entry['parameters'] = LoadCaseConfig(caseDir + 'config.json')
+    return entry
+
+""" Saves the index of the sweep as JSON (every field) and CSV (one row per case,
+one column per swept parameter). Written via temporary files.
+"""
+def WriteIndex(sweepDir, entries, sweptNames):
+    entries = sorted(entries, key=lambda entry: entry['case'])
+
+    of = open(sweepDir + 'index.json.part', 'w')
+    try:
+        json.dump(entries, of, indent=1, sort_keys=True)
+    finally:
+        of.close()
+    os.rename(sweepDir + 'index.json.part', sweepDir + 'index.json')
+
+    of = open(sweepDir + 'index.csv.part', 'w')
+    try:
+        of.write(','.join(INDEX_FIELDS + sweptNames) + '\n')
+        for entry in entries:
+            row = [entry[field] for field in INDEX_FIELDS] + [entry['parameters'][name] for name in sweptNames]
+            of.write(','.join('"%s"' % json.dumps(v) if isinstance(v, list) else str(v) for v in row) + '\n')
+    finally:
+        of.close()
+    os.rename(sweepDir + 'index.csv.part', sweepDir + 'index.csv')
+
+""" Runs every case of a sweep, at most numWorkers at a time.
+mDir -> the dataset directory SetupEPSimulation.py is given ([5])
+sweepDir -> directory of the sweep (with trailing slash)
+cases -> list of cases from GridCases/RandomCases
+numWorkers -> number of simulations running at once
+continuity -> command that starts Continuity
+script -> the setup script every case runs
+freshRun -> start every case over (see WriteCaseConfigs)
+Returns -> the index entries
+"""
+def RunSweep(mDir, sweepDir, cases, numWorkers=2, continuity='continuity', script=None, freshRun=False):
+    if script is None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SetupEPSimulation.py')
+    sweptNames = sorted(set(name for case in cases for name in case))
+
+    jobs = [(name, caseDir, continuity, script, mDir) for name, caseDir in WriteCaseConfigs(sweepDir, cases, freshRun)]
+    entries = []
+    pool = ThreadPool(numWorkers) # Threads only wait on the Continuity processes
+    try:
+        for entry in pool.imap_unordered(RunCase, jobs):
+            entries.append(entry)
+            print('%s %s in %.1fs (%d frames)' % (entry['case'], entry['status'], entry['seconds'], entry['frames']))
+            WriteIndex(sweepDir, entries, sweptNames) # Keep the index current if the sweep is stopped
+    finally:
+        pool.close()
+        pool.join()
+    return entries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the EP simulation')
+    parser.add_argument('mDir', help='dataset directory, as given to SetupEPSimulation.py')
+    parser.add_argument('sweepDir', help='directory for the cases and the index')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--grid', help='JSON file of parameter -> list of values')
+    group.add_argument('--random', help='JSON file of parameter -> [low, high] or {"choices": [...]}')
+    parser.add_argument('--samples', type=int, default=10, help='number of random cases')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=2, help='simulations running at once')
+    parser.add_argument('--continuity', default='continuity', help='command that starts Continuity')
+    parser.add_argument('--script', default=None, help='setup script (default SetupEPSimulation.py)')
+    parser.add_argument('--fresh', action='store_true',
+                        help="start every case over instead of resuming a rerun case from its restart files")
+    args = parser.parse_args()
+
+    f = open(args.grid or args.random)
+    try:
+        spec = json.load(f)
+    finally:
+        f.close()
+    cases = GridCases(spec) if args.grid else RandomCases(spec, args.samples, args.seed)
+
+    sweepDir = os.path.join(args.sweepDir, '')
+    if not os.path.isdir(sweepDir):
+        os.makedirs(sweepDir)
+    entries = RunSweep(args.mDir, sweepDir, cases, args.workers, args.continuity, args.script, args.fresh)
+    failed = sorted(entry['case'] for entry in entries if entry['status'] != 'done')
+    print('%d cases, %d failed%s' % (len(entries), len(failed), (': ' + ', '.join(failed)) if failed else ''))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,192 @@
+# Stand-in for the Continuity executable, for trying out ep_sweep.py (or anything
+# else that launches SetupEPSimulation.py batch jobs) without Continuity. Takes the
+# same arguments:
+#
+# python fake_continuity.py --full --no-threads --batch script mDir [config.json]
+#
+# and runs the script itself, with a stub for the Continuity client object (self)
+# and its preferences (allPrefs). The stub records every call the script makes and
+# prints them at the end; the model is a unit cube of hexahedra with 2 *
+# max(elemsPerElem) elements along each side, so paced nodes past its node count
+# fail the way they would in Continuity.
+# SintElectrophys writes, into the working directory preference as it is when
+# called:
+#
+# Vsoln_<fileName>.npy, Vsoln_<fileName>_<i>.npy   a frame every dtout from tstart to
+#                                                  tlen, numbered from 0 in each call
+# restart_<fileName>_<i>.npy                       every saveRestartFrequency frames
+#
+# The frames are an activation front moving along x whose speed follows the
+# conductivity and which gets sharper as the mesh gets finer, so refinement levels
+# differ. With restartFile set it carries on from the restart file staged in the
+# working directory, giving the same frames as a run that never stopped.
+#
+# The shared working directory is FAKE_CONTINUITY_WORKDIR (default <tmp>/fake_continuity/).
+# FAKE_CONTINUITY_FAIL=1 makes it exit with an error instead of running the script;
+# FAKE_CONTINUITY_DIE_AT=<i> kills the process once frame <i> is written, the way a
+# crashed simulation leaves its run directory.
+#
+# Continuity scripts are Python 2; under Python 3 their print statements are
+# turned into calls before they run.
+
+import os
+import re
+import sys
+import glob
+import types
+import tempfile
+
+import numpy as np
+
+from ep_sweep import LoadCaseConfig
+
+# Fields per node of the EP model (SetupEPSimulation.py sets the stimulus in [13])
+NUM_FIELDS = 18
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+""" Stands in for any attribute or method of the client, and logs the calls made on it.
+"""
+class Recorder(object):
+    def __init__(self, client, name):
+        self._client, self._name = client, name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Recorder(self._client, self._name + '.' + name)
+
+    def __call__(self, *args, **kwargs):
+        self._client.calls.append(self._name)
+        return Recorder(self._client, self._name + '()')
+
+    def __getitem__(self, key):
+        return Recorder(self._client, '%s[%r]' % (self._name, key))
+
+class FakeNode(object):
+    def __init__(self, coords):
+        self.derivs = [[float(c)] for c in coords] + [[0.0] for i in range(NUM_FIELDS - 3)]
+
+""" The nodes object of stored_data: nodes with their field derivatives.
+"""
+class FakeNodeList(object):
+    def __init__(self, client, coords):
+        self.nodes = [FakeNode(c) for c in coords]
+        self.record = Recorder(client, 'stored_data.nodes.obj')
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getattr__(self, name):
+        return getattr(self.record, name)
+
+""" The client object Continuity scripts run as (self), for SetupEPSimulation.py.
+prefs -> the allPrefs the script imports, the working directory is read from it
+params -> the case parameters (ep_sweep.LoadCaseConfig)
+"""
+class FakeContinuity(object):
+    def __init__(self, prefs, params):
+        self.calls = []
+        self.prefs, self.params = prefs, params
+        self.n = n = 2 * max(params['elemsPerElem']) + 1
+        idx = np.arange(n ** 3).reshape(n, n, n)
+        self.coords = np.stack(np.meshgrid(*[np.arange(n) / float(n - 1)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+        # Continuity local node order: xi1 fastest, then xi2, then xi3; numbered from 1
+        a = idx[:-1, :-1, :-1].ravel()
+        elements = np.stack([a, a + n * n, a + n, a + n * n + n,
+                             a + 1, a + n * n + 1, a + n + 1, a + n * n + n + 1], axis=1) + 1
+
+        self.stored_data = Recorder(self, 'stored_data')
+        self.stored_data.nodes = Namespace(obj=FakeNodeList(self, self.coords))
+        self.stored_data.elem = Namespace(obj=Namespace(elements=elements))
+
+    def __getattr__(self, name):
+        return Recorder(self, name)
+
+    def Save(self, filePath, log=0):
+        self.calls.append('Save')
+        open(filePath, 'w').close()
+
+    def SintElectrophys(self, options, log=0):
+        self.calls.append('SintElectrophys')
+        workDir = self.prefs['workDir']['defVal']
+        name, solutions = options['fileName'], options['solutions']
+        dtout, tstart, tlen = options['dtout'], options['tstart'], options['tlen']
+        if solutions['restartFile']:
+            restarts = glob.glob(workDir + 'restart*')
+            if len(restarts) != 1:
+                raise RuntimeError('restartFile set, but %d restart files in %s' % (len(restarts), workDir))
+            tstart = float(np.load(restarts[0])[0])
+
+        x = self.coords[:, 0]
+        # Crosses the cube in tlen at the default conductivity and ODE step size
+        speed = self.params['f11Value'] / self.params['odeStepSize'] / self.params['tlen']
+        dieAt = os.environ.get('FAKE_CONTINUITY_DIE_AT')
+        restartEvery = int(solutions['saveRestartFrequency'])
+        for i in range(int(round((tlen - tstart) / dtout)) + 1):
+            t = tstart + i * dtout
+            # Front moving along x, as wide as an element
+            values = 1.0 / (1.0 + np.exp(np.clip((x - speed * t) * (self.n - 1), -50, 50)))
+            fileName = 'Vsoln_%s.npy' % name if i == 0 else 'Vsoln_%s_%d.npy' % (name, i)
+            np.save(workDir + fileName, np.tile(values, (1, 8, 1, 1)))
+            if i and i % restartEvery == 0:
+                np.save(workDir + 'restart_%s_%d.npy' % (name, i), np.array([t]))
+            if dieAt is not None and i == int(dieAt):
+                print('Killed at frame %d (FAKE_CONTINUITY_DIE_AT)' % i)
+                sys.stdout.flush()
+                os._exit(1)
+
+""" Reads a Continuity script, turning Python 2 print statements into calls when
+running under Python 3.
+"""
+def ReadScript(script):
+    f = open(script)
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    if sys.version_info[0] > 2:
+        source = re.sub(r'^(\s*)print (.*)$', r'\1print(\2)', source, flags=re.M)
+    return source
+
+def main(argv):
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    script, mDir = args[0], args[1]
+    params = LoadCaseConfig(args[2] if len(args) > 2 else None)
+
+    if os.environ.get('FAKE_CONTINUITY_FAIL'):
+        print('Simulation failed (FAKE_CONTINUITY_FAIL)')
+        return 1
+
+    workDir = os.path.join(os.environ.get('FAKE_CONTINUITY_WORKDIR') or
+                           os.path.join(tempfile.gettempdir(), 'fake_continuity'), '')
+    if not os.path.isdir(workDir):
+        os.makedirs(workDir)
+    vSolnDir = params['outputDir'] or os.path.join(mDir, 'ContinuityFiles', 'Vsolns', '')
+    if not os.path.isdir(vSolnDir):
+        os.makedirs(vSolnDir)
+
+    # The preferences module the script imports allPrefs from
+    prefs = {'workDir': {'defVal': workDir}}
+    client = types.ModuleType('client')
+    client.PrefsManager = types.ModuleType('client.PrefsManager')
+    client.PrefsManager.allPrefs = prefs
+    sys.modules['client'], sys.modules['client.PrefsManager'] = client, client.PrefsManager
+
+    print('Running %s for %s with a fake Continuity, shared working directory %s'
+          % (os.path.basename(script), mDir, workDir))
+    fake = FakeContinuity(prefs, params)
+    sys.argv = list(argv)
+    try:
+        exec(compile(ReadScript(script), script, 'exec'), {'self': fake, '__name__': '__main__', '__file__': script})
+    finally:
+        print('Continuity calls: %s' % ', '.join(fake.calls))
+    if prefs['workDir']['defVal'] != workDir:
+        print('Working directory preference left at %s' % prefs['workDir']['defVal'])
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
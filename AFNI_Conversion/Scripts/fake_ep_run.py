@@ -0,0 +1,101 @@
+# Stand-in for the Continuity EP simulation, for trying out the follow mode of
+# SaveMeshAndScalarValues.py without running Continuity. Mimics what
+# SetupEPSimulation.py does: saves out the mesh CSVs, writes Vsoln frames into a
+# private run directory under the working directory at intervals (each one in two
+# halves, so readers see partly written files), publishes them into the Vsolns/
+# directory and then drops the sentinel file.
+#
+# python fake_ep_run.py fileDir workDir [numFrames] [interval]
+#
+# e.g. in two shells:
+#   python fake_ep_run.py /tmp/run/Vsolns/ /tmp/run/work/ 31 0.5
+#   pvpython SaveMeshAndScalarValues.py /tmp/run/Vsolns/ --follow /tmp/run/work/ --tlen 3.0 --dtout 0.1
+
+import os
+import sys
+import time
+import io
+
+import numpy as np
+
+from run_dirs import NewRunId, MakeRunDir, PublishRunFiles, WriteRunManifest
+from run_dirs import WriteCurrentRun, ClearCurrentRun
+
+""" Saves a structured block of hexahedra out in the Continuity CSV format.
+fileDir -> output directory (with trailing slash)
+n -> nodes along each side of the block
+size -> length of the block's sides (default n - 1, one unit between nodes)
+Returns -> number of nodes
+"""
+def WriteFakeMesh(fileDir, n, size=None):
+    idx = np.arange(n ** 3).reshape(n, n, n)
+    coords = np.stack(np.meshgrid(np.arange(n), np.arange(n), np.arange(n), indexing='ij'), axis=-1).reshape(-1, 3)
+    if size is not None:
+        coords = coords * (float(size) / (n - 1))
+
+    # Continuity local node order: xi1 fastest, then xi2, then xi3
+    a = idx[:-1, :-1, :-1].ravel()
+    elems = np.stack([a, a + n * n, a + n, a + n * n + n,
+                      a + 1, a + n * n + 1, a + n + 1, a + n * n + n + 1], axis=1)
+
+    np.savetxt(fileDir + '_NODEFILE.csv', coords.astype(np.float64), fmt='%.9f', delimiter=',',
+               header='Coordinate_X,Coordinate_Y,Coordinate_Z', comments='')
+    np.savetxt(fileDir + '_ELEMFILE.csv', elems, fmt='%i', delimiter=',',
+               header=','.join('Global_Node_%d' % (i + 1) for i in range(8)), comments='')
+    return n ** 3
+
+""" Writes one frame in the nested layout Continuity uses, in two halves with a
+pause in between.
+"""
+def WriteFakeFrame(filePath, numNodes, frameNum, interval):
+    # A wave moving through the block, so the frames look different in ParaView
+    values = 0.5 + 0.5 * np.sin(np.linspace(0, np.pi, numNodes) - 0.2 * frameNum)
+    buf = io.BytesIO()
+    np.save(buf, np.tile(values, (1, 8, 1, 1)))
+    data = buf.getvalue()
+
+    of = open(filePath, 'wb')
+    try:
+        of.write(data[:len(data) // 2])
+        of.flush()
+        time.sleep(interval / 2.0)
+        of.write(data[len(data) // 2:])
+    finally:
+        of.close()
+
+def main(fileDir, workDir, numFrames, interval, nodesPerSide=10):
+    for dir in (fileDir, workDir):
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+
+    sentinelPath = fileDir + 'Vsoln_testrun.done'
+    if os.path.exists(sentinelPath):
+        os.remove(sentinelPath)
+
+    numNodes = WriteFakeMesh(fileDir, nodesPerSide)
+
+    runId = NewRunId()
+    runDir = MakeRunDir(workDir, runId)
+    WriteCurrentRun(fileDir, runDir)
+    started = time.time()
+
+    for i in range(numFrames):
+        name = 'Vsoln_testrun.npy' if i == 0 else 'Vsoln_testrun_%d.npy' % i
+        WriteFakeFrame(runDir + name, numNodes, i, interval)
+        print('Wrote %s' % name)
+        time.sleep(interval / 2.0)
+
+    # Same clean up as SetupEPSimulation.py
+    published = PublishRunFiles(runDir, fileDir, runId, ('Vsoln', 'restart'))
+    WriteRunManifest(fileDir, runId, {'files': published, 'workDir': runDir,
+                                      'started': started, 'published': time.time()})
+    ClearCurrentRun(fileDir)
+    open(sentinelPath, 'w').close()
+    print('All Done!')
+
+if __name__ == '__main__':
+    fileDir = sys.argv[1]
+    workDir = sys.argv[2]
+    numFrames = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    interval = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+    main(fileDir, workDir, numFrames, interval)
@@ -0,0 +1,172 @@
+# Bounded LRU cache of voltage solution frames for the interactive slider viewer.
+# Moving the slider used to reload the frame's .npy from disk on the UI thread;
+# with this the frames either side of the current slider position are loaded by a
+# background thread, so scrubbing back and forth is served from memory.
+
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+""" LRU cache of nodal value arrays, keyed on frame number, with neighbour prefetch.
+loader -> function taking a frame number and returning its nodal values
+maxBytes -> memory budget for the cached arrays
+prefetchRadius -> how many frames either side of the requested one to prefetch
+frameRange -> (first, last) frame numbers that exist, prefetch stays inside it
+"""
+class FrameCache(object):
+    def __init__(self, loader, maxBytes, prefetchRadius=2, frameRange=None):
+        self.loader = loader
+        self.maxBytes = maxBytes
+        self.prefetchRadius = prefetchRadius
+        self.frameRange = frameRange
+
+        self.__frames = OrderedDict() # Frame number -> values, least recent first
+        self.__bytes = 0
+        self.__loading = set() # Frames being loaded by either thread
+        self.__queue = [] # Frames waiting to be prefetched, nearest first
+        self.__lock = threading.Condition()
+        self.__closed = False
+
+        # Stats for Report()
+        self.hits = 0
+        self.misses = 0
+        self.getTimes = []
+        self.loadTimes = []
+        self.prefetched = 0
+
+        self.__thread = threading.Thread(target=self.__PrefetchLoop)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    """ Gets a frame, from memory if it is cached (or being prefetched), otherwise by
+    loading it on the calling thread. Queues up the neighbouring frames.
+    frameNum -> frame number as used in the Vsoln file names
+    Returns -> the frame's nodal values
+    """
+    def Get(self, frameNum):
+        start = timer()
+        self.__lock.acquire()
+        try:
+            # Wait for the prefetch thread rather than loading the same frame twice
+            while frameNum in self.__loading:
+                self.__lock.wait()
+
+            values = self.__frames.pop(frameNum, None)
+            if values is not None:
+                self.__frames[frameNum] = values # Most recently used
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.__loading.add(frameNum)
+        finally:
+            self.__lock.release()
+
+        if values is None:
+            try:
+                values = self.__Load(frameNum)
+            finally:
+                self.__lock.acquire()
+                self.__loading.discard(frameNum)
+                self.__lock.notify_all()
+                self.__lock.release()
+
+        self.Prefetch(frameNum)
+        self.getTimes.append(timer() - start)
+        return values
+
+    """ Queues the frames around frameNum for the background thread, nearest first.
+    Replaces whatever was still queued from earlier slider positions.
+    """
+    def Prefetch(self, frameNum):
+        neighbours = []
+        for offset in range(1, self.prefetchRadius + 1):
+            for neighbour in (frameNum + offset, frameNum - offset):
+                if self.frameRange is not None and not (self.frameRange[0] <= neighbour <= self.frameRange[1]):
+                    continue
+                neighbours.append(neighbour)
+
+        self.__lock.acquire()
+        try:
+            self.__queue = [n for n in neighbours if n not in self.__frames and n not in self.__loading]
+            self.__lock.notify_all()
+        finally:
+            self.__lock.release()
+
+    """ Stops the prefetch thread.
+    """
+    def Close(self):
+        self.__lock.acquire()
+        self.__closed = True
+        self.__lock.notify_all()
+        self.__lock.release()
+        self.__thread.join()
+
+    """ Returns -> a summary of the hit rate and load latency
+    """
+    def Report(self):
+        requests = self.hits + self.misses
+        lines = ['Frame cache: %d requests, %d hits (%.0f%%), %d prefetched, %.1f of %.1f MB used'
+                 % (requests, self.hits, 100.0 * self.hits / max(1, requests), self.prefetched,
+                    self.__bytes / 1048576.0, self.maxBytes / 1048576.0)]
+        if self.getTimes:
+            lines.append('  slider latency: mean %.2f ms, max %.2f ms'
+                         % (1000.0 * sum(self.getTimes) / len(self.getTimes), 1000.0 * max(self.getTimes)))
+        if self.loadTimes:
+            lines.append('  frame load:     mean %.2f ms, max %.2f ms (%d loads)'
+                         % (1000.0 * sum(self.loadTimes) / len(self.loadTimes), 1000.0 * max(self.loadTimes),
+                            len(self.loadTimes)))
+        return '\n'.join(lines)
+
+    def __Load(self, frameNum):
+        start = timer()
+        values = self.loader(frameNum)
+        elapsed = timer() - start
+
+        self.__lock.acquire()
+        try:
+            self.loadTimes.append(elapsed)
+            self.__Insert(frameNum, values)
+        finally:
+            self.__lock.release()
+        return values
+
+    # Caller holds the lock
+    def __Insert(self, frameNum, values):
+        if values.nbytes > self.maxBytes:
+            return # Would never fit, don't flush the cache for it
+        old = self.__frames.pop(frameNum, None)
+        if old is not None:
+            self.__bytes -= old.nbytes
+        self.__frames[frameNum] = values
+        self.__bytes += values.nbytes
+
+        # Evict least recently used frames until back under budget
+        while self.__bytes > self.maxBytes:
+            evictedNum, evicted = self.__frames.popitem(last=False)
+            self.__bytes -= evicted.nbytes
+
+    def __PrefetchLoop(self):
+        while True:
+            self.__lock.acquire()
+            try:
+                while not self.__queue and not self.__closed:
+                    self.__lock.wait()
+                if self.__closed:
+                    return
+                frameNum = self.__queue.pop(0)
+                if frameNum in self.__frames or frameNum in self.__loading:
+                    continue
+                self.__loading.add(frameNum)
+            finally:
+                self.__lock.release()
+
+            try:
+                self.__Load(frameNum)
+                self.prefetched += 1
+            except Exception:
+                pass # Missing frame etc., Get() will raise it if it is ever asked for
+            finally:
+                self.__lock.acquire()
+                self.__loading.discard(frameNum)
+                self.__lock.notify_all()
+                self.__lock.release()
@@ -0,0 +1,157 @@
+# Keeps track of which .vtp frames SaveMeshAndScalarValues.py has already converted,
+# so that rerunning it on a directory only converts frames that are new or whose
+# Vsoln source changed. Everything is reconverted when the mesh CSVs change.
+#
+# The manifest is a small JSON file saved next to the converted frames:
+# {"mesh": <sha1 of _NODEFILE.csv + _ELEMFILE.csv>,
+#  "frames": {"<frame number>": {"size": .., "mtime": .., "sha1": ..}}}
+# where size and sha1 are of the frame's values, not of the file they were read from.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from vsoln_io import OpenVoltageSolnStore, StorePath
+
+""" Hashes the contents of one or more files, in order.
+filePaths -> list of files to hash
+Returns -> hex digest
+"""
+def FileHash(filePaths):
+    sha1 = hashlib.sha1()
+    for filePath in filePaths:
+        f = open(filePath, 'rb')
+        try:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        finally:
+            f.close()
+    return sha1.hexdigest()
+
+""" Manifest of the frames converted out of one Vsoln directory.
+manifestPath -> the manifest file (created on the first Save)
+meshHash -> hash of the mesh the frames are being converted with
+"""
+class FrameManifest(object):
+    # Save after this many newly converted frames, so a crash loses little work
+    saveEvery = 20
+
+    def __init__(self, manifestPath, meshHash):
+        self.manifestPath = manifestPath
+        self.meshHash = meshHash
+        self.frames = {}
+        self.meshChanged = True
+        self.__pending = 0
+
+        if os.path.exists(manifestPath):
+            f = open(manifestPath)
+            try:
+                manifest = json.load(f)
+            finally:
+                f.close()
+
+            # Frames converted with a different mesh are all stale
+            if manifest.get('mesh') == meshHash:
+                self.frames = manifest.get('frames', {})
+                self.meshChanged = False
+
+    """ Size, mtime and hash of a frame's values, from the frame's row of the packed
+    store when there is one and its .npy file otherwise. Size and hash are of the
+    values as little-endian doubles, the way the store holds them, so a frame
+    recorded from its .npy (e.g. in follow mode) is still recognised once the run
+    has been packed; only the mtime differs, which falls back to the hash.
+    fileDir -> directory holding the Vsoln files (with trailing slash)
+    frameNum -> frame number as used in the Vsoln file names
+    withHash -> hash the source as well (skipped for the quick size/mtime check)
+    """
+    def Source(self, fileDir, frameNum, withHash=True):
+        storePath = StorePath(fileDir)
+        if os.path.exists(storePath):
+            values = OpenVoltageSolnStore(storePath).Frame(frameNum)
+            filePath = storePath
+        else:
+            if frameNum == 0:
+                filePath = fileDir + 'Vsoln_testrun.npy'
+            else:
+                filePath = fileDir + 'Vsoln_testrun_%d.npy' % frameNum
+            values = np.load(filePath, mmap_mode='r')[0, 0, 0] # As LoadVoltageSoln, without reading it yet
+
+        source = {'size': values.size * 8, 'mtime': os.path.getmtime(filePath)}
+        if withHash:
+            source['sha1'] = hashlib.sha1(np.ascontiguousarray(values, dtype='<f8').tobytes()).hexdigest()
+        return source
+
+    """ Whether a frame has values to convert: frame 0 is saved without scalars when the
+    run has no first frame (Vsoln_testrun.npy).
+    """
+    def HasSource(self, fileDir, frameNum):
+        storePath = StorePath(fileDir)
+        if os.path.exists(storePath):
+            return frameNum in OpenVoltageSolnStore(storePath).frames
+        if frameNum == 0:
+            return os.path.exists(fileDir + 'Vsoln_testrun.npy')
+        return os.path.exists(fileDir + 'Vsoln_testrun_%d.npy' % frameNum)
+
+    """ Works out which frames need to be (re)converted.
+    fileDir -> directory holding the Vsoln files (with trailing slash)
+    frameNums -> every frame number of the run (0 is the blank frame when there's no first frame)
+    outputDir -> where the frames are saved out
+    extension -> file extension of the saved frames
+    Returns -> frame numbers that are missing, stale or converted with another mesh
+    """
+    def StaleFrames(self, fileDir, frameNums, outputDir, extension='vtp'):
+        stale = []
+        for frameNum in frameNums:
+            entry = self.frames.get(str(frameNum))
+            if entry is None or not os.path.exists(outputDir + 'Vsoln_testrun_%d.%s' % (frameNum, extension)):
+                stale.append(frameNum)
+                continue
+
+            # A blank frame 0 only depends on the mesh, unless a first frame has appeared since
+            if not entry:
+                if self.HasSource(fileDir, frameNum):
+                    stale.append(frameNum)
+                continue
+            if not self.HasSource(fileDir, frameNum): # Converted from a first frame that's gone since
+                stale.append(frameNum)
+                continue
+
+            # Same size and mtime -> unchanged; otherwise fall back to the hash so
+            # that touched/copied but identical files aren't reconverted
+            source = self.Source(fileDir, frameNum, withHash=False)
+            if source['size'] == entry['size'] and source['mtime'] == entry['mtime']:
+                continue
+            if source['size'] == entry['size'] and self.Source(fileDir, frameNum)['sha1'] == entry['sha1']:
+                entry['mtime'] = source['mtime']
+                continue
+            stale.append(frameNum)
+        return stale
+
+    """ Records a frame as converted from its current source.
+    sourceFrame -> number of the file it was converted from, if not frameNum (a resumed
+                   run's frames before they are published)
+    """
+    def Record(self, fileDir, frameNum, sourceFrame=None):
+        sourceFrame = frameNum if sourceFrame is None else sourceFrame
+        if self.HasSource(fileDir, sourceFrame):
+            self.frames[str(frameNum)] = self.Source(fileDir, sourceFrame)
+        else: # Blank frame 0
+            self.frames[str(frameNum)] = {}
+
+        self.__pending += 1
+        if self.__pending >= self.saveEvery:
+            self.Save()
+
+    """ Writes the manifest out (via a temporary file, so it is never half written).
+    """
+    def Save(self):
+        tmpPath = self.manifestPath + '.part'
+        of = open(tmpPath, 'w')
+        try:
+            json.dump({'mesh': self.meshHash, 'frames': self.frames}, of, indent=1, sort_keys=True)
+        finally:
+            of.close()
+        os.rename(tmpPath, self.manifestPath)
+        self.__pending = 0
@@ -0,0 +1,132 @@
+# Reads the refined mesh that SetupEPSimulation.py saves out as _NODEFILE.csv and
+# _ELEMFILE.csv into whole numpy arrays, and keeps a binary copy of them next to the
+# CSVs so later loads (every viewer launch, every conversion run) skip the text
+# parsing. No vtk imports, so Continuity scripts can write the same cache.
+
+import os
+
+import numpy as np
+
+from frame_manifest import FileHash
+
+# Binary copy of the mesh, saved in the same directory as the CSVs
+MESH_CACHE_NAME = '_MESHCACHE.npz'
+
+""" Parses the mesh CSVs (one header line each) with whole-array reads.
+nodesFile -> the file where the nodes information of the heart mesh were saved
+elemsFile -> the file where the elems information of the heart mesh were saved
+Returns -> points (N x 3 float64), elements (E x 8 int64, zero-indexed node numbers)
+"""
+def ReadMeshCSV(nodesFile, elemsFile):
+    points = np.loadtxt(nodesFile, delimiter=',', skiprows=1, ndmin=2, dtype=np.float64)
+    elements = np.loadtxt(elemsFile, delimiter=',', skiprows=1, ndmin=2, dtype=np.int64)
+    return points[:, :3], elements
+
+""" Default location of the binary mesh cache for a pair of mesh CSVs.
+"""
+def MeshCachePath(nodesFile):
+    return os.path.join(os.path.dirname(os.path.abspath(nodesFile)), MESH_CACHE_NAME)
+
+""" Saves the mesh arrays out in binary, tagged with the hash of the CSVs they came
+from. Written to a temporary file first, so a reader never sees half a cache.
+cachePath -> the .npz file to write
+meshHash -> FileHash of the nodes and elems CSVs
+"""
+def SaveMeshCache(cachePath, meshHash, points, elements):
+    tmpPath = cachePath + '.part'
+    of = open(tmpPath, 'wb')
+    try:
+        np.savez(of, hash=np.array(meshHash), points=points, elements=elements)
+    finally:
+        of.close()
+    os.rename(tmpPath, cachePath)
+
+""" Writes the binary cache for mesh CSVs that were just saved out from these arrays,
+so that not even the first LoadMeshArrays() has to parse them.
+nodesFile -> the nodes CSV written from points
+elemsFile -> the elems CSV written from elements
+"""
+def SaveMeshSidecar(nodesFile, elemsFile, points, elements):
+    SaveMeshCache(MeshCachePath(nodesFile), FileHash([nodesFile, elemsFile]),
+                  np.asarray(points, dtype=np.float64), np.asarray(elements, dtype=np.int64))
+
+""" Loads the mesh arrays, from the binary cache when it was made from the same CSV
+contents, otherwise by parsing the CSVs (and then refreshing the cache).
+nodesFile -> the file where the nodes information of the heart mesh were saved
+elemsFile -> the file where the elems information of the heart mesh were saved
+Returns -> points (N x 3 float64), elements (E x 8 int64, zero-indexed node numbers)
+"""
+def LoadMeshArrays(nodesFile, elemsFile):
+    meshHash = FileHash([nodesFile, elemsFile])
+    cachePath = MeshCachePath(nodesFile)
+
+    if os.path.exists(cachePath):
+        try:
+            cache = np.load(cachePath)
+            try:
+                if str(cache['hash']) == meshHash:
+                    return cache['points'], cache['elements']
+            finally:
+                cache.close()
+        except (IOError, ValueError, KeyError):
+            pass # Unreadable cache, rebuild it below
+
+    points, elements = ReadMeshCSV(nodesFile, elemsFile)
+    try:
+        SaveMeshCache(cachePath, meshHash, points, elements)
+    except (IOError, OSError):
+        pass # Read-only directory, still fine to use the parsed mesh
+    return points, elements
+
+## CELLS ***********************************************************************
+# Continuity numbers the 8 nodes of a hex element with xi1 fastest, then xi2, then
+# xi3: node 0 is (0,0,0), node 1 (1,0,0), node 2 (0,1,0), node 3 (1,1,0), and nodes
+# 4-7 repeat that at xi3 = 1.
+
+# The 6 faces of a hex element, each wound so its normal points out of the element
+HEX_FACES = [[0, 2, 3, 1],  # xi3 = 0 (inner)
+             [4, 5, 7, 6],  # xi3 = 1 (outer)
+             [0, 1, 5, 4],  # xi2 = 0
+             [2, 6, 7, 3],  # xi2 = 1
+             [0, 4, 6, 2],  # xi1 = 0
+             [1, 3, 7, 5]]  # xi1 = 1
+
+# Continuity node order -> VTK_HEXAHEDRON node order
+# -> [hex[0],hex[1],hex[3],hex[2],hex[4],hex[5],hex[7],hex[6]]
+VTK_HEX_ORDER = [0, 1, 3, 2, 4, 5, 7, 6]
+
+""" The three faces per element that Load() has always drawn: inner, outer and one
+horizontal plane (kept for comparison with older output).
+elements -> E x 8 zero-indexed node numbers
+Returns -> 3E x 4 quads
+"""
+def ElementFaces(elements):
+    return elements[:, [[0, 1, 3, 2], [4, 5, 7, 6], [6, 7, 3, 2]]].reshape(-1, 4)
+
+""" Finds the exterior surface of a hex mesh. Every face of every element is keyed on
+its sorted node numbers; faces shared by two elements are interior, faces that only
+occur once are on the boundary. Faces collapsed to a line or a point (e.g. at the
+apex) are dropped.
+elements -> E x 8 zero-indexed node numbers
+Returns -> F x 4 boundary quads, wound outwards
+"""
+def BoundaryFaces(elements):
+    faces = elements[:, HEX_FACES].reshape(-1, 4)
+    keys = np.sort(faces, axis=1)
+
+    # Rows as single opaque values so np.unique can hash them in one pass
+    keys = np.ascontiguousarray(keys).view(np.dtype((np.void, keys.dtype.itemsize * 4))).ravel()
+    uniqueKeys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    boundary = faces[np.sort(first[counts == 1])]
+
+    # Keep faces with at least 3 distinct nodes
+    sortedNodes = np.sort(boundary, axis=1)
+    distinct = 1 + (np.diff(sortedNodes, axis=1) != 0).sum(axis=1)
+    return boundary[distinct >= 3]
+
+""" Reorders the elements into VTK_HEXAHEDRON node order.
+elements -> E x 8 zero-indexed node numbers
+Returns -> E x 8 node numbers in vtk order
+"""
+def HexCells(elements):
+    return elements[:, VTK_HEX_ORDER]
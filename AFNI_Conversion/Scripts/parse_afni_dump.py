@@ -0,0 +1,181 @@
+# Streaming replacement for Matlab/Parse_AFNI_v4_G1.m and Parse_AFNI_v4_GRPS.m. Those
+# textscan the whole 3dmaskdump output (every voxel of the image, 25 columns) into
+# memory before masking it; this reads the dump in chunks of rows, masks (MD ~= 0 and
+# FA ~= 1) and flips RAI to LPI per chunk, and appends only the kept rows to the
+# output, so memory is bounded by the chunk size.
+#
+# The dump is made with: 3dmaskdump -index -noijk -xyz -o DT_grfl_msk_dump.txt DT_gradfile_msk+orig.
+# Columns (1 based, as in Parse_AFNI_v4):
+#   1 n, 2-4 x y z, 5-10 Dxx Dxy Dyy Dxz Dyz Dzz, 11-13 lambda1-3 (lambda1 largest),
+#   14-16 evec1, 17-19 evec2, 20-22 evec3, 23 FA, 24 MD
+#
+# Writes <dump_file without extension>_out_mask.mat into the working directory with
+# the same variables as the MATLAB version (D, DT, coords, es, vs, d_nz), as a
+# MATLAB 7.3 MAT-file (HDF5), which Scanner2ModelXform_EC.m opens with matfile.
+#
+# python parse_afni_dump.py working_directory dump_file [G1|GRPS] [chunkRows]
+
+import os
+import sys
+import time
+import itertools
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+DUMP_COLUMNS = 25
+# Image size per data group, the MATLAB versions read no more voxels than this
+IMAGE_SIZES = {'G1': (192, 192, 192), 'GRPS': (216, 144, 144)}
+
+# Zero-indexed dump columns of each output variable. 2D variables are rows x columns
+# per voxel; for the 3 x 3 x N ones, [i][j] is the column of element (i, j).
+D_COLUMNS = [4, 6, 9, 5, 7, 8] # Dxx Dyy Dzz Dxy Dxz Dyz
+DT_COLUMNS = [[4, 5, 7], [5, 6, 8], [7, 8, 9]]
+COORD_COLUMNS = [1, 2, 3]
+ES_COLUMNS = [12, 11, 10] # es(:,3) the primary eigenvalue, Continuity style
+VS_COLUMNS = [[19, 16, 13], [20, 17, 14], [21, 18, 15]] # vs(:,3) the primary eigenvector
+
+""" Reads the dump in chunks of rows, one voxel per line.
+maxRows -> stop after this many rows (None reads to the end), as textscan stops at the image size
+Returns -> generator of arrays (rows x 25)
+"""
+def DumpChunks(dumpFile, chunkRows=1 << 16, maxRows=None):
+    f = open(dumpFile)
+    try:
+        numRows = 0
+        while maxRows is None or numRows < maxRows:
+            rows = chunkRows if maxRows is None else min(chunkRows, maxRows - numRows)
+            lines = list(itertools.islice(f, rows))
+            if not lines:
+                break
+            d = np.loadtxt(lines, ndmin=2, dtype=np.float64)
+            if d.shape[1] != DUMP_COLUMNS:
+                raise ValueError('%s has %d columns, expected %d (3dmaskdump -index -noijk -xyz)'
+                                 % (dumpFile, d.shape[1], DUMP_COLUMNS))
+            numRows += len(d)
+            yield d
+    finally:
+        f.close()
+
+""" Masks a chunk of the dump (MD ~= 0 and FA ~= 1) and converts the coordinates from
+RAI to LPI (x and y negated), in place for the kept rows.
+Returns -> the kept rows
+"""
+def MaskAndFlip(d):
+    d = d[(d[:, 23] != 0) & (d[:, 22] != 1)]
+    d[:, 1] = -d[:, 1] # Switch (R) to (L) [mm]
+    d[:, 2] = -d[:, 2] # Switch (A) to (P) [mm]
+    return d
+
+""" Writes double arrays into a MATLAB 7.3 MAT-file a block of rows at a time. MATLAB
+stores arrays column major, so an N x k variable is an HDF5 dataset of shape (k, N)
+and a 3 x 3 x N one a dataset of shape (N, 3, 3) holding the transposed matrices.
+Written to a temporary file and renamed into place by Close().
+"""
+class MatFileWriter(object):
+    def __init__(self, filePath):
+        if h5py is None:
+            raise ImportError('h5py is required to write MATLAB 7.3 MAT-files')
+        self.filePath = filePath
+        self.__file = h5py.File(filePath + '.part', 'w', userblock_size=512)
+        self.__dims = {} # Variable -> MATLAB dimensions without the voxel one
+
+    """ Appends rows to a variable, created on first use.
+    name -> variable name
+    rows -> N x k (an N x k variable) or N x 3 x 3 (a 3 x 3 x N variable, [n, i, j] its element (i, j, n))
+    """
+    def Append(self, name, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        if name not in self.__dims:
+            self.__dims[name] = rows.shape[1:]
+            if rows.ndim == 2:
+                shape, maxshape, chunks = (rows.shape[1], 0), (rows.shape[1], None), (rows.shape[1], 4096)
+            else:
+                shape, maxshape, chunks = (0, 3, 3), (None, 3, 3), (4096, 3, 3)
+            dataset = self.__file.create_dataset(name, shape, maxshape=maxshape, chunks=chunks, dtype=np.float64)
+            dataset.attrs.create('MATLAB_class', np.bytes_('double'))
+        dataset = self.__file[name]
+        if rows.ndim == 2:
+            n = dataset.shape[1]
+            dataset.resize(n + len(rows), axis=1)
+            dataset[:, n:] = rows.T
+        else:
+            n = dataset.shape[0]
+            dataset.resize(n + len(rows), axis=0)
+            dataset[n:] = rows.transpose(0, 2, 1)
+
+    """ Writes the MAT-file header and moves the file into place. Variables left empty
+    are saved the way MATLAB saves empty arrays.
+    """
+    def Close(self):
+        for name, dims in self.__dims.items():
+            dataset = self.__file[name]
+            if dataset.size == 0:
+                matlabDims = (0,) + tuple(dims) if len(dims) == 1 else tuple(dims) + (0,)
+                del self.__file[name]
+                dataset = self.__file.create_dataset(name, data=np.array(matlabDims, dtype=np.uint64))
+                dataset.attrs.create('MATLAB_class', np.bytes_('double'))
+                dataset.attrs.create('MATLAB_empty', np.uint8(1))
+        self.__file.close()
+
+        header = ('MATLAB 7.3 MAT-file, Platform: %s, Created on: %s HDF5 schema 1.00 .'
+                  % (sys.platform, time.strftime('%a %b %d %H:%M:%S %Y'))).ljust(116)[:116]
+        of = open(self.filePath + '.part', 'r+b')
+        try:
+            of.write(header.encode('ascii') + b'\0' * 8 + b'\x00\x02' + b'IM')
+        finally:
+            of.close()
+        os.rename(self.filePath + '.part', self.filePath)
+
+    """ Drops the temporary file if Close() wasn't reached.
+    """
+    def Discard(self):
+        if self.__file:
+            self.__file.close()
+        if os.path.exists(self.filePath + '.part'):
+            os.remove(self.filePath + '.part')
+
+""" Parses a 3dmaskdump output into the masked MAT-file Parse_AFNI_v4 saves.
+dumpFile -> the dump (DT_grfl_msk_dump.txt)
+outputPath -> the MAT-file to write
+maxRows -> voxels to read at most (the image size), None for the whole dump
+chunkRows -> rows read at once, bounds the memory used
+Returns -> number of voxels read, number kept by the mask
+"""
+def ParseAFNIDump(dumpFile, outputPath, maxRows=None, chunkRows=1 << 16):
+    writer = MatFileWriter(outputPath)
+    numRows, numKept = 0, 0
+    try:
+        for d in DumpChunks(dumpFile, chunkRows, maxRows):
+            numRows += len(d)
+            d = MaskAndFlip(d)
+            numKept += len(d)
+            writer.Append('D', d[:, D_COLUMNS])
+            writer.Append('DT', d[:, DT_COLUMNS])
+            writer.Append('coords', d[:, COORD_COLUMNS])
+            writer.Append('es', d[:, ES_COLUMNS])
+            writer.Append('vs', d[:, VS_COLUMNS])
+            writer.Append('d_nz', d)
+        if numRows == 0:
+            raise ValueError('%s holds no voxels' % dumpFile)
+        writer.Close()
+    finally:
+        writer.Discard()
+    return numRows, numKept
+
+if __name__ == '__main__':
+    workingDir = os.path.join(sys.argv[1], '')
+    dumpFile = sys.argv[2]
+    maxRows = int(np.prod(IMAGE_SIZES[sys.argv[3]])) if len(sys.argv) > 3 else None
+    chunkRows = int(sys.argv[4]) if len(sys.argv) > 4 else 1 << 16
+
+    outputPath = workingDir + os.path.splitext(os.path.basename(dumpFile))[0] + '_out_mask.mat'
+    print('Processing file %s...' % (workingDir + dumpFile))
+    start = time.time()
+    numRows, numKept = ParseAFNIDump(workingDir + dumpFile, outputPath, maxRows, chunkRows)
+    print('Mask included ~%.f%% of voxels (%d of %d).' % (100.0 * numKept / (maxRows or numRows), numKept, numRows))
+    print('Saved %s in %.2fs' % (outputPath, time.time() - start))
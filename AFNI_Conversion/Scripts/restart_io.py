@@ -0,0 +1,206 @@
+# Lets SetupEPSimulation.py resume an EP simulation that died part way through,
+# from the last restart checkpoint, instead of rerunning it from t = 0.
+#
+# SintElectrophys saves a Vsoln frame every dtout (frame <i> holds the solution at
+# t = <i> * dtout, frame 0 the unsuffixed Vsoln_<name>.npy) and a restart file every
+# saveRestartFrequency frames next to them (restart*<i>, <i> being the frame it was
+# saved at, so it holds the state at t = <i> * dtout). Resuming:
+# 1. SalvageRun publishes the complete frames and restart files the dead run left
+#    in its run directory (see run_dirs.py) and throws away the half written ones.
+#    Only done once the dead run's process is known to be gone (run_dirs.IsRunAlive).
+# 2. The case parameters saved with the checkpoints (WriteCheckpointParams) have to
+#    match the new run's, otherwise it starts over (RemoveRunFiles clears the
+#    earlier run's frames, store and restart files first).
+# 3. FindResumePoint picks the latest restart file that is complete and whose
+#    frames 0..<i> are all on disk.
+# 4. The simulation is restarted from that file with tstart = <i> * dtout and the
+#    same tlen, tlen being the end time of the whole simulation.
+# 5. PublishResumedFrames publishes the resumed run's frames (and restart files)
+#    under the numbers they have in the whole run. Each SintElectrophys call numbers
+#    its frames from 0, frame 0 being the state at tstart, so frame <k> of the
+#    resumed run is frame <i> + <k> of the whole run, and its frame 0 (the
+#    checkpoint frame, already there) is dropped.
+#
+# How Continuity numbers the frames of a resumed run isn't documented and hasn't
+# been checked against Continuity itself; step 5 is the one rule used (and the one
+# fake_continuity.py follows). A resumed run with more frames than fit before tlen
+# under it is refused rather than published under wrong numbers.
+
+import os
+import re
+import json
+import glob
+import shutil
+import filecmp
+
+from vsoln_io import ListVoltageSolnFiles, FrameNumber, IsFrameComplete, StorePath
+from run_dirs import PublishRunFiles
+
+RESTART_PREFIX = 'restart'
+# Case parameters of the run the restart files belong to, next to them
+CHECKPOINT_PARAMS_NAME = 'checkpoint_%s.json'
+# The frame number at the end of a restart file name, before any extension
+RESTART_NUMBER = re.compile(r'(\d+)(\.\w+)?$')
+
+""" Works out which output frame a restart file was saved at, from the number at the
+end of its name (restart_testrun_300.npy -> 300).
+Returns -> the frame number, None if the name doesn't end in one
+"""
+def RestartFrame(filePath):
+    match = RESTART_NUMBER.search(os.path.basename(filePath))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+""" Checks whether a restart file has been completely written. .npy files are checked
+against their header, other formats only for being non-empty.
+"""
+def IsRestartComplete(filePath):
+    if filePath.endswith('.npy'):
+        return IsFrameComplete(filePath)
+    try:
+        return os.path.getsize(filePath) > 0
+    except OSError:
+        return False
+
+""" Lists the restart files in a directory, latest checkpoint first.
+fileDir -> directory holding the restart files (with trailing slash)
+Returns -> list of (frame number, file path)
+"""
+def ListRestartFiles(fileDir):
+    restarts = []
+    for filePath in glob.glob(fileDir + RESTART_PREFIX + '*'):
+        frameNum = RestartFrame(filePath)
+        if frameNum is not None and not filePath.endswith('.part'):
+            restarts.append((frameNum, filePath))
+    return sorted(restarts, reverse=True)
+
+""" Publishes what a run that died before finishing left in its run directory.
+Frames and restart files that were still being written are removed first, so only
+complete files end up next to the other frames.
+runDir -> the dead run's working directory (with trailing slash)
+destDir -> the directory to publish into (with trailing slash)
+runId -> id of the dead run (the name of its run directory)
+Returns -> names of the published files
+"""
+def SalvageRun(runDir, destDir, runId):
+    for filePath in ListVoltageSolnFiles(runDir):
+        if not IsFrameComplete(filePath):
+            os.remove(filePath)
+    for frameNum, filePath in ListRestartFiles(runDir):
+        if not IsRestartComplete(filePath):
+            os.remove(filePath)
+    return PublishRunFiles(runDir, destDir, runId, ('Vsoln', RESTART_PREFIX))
+
+""" Finds where a run can be resumed from.
+fileDir -> directory holding the Vsoln frames and restart files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> (restart file path, frame number to resume from), (None, 0) to start over
+"""
+def FindResumePoint(fileDir, runName='testrun'):
+    complete = set(FrameNumber(filePath) for filePath in ListVoltageSolnFiles(fileDir, runName)
+                   if IsFrameComplete(filePath))
+    for frameNum, filePath in ListRestartFiles(fileDir):
+        # Frames up to the checkpoint have to be there, the rest get rewritten
+        if frameNum > 0 and IsRestartComplete(filePath) and all(i in complete for i in range(frameNum + 1)):
+            return filePath, frameNum
+    return None, 0
+
+""" Publishes the frames of a resumed run with their frame numbers in the whole run:
+frame <k> of the resumed run is frame resumeFrame + <k> (see the top of this file).
+Its frame 0, the checkpoint frame that is already published, is dropped.
+runDir -> the resumed run's working directory (with trailing slash)
+destDir -> the directory to publish into (with trailing slash)
+runId -> id of the resumed run
+restartPath -> the restart file the run was resumed from
+resumeFrame -> the frame the run was resumed from
+lastFrame -> number of the last frame of the whole simulation (tlen / dtout)
+runName -> the outputFileName given to SintElectrophys
+Returns -> names of the published files
+"""
+def PublishResumedFrames(runDir, destDir, runId, restartPath, resumeFrame, lastFrame, runName='testrun'):
+    frames = ListVoltageSolnFiles(runDir, runName)
+    frameNums = [FrameNumber(filePath) for filePath in frames]
+    if frameNums and resumeFrame + max(frameNums) > lastFrame:
+        raise ValueError('The resumed run wrote frames up to %d, past the last frame (%d) once numbered on '
+                         'from frame %d; its frames are left in %s' % (max(frameNums), lastFrame, resumeFrame, runDir))
+
+    # Renamed within the run directory first, the highest numbers first so that
+    # no frame is renamed over one that still has to be moved
+    for filePath, frameNum in sorted(zip(frames, frameNums), key=lambda pair: -pair[1]):
+        if frameNum == 0:
+            os.remove(filePath)
+        else:
+            os.rename(filePath, runDir + 'Vsoln_%s_%d.npy' % (runName, frameNum + resumeFrame))
+
+    # The restart file the run started from is already published, later ones are
+    # renumbered like the frames. The run can save a new checkpoint under the staged
+    # copy's name, so that is told apart by its contents.
+    for frameNum, filePath in ListRestartFiles(runDir):
+        if os.path.basename(filePath) == os.path.basename(restartPath) and filecmp.cmp(filePath, restartPath, shallow=False):
+            os.remove(filePath)
+        else:
+            fileName = os.path.basename(filePath)
+            match = RESTART_NUMBER.search(fileName)
+            os.rename(filePath, runDir + fileName[:match.start(1)] + str(frameNum + resumeFrame) + fileName[match.end(1):])
+    return PublishRunFiles(runDir, destDir, runId, ('Vsoln', RESTART_PREFIX))
+
+""" Puts the restart file a run resumes from into its working directory, where
+Continuity reads it from.
+Returns -> path of the copy
+"""
+def StageRestartFile(restartPath, runDir):
+    copyPath = runDir + os.path.basename(restartPath)
+    shutil.copyfile(restartPath, copyPath)
+    return copyPath
+
+""" Saves the case parameters a run's restart files belong to, so a later run only
+resumes from them with the same parameters. Written via a temporary file.
+fileDir -> directory holding the restart files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+params -> JSON serialisable parameters
+"""
+def WriteCheckpointParams(fileDir, runName, params):
+    paramsPath = fileDir + CHECKPOINT_PARAMS_NAME % runName
+    of = open(paramsPath + '.part', 'w')
+    try:
+        json.dump(params, of, indent=1, sort_keys=True)
+    finally:
+        of.close()
+    os.rename(paramsPath + '.part', paramsPath)
+
+""" Reads the parameters saved by WriteCheckpointParams.
+Returns -> the parameters, None if none were saved (restart files of an older run)
+"""
+def ReadCheckpointParams(fileDir, runName):
+    try:
+        f = open(fileDir + CHECKPOINT_PARAMS_NAME % runName)
+    except IOError:
+        return None
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+""" Lists the parameters that differ between two parameter sets.
+Returns -> sorted names, empty if they match
+"""
+def ChangedParams(saved, params):
+    # Through JSON, so tuples and lists (and str and unicode) compare equal
+    params = json.loads(json.dumps(params))
+    return sorted(name for name in set(saved) | set(params) if saved.get(name) != params.get(name))
+
+""" Removes what an earlier run left in a directory, when starting over: its Vsoln
+frames, the store they were packed into and its restart files, so that none of them
+is packed with the new run's frames or taken for one of its checkpoints.
+fileDir -> directory holding the run's files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> names of the removed files
+"""
+def RemoveRunFiles(fileDir, runName='testrun'):
+    filePaths = ListVoltageSolnFiles(fileDir, runName) + [filePath for frameNum, filePath in ListRestartFiles(fileDir)]
+    if os.path.exists(StorePath(fileDir, runName)):
+        filePaths.append(StorePath(fileDir, runName))
+    for filePath in filePaths:
+        os.remove(filePath)
+    return [os.path.basename(filePath) for filePath in filePaths]
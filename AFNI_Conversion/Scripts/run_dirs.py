@@ -0,0 +1,214 @@
+# Keeps concurrent EP simulations on one machine apart. Each run gets a unique run
+# id and its own working directory for Continuity to write the Vsoln/restart files
+# into. When the run is done its files are published into the dataset's Vsolns/
+# directory with atomic renames, so readers never see a half moved file and one
+# run never picks up another run's files. A small JSON manifest per run, in
+# Vsolns/runs/, records which files came from which run.
+
+import os
+import json
+import errno
+import time
+import socket
+import shutil
+import uuid
+
+# Where the per-run manifests are kept, inside the directory the files are published to
+RUNS_DIR_NAME = 'runs/'
+# Names the working directory of the run in progress, in the directory it publishes to
+CURRENT_RUN_NAME = 'current_run.txt'
+
+""" Makes an id that is unique across runs, processes and hosts, and sorts by start time.
+Returns -> run id, e.g. 20240131-142501-myhost-1234-1a2b3c
+"""
+def NewRunId():
+    host = socket.gethostname().split('.')[0] or 'host'
+    return '%s-%s-%d-%s' % (time.strftime('%Y%m%d-%H%M%S'), host, os.getpid(), uuid.uuid4().hex[:6])
+
+""" Creates the private working directory of a run.
+baseDir -> the shared working directory (with trailing slash)
+runId -> from NewRunId()
+Returns -> the run's working directory (with trailing slash)
+"""
+def MakeRunDir(baseDir, runId):
+    runDir = baseDir + RUNS_DIR_NAME + runId + '/'
+    os.makedirs(runDir)
+    return runDir
+
+""" Records which run directory the simulation for destDir is writing into, so a
+follow mode converter can watch it (the run id isn't known before the run starts),
+and which process is running it, so a later run can tell whether it is still alive.
+destDir -> the directory the run's files will be published to (with trailing slash)
+runDir -> the run's working directory (with trailing slash)
+frameOffset -> number of the run's first frame in the whole simulation (when resuming)
+"""
+def WriteCurrentRun(destDir, runDir, frameOffset=0):
+    pointerPath = destDir + CURRENT_RUN_NAME
+    info = {'runDir': runDir, 'pid': os.getpid(), 'host': socket.gethostname(), 'started': time.time(),
+            'frameOffset': frameOffset}
+    of = open(pointerPath + '.part', 'w')
+    try:
+        json.dump(info, of, indent=1, sort_keys=True)
+    finally:
+        of.close()
+    os.rename(pointerPath + '.part', pointerPath)
+
+""" Reads the record of the run in progress for destDir. Records written before the
+process was recorded hold only the run directory.
+Returns -> dict of 'runDir', 'pid', 'host', 'started', 'frameOffset' (None where not
+           recorded), None if there isn't a run in progress
+"""
+def ReadCurrentRunInfo(destDir):
+    try:
+        f = open(destDir + CURRENT_RUN_NAME)
+    except IOError:
+        return None
+    try:
+        text = f.read().strip()
+    finally:
+        f.close()
+    if not text:
+        return None
+    info = dict.fromkeys(['runDir', 'pid', 'host', 'started', 'frameOffset'])
+    if text.startswith('{'):
+        info.update(json.loads(text))
+    else:
+        info['runDir'] = text
+    return info
+
+""" Returns -> the working directory of the run in progress for destDir, None if there isn't one
+"""
+def ReadCurrentRun(destDir):
+    info = ReadCurrentRunInfo(destDir)
+    return info['runDir'] if info is not None else None
+
+""" Start time of a process (seconds since the epoch), from /proc on Linux.
+Returns -> None where it can't be read
+"""
+def ProcessStartTime(pid):
+    try:
+        f = open('/proc/%d/stat' % pid)
+        try:
+            # Fields after the command name, which may hold spaces; starttime is field 22
+            startTicks = int(f.read().rsplit(')', 1)[1].split()[19])
+        finally:
+            f.close()
+        f = open('/proc/stat')
+        try:
+            bootTime = int([line.split()[1] for line in f if line.startswith('btime')][0])
+        finally:
+            f.close()
+        return bootTime + float(startTicks) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        return None
+
+""" Tells whether the run a current run record names is still running.
+info -> from ReadCurrentRunInfo
+Returns -> True if its process is alive, False if it is gone, None if that can't be
+           told (another host, or a record without the process)
+"""
+def IsRunAlive(info):
+    if info.get('pid') is None or info.get('host') != socket.gethostname():
+        return None
+    pid = int(info['pid'])
+    if pid == os.getpid():
+        return False # An earlier script of this Continuity session, which has ended
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        # EPERM: a process of another user has the pid, which is alive either way
+    startTime = ProcessStartTime(pid)
+    if startTime is not None and info.get('started') is not None and startTime > info['started'] + 1.0:
+        return False # The pid was reused by a process started after the run
+    return True
+
+""" Removes the current run record once the run's files have been published.
+"""
+def ClearCurrentRun(destDir):
+    if os.path.exists(destDir + CURRENT_RUN_NAME):
+        os.remove(destDir + CURRENT_RUN_NAME)
+
+""" Moves a run's output files into the published directory. Each file is first
+moved into a staging directory next to the destination (a copy when the run
+directory is on another filesystem), then renamed into place, which is atomic.
+runDir -> the run's working directory (with trailing slash)
+destDir -> the directory to publish into (with trailing slash)
+runId -> from NewRunId()
+prefixes -> only files whose names start with one of these are published
+Returns -> names of the published files
+"""
+def PublishRunFiles(runDir, destDir, runId, prefixes):
+    stagingDir = destDir + '.staging_' + runId + '/'
+    os.makedirs(stagingDir)
+
+    published = []
+    try:
+        for file in sorted(os.listdir(runDir)):
+            if not file.startswith(tuple(prefixes)):
+                continue
+            shutil.move(runDir + file, stagingDir + file)
+            os.rename(stagingDir + file, destDir + file)
+            published.append(file)
+    finally:
+        if not os.listdir(stagingDir):
+            os.rmdir(stagingDir)
+
+    # Leave the run directory behind if Continuity wrote anything else into it
+    if not os.listdir(runDir):
+        os.rmdir(runDir)
+    return published
+
+""" Saves the manifest of a run as <destDir>/runs/<runId>.json (via a temporary
+file, so it is never half written).
+destDir -> the directory the run's files were published to (with trailing slash)
+runId -> from NewRunId()
+info -> anything else to record about the run: 'files' (published file names),
+        'published' (time.time() when they were published), ...
+Returns -> path of the manifest
+"""
+def WriteRunManifest(destDir, runId, info):
+    runsDir = destDir + RUNS_DIR_NAME
+    if not os.path.isdir(runsDir):
+        try:
+            os.makedirs(runsDir)
+        except OSError:
+            if not os.path.isdir(runsDir): # Another run made it first
+                raise
+
+    manifest = {'runId': runId, 'host': socket.gethostname(), 'pid': os.getpid()}
+    manifest.update(info)
+
+    manifestPath = runsDir + runId + '.json'
+    of = open(manifestPath + '.part', 'w')
+    try:
+        json.dump(manifest, of, indent=1, sort_keys=True)
+    finally:
+        of.close()
+    os.rename(manifestPath + '.part', manifestPath)
+    return manifestPath
+
+""" Finds which run published a file, from the manifests.
+destDir -> the directory the files were published to (with trailing slash)
+file -> name of a published file
+Returns -> id of the run whose copy of the file is there now, None if no run published it
+"""
+def RunOfFile(destDir, file):
+    runsDir = destDir + RUNS_DIR_NAME
+    if not os.path.isdir(runsDir):
+        return None
+
+    # The run that published it last (by 'published' time) is the one whose copy is there now
+    lastRun, lastPublished = None, None
+    for name in os.listdir(runsDir):
+        if not name.endswith('.json'):
+            continue
+        f = open(runsDir + name)
+        try:
+            manifest = json.load(f)
+        finally:
+            f.close()
+        if file in manifest.get('files', []) and (lastRun is None or manifest.get('published', 0) >= lastPublished):
+            lastRun, lastPublished = manifest['runId'], manifest.get('published', 0)
+    return lastRun
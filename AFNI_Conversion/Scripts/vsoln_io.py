@@ -0,0 +1,275 @@
+# Helpers for reading the voltage solution (Vsoln_*.npy) files written out by the
+# Continuity EP simulation. Kept free of vtk/paraview imports so that the same
+# functions can be used from pvpython, Continuity scripts and plain python.
+
+import os
+import sys
+import glob
+import json
+
+import numpy as np
+
+""" Loads a single voltage solution frame that was outputted from the Continuity EP
+simulation. The saved array has an awkward nested shape (see heart_reader.py), the
+values for every node sit at [0][0][0]; this picks them out with a single view
+instead of rebuilding the array with python lists.
+filePath -> the location to the specific voltage solution data
+Returns -> contiguous float64 array of nodal values, minimum value, maximum value
+"""
+def LoadVoltageSoln(filePath):
+    vSolns = np.load(filePath) # Location of the voltage solutions
+
+    # Same as cleaner_data[0] in heart_reader, but without the copy per row.
+    # Only copies when the file was saved as single precision.
+    values = np.ascontiguousarray(vSolns[0, 0, 0], dtype=np.float64)
+
+    return values, values.min(), values.max()
+
+## FRAME FILES *****************************************************************
+
+""" Works out which output frame a voltage solution file belongs to. Continuity
+saves the first frame without a suffix (Vsoln_testrun.npy) and every later one as
+Vsoln_testrun_<i>.npy.
+filePath -> the location to the specific voltage solution data
+Returns -> the frame number (int)
+"""
+def FrameNumber(filePath):
+    baseFileName = os.path.basename(filePath)[:-4] # get filename without the extension
+    suffix = baseFileName.rsplit('_', 1)[-1]
+    if suffix.isdigit():
+        return int(suffix)
+    return 0
+
+""" Lists the voltage solution files of a run in frame order (glob returns them in
+directory order, so Vsoln_testrun_10 would otherwise come before Vsoln_testrun_2).
+fileDir -> directory holding the Vsoln files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> list of file paths sorted by frame number
+"""
+def ListVoltageSolnFiles(fileDir, runName='testrun'):
+    relevantFiles = glob.glob(fileDir + 'Vsoln_' + runName + '_*.npy')
+    firstFile = fileDir + 'Vsoln_' + runName + '.npy'
+    if os.path.exists(firstFile):
+        relevantFiles.append(firstFile)
+
+    # Skip anything that isn't a plain frame (e.g. Vsoln_testrun_backup.npy)
+    relevantFiles = [f for f in relevantFiles
+                     if f == firstFile or os.path.basename(f)[:-4].rsplit('_', 1)[-1].isdigit()]
+    return sorted(relevantFiles, key=FrameNumber)
+
+""" Checks whether a Vsoln .npy file has been completely written, so that a frame
+can be picked up while the simulation is still running. The .npy header records
+the array's shape and dtype, so the file is complete once it is as long as the
+header says it should be.
+filePath -> the location to the specific voltage solution data
+Returns -> True if the whole array is on disk
+"""
+def IsFrameComplete(filePath):
+    try:
+        f = open(filePath, 'rb')
+    except IOError:
+        return False
+    try:
+        try:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortranOrder, dtype = np.lib.format.read_array_header_2_0(f)
+        except ValueError:
+            return False # Header not fully written yet
+        if dtype.hasobject:
+            return False
+        expectedSize = f.tell() + int(np.prod(shape)) * dtype.itemsize
+    finally:
+        f.close()
+
+    try:
+        return os.path.getsize(filePath) >= expectedSize
+    except OSError:
+        return False # Moved away in the meantime
+
+## CONSOLIDATED STORE **********************************************************
+# A run's frames packed into one (frames x nodes) float64 array on disk. The file
+# starts with a small JSON header (padded out to a page boundary) recording dtout,
+# tlen, the node count and the frame numbers, followed by the raw little-endian
+# array. Readers memory-map the array, so slicing a frame or a node's time trace
+# only touches the pages it needs.
+
+STORE_MAGIC = b'VSOLNSTORE1\n'
+STORE_ALIGN = 4096
+
+""" Packs the separate Vsoln_<runName>_<i>.npy frames of a run into one store file.
+Frames are streamed in one at a time, so the run never has to fit in memory.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+storePath -> the store file to write
+dtout -> output time step used in the simulation
+tlen -> simulation length
+runName -> the outputFileName given to SintElectrophys
+Returns -> the number of frames packed
+"""
+def PackVoltageSolns(fileDir, storePath, dtout, tlen, runName='testrun'):
+    relevantFiles = ListVoltageSolnFiles(fileDir, runName)
+    if len(relevantFiles) == 0:
+        raise IOError('No Vsoln_%s files found in %s' % (runName, fileDir))
+    # Frames 0..tlen/dtout; anything past that is left over from another run
+    lastFrame = int(round(tlen / dtout))
+    if FrameNumber(relevantFiles[-1]) > lastFrame:
+        raise ValueError('%s holds frames up to %d, past the last frame (%d) of a run of length %g at dtout %g'
+                         % (fileDir, FrameNumber(relevantFiles[-1]), lastFrame, tlen, dtout))
+
+    numNodes = LoadVoltageSoln(relevantFiles[0])[0].shape[0]
+    header = {'runName': runName,
+              'dtout': float(dtout),
+              'tlen': float(tlen),
+              'numNodes': int(numNodes),
+              'numFrames': len(relevantFiles),
+              'frames': [FrameNumber(f) for f in relevantFiles],
+              'dtype': '<f8'}
+    headerBytes = STORE_MAGIC + json.dumps(header).encode('ascii') + b'\n'
+    headerSize = ((len(headerBytes) + 8) // STORE_ALIGN + 1) * STORE_ALIGN
+
+    # Write next to the target, then rename, so readers never see half a store
+    tmpPath = storePath + '.part'
+    of = open(tmpPath, 'wb')
+    try:
+        of.write(np.array([headerSize], dtype='<u8').tobytes())
+        of.write(headerBytes)
+        of.write(b'\0' * (headerSize - 8 - len(headerBytes)))
+
+        for file in relevantFiles:
+            values = LoadVoltageSoln(file)[0]
+            if values.shape[0] != numNodes:
+                raise ValueError('%s has %d nodes, expected %d' % (file, values.shape[0], numNodes))
+            of.write(values.astype('<f8').tobytes())
+    finally:
+        of.close()
+    os.rename(tmpPath, storePath)
+
+    return len(relevantFiles)
+
+""" Read-only view of a packed voltage solution store. The data is memory-mapped,
+nothing is read from disk until a frame or trace is sliced out.
+storePath -> the store file written by PackVoltageSolns
+"""
+class VoltageSolnStore(object):
+    def __init__(self, storePath):
+        self.storePath = storePath
+
+        f = open(storePath, 'rb')
+        try:
+            headerSize = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+            headerBytes = f.read(headerSize - 8)
+        finally:
+            f.close()
+
+        if not headerBytes.startswith(STORE_MAGIC):
+            raise ValueError('%s is not a voltage solution store' % storePath)
+        header = json.loads(headerBytes[len(STORE_MAGIC):].split(b'\n', 1)[0].decode('ascii'))
+
+        self.runName = header['runName']
+        self.dtout = header['dtout']
+        self.tlen = header['tlen']
+        self.numNodes = header['numNodes']
+        self.numFrames = header['numFrames']
+        self.frames = header['frames'] # Frame number (file suffix) of each row
+        self.data = np.memmap(storePath, dtype=header['dtype'], mode='r',
+                              offset=headerSize, shape=(self.numFrames, self.numNodes))
+
+        # Frame number -> row in the store
+        self.__rows = dict((frame, row) for row, frame in enumerate(self.frames))
+
+    def __len__(self):
+        return self.numFrames
+
+    """ frameNumber -> frame number as used in the Vsoln file names
+    Returns -> nodal values of that frame (view into the store)
+    """
+    def Frame(self, frameNumber):
+        return self.data[self.__rows[frameNumber]]
+
+    """ node -> zero-indexed node number (as in _NODEFILE.csv)
+    Returns -> the node's voltage over every frame in the store
+    """
+    def NodeTrace(self, node):
+        return np.array(self.data[:, node])
+
+    """ Returns -> simulation time of every frame in the store
+    """
+    def Times(self):
+        return np.array(self.frames, dtype=np.float64) * self.dtout
+
+# Stores already opened in this process, keyed on path, size and mtime
+_openStores = {}
+
+""" Opens a packed store, reusing the memory map if this process already has the
+same (unchanged) file open. Saves re-reading the header for every frame.
+storePath -> the store file written by PackVoltageSolns
+Returns -> VoltageSolnStore
+"""
+def OpenVoltageSolnStore(storePath):
+    stat = os.stat(storePath)
+    key = (storePath, stat.st_size, stat.st_mtime)
+    if key not in _openStores:
+        _openStores.clear()
+        _openStores[key] = VoltageSolnStore(storePath)
+    return _openStores[key]
+
+""" Default location of the store for a run.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> the store file path
+"""
+def StorePath(fileDir, runName='testrun'):
+    return fileDir + 'Vsoln_' + runName + '.vstore'
+
+""" Iterates over the frames of a run, reading from the packed store when there is
+one and falling back to the separate .npy files otherwise.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> generator of (frame number, nodal values)
+"""
+def VoltageSolnFrames(fileDir, runName='testrun'):
+    storePath = StorePath(fileDir, runName)
+    if os.path.exists(storePath):
+        store = VoltageSolnStore(storePath)
+        for frameNumber in store.frames:
+            yield frameNumber, store.Frame(frameNumber)
+    else:
+        for file in ListVoltageSolnFiles(fileDir, runName):
+            yield FrameNumber(file), LoadVoltageSoln(file)[0]
+
+""" Lists the frame numbers of a run without reading any of the frames, from the
+packed store when there is one and the separate .npy files otherwise.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+runName -> the outputFileName given to SintElectrophys
+Returns -> list of frame numbers in order
+"""
+def ListVoltageSolnFrames(fileDir, runName='testrun'):
+    storePath = StorePath(fileDir, runName)
+    if os.path.exists(storePath):
+        return list(OpenVoltageSolnStore(storePath).frames)
+    return [FrameNumber(f) for f in ListVoltageSolnFiles(fileDir, runName)]
+
+""" Reads a single frame of a run, from the packed store when there is one and the
+frame's .npy file otherwise.
+fileDir -> directory holding the Vsoln files (with trailing slash)
+frameNumber -> frame number as used in the Vsoln file names
+runName -> the outputFileName given to SintElectrophys
+Returns -> nodal values of the frame
+"""
+def ReadVoltageSolnFrame(fileDir, frameNumber, runName='testrun'):
+    storePath = StorePath(fileDir, runName)
+    if os.path.exists(storePath):
+        return OpenVoltageSolnStore(storePath).Frame(frameNumber)
+    if frameNumber == 0:
+        return LoadVoltageSoln(fileDir + 'Vsoln_' + runName + '.npy')[0]
+    return LoadVoltageSoln(fileDir + 'Vsoln_%s_%d.npy' % (runName, frameNumber))[0]
+
+# python vsoln_io.py fileDir dtout tlen [runName]
+if __name__ == '__main__':
+    fileDir = sys.argv[1]
+    runName = sys.argv[4] if len(sys.argv) > 4 else 'testrun'
+    numFrames = PackVoltageSolns(fileDir, StorePath(fileDir, runName),
+                                 float(sys.argv[2]), float(sys.argv[3]), runName)
+    print('Packed %d frames into %s' % (numFrames, StorePath(fileDir, runName)))
@@ -0,0 +1,124 @@
+# Content addressed cache of the xi tables CalcXis.py computes, so the xi search is
+# skipped when the mesh geometry, the data coordinates and the xi options are the
+# same as in an earlier run (refitting with other weights, rerunning a later stage
+# on the same heart). Tables are stored by the hash of their inputs in a directory
+# shared between runs and datasets, and the least recently used ones are removed
+# once the directory grows over its disk budget.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+from frame_manifest import FileHash
+
+# Bump when the xi calculation or the key changes in a way that changes the tables
+XI_CACHE_VERSION = 2
+
+""" Hashes everything an xi table depends on.
+nodes -> node coordinates of the mesh (M x 3)
+elements -> zero-indexed node numbers per element (E x 8)
+dataFile -> the data coordinates file the xi are calculated for
+xiOptions -> dict of the options of the xi calculation (engine, subdivisions, tolerance, ...)
+geometry -> list of further arrays the element geometry depends on (nodal derivatives,
+            basis numbers, ...), hashed with their shapes
+Returns -> hex digest
+"""
+def XiCacheKey(nodes, elements, dataFile, xiOptions, geometry=()):
+    sha1 = hashlib.sha1()
+    sha1.update(json.dumps({'version': XI_CACHE_VERSION, 'options': xiOptions}, sort_keys=True).encode('utf-8'))
+    sha1.update(np.ascontiguousarray(nodes, dtype=np.float64).tobytes())
+    sha1.update(np.ascontiguousarray(elements, dtype=np.int64).tobytes())
+    for array in geometry:
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        sha1.update(json.dumps(array.shape).encode('utf-8'))
+        sha1.update(array.tobytes())
+    sha1.update(FileHash([dataFile]).encode('utf-8'))
+    return sha1.hexdigest()
+
+""" Puts the cached table for key at outputPath, hard linked when the cache is on the
+same filesystem and copied otherwise. Renamed into place, so whatever was at
+outputPath before is replaced rather than written through.
+cacheDir -> the cache directory (with trailing slash)
+Returns -> True on a hit, False if the table isn't cached
+"""
+def FetchXiTable(cacheDir, key, outputPath):
+    tablePath = cacheDir + key + '.txt'
+    if not os.path.exists(tablePath):
+        return False
+
+    tmpPath = outputPath + '.part'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    try:
+        os.link(tablePath, tmpPath)
+    except (OSError, AttributeError): # Other filesystem, or no hard links
+        shutil.copyfile(tablePath, tmpPath)
+    os.rename(tmpPath, outputPath)
+    os.utime(tablePath, None) # Most recently used
+    return True
+
+""" Copies a freshly computed table into the cache and evicts the least recently used
+tables beyond the disk budget. Tables bigger than the whole budget aren't kept.
+cacheDir -> the cache directory (with trailing slash)
+tablePath -> the table that was just computed
+maxBytes -> disk budget of the cache
+info -> anything to record next to the table (model, data file, options, ...)
+"""
+def StoreXiTable(cacheDir, key, tablePath, maxBytes, info=None):
+    if os.path.getsize(tablePath) > maxBytes:
+        return
+    if not os.path.isdir(cacheDir):
+        try:
+            os.makedirs(cacheDir)
+        except OSError:
+            if not os.path.isdir(cacheDir): # Another run made it first
+                raise
+
+    entryPath = cacheDir + key
+    shutil.copyfile(tablePath, entryPath + '.txt.part')
+    os.rename(entryPath + '.txt.part', entryPath + '.txt')
+
+    info = dict(info or {})
+    info['created'] = time.time()
+    of = open(entryPath + '.json.part', 'w')
+    try:
+        json.dump(info, of, indent=1, sort_keys=True)
+    finally:
+        of.close()
+    os.rename(entryPath + '.json.part', entryPath + '.json')
+
+    EvictXiTables(cacheDir, maxBytes)
+
+""" Removes the least recently used tables (and their info files) until the cache
+is within its disk budget.
+Returns -> keys of the removed tables
+"""
+def EvictXiTables(cacheDir, maxBytes):
+    entries = []
+    total = 0
+    for name in os.listdir(cacheDir):
+        if not name.endswith('.txt'):
+            continue
+        key = name[:-4]
+        try:
+            size = sum(os.path.getsize(cacheDir + key + ext) for ext in ('.txt', '.json')
+                       if os.path.exists(cacheDir + key + ext))
+            entries.append((os.path.getmtime(cacheDir + name), key, size))
+        except OSError: # Removed by another run meanwhile
+            continue
+        total += size
+
+    removed = []
+    for mtime, key, size in sorted(entries):
+        if total <= maxBytes:
+            break
+        for ext in ('.txt', '.json'):
+            if os.path.exists(cacheDir + key + ext):
+                os.remove(cacheDir + key + ext)
+        total -= size
+        removed.append(key)
+    return removed
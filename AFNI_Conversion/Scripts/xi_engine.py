@@ -0,0 +1,336 @@
+# Finds the element and xi coordinates of every DT data point inside the volume of a
+# hexahedral mesh with numpy, instead of Continuity's FitData 'in 3D volume' xi
+# calculation in CalcXis.py, and writes them out as the XiTable that FieldFit3D.py
+# reads ('calcType': 'from table').
+#
+# 1. The elements' bounding boxes are binned into a uniform grid, so each data point
+#    only gets tested against the few elements whose boxes cover its grid cell.
+# 2. xi is solved for every (point, candidate element) pair at once with Newton
+#    iterations on the element's trilinear map between its 8 corner nodes.
+# 3. Each point keeps the element it lies inside; points outside every element are
+#    left out of the table, as with Continuity's ignorePoints.
+#
+# Only meshes whose coordinates are trilinear between the corner nodes are supported
+# (CheckTrilinearGeometry); models with cubic Hermite or other coordinate bases are
+# rejected rather than given approximate xi. CalcXis.py keeps Continuity's calculation
+# as its default until the two have been compared on a real model
+# (bench_xi_engine.py --compare).
+#
+# The table layout (XI_TABLE_HEADER, tab separated data number, element, xi1-3) has not
+# been checked against a table Continuity wrote. Given one (referencePath), the header
+# lines and column separator are copied from it, and a table whose rows aren't those
+# five columns is refused instead of being written in a layout it doesn't have.
+# Reading a table back (ReadXiTable) takes the columns by their header names where
+# the table has them.
+#
+# python xi_engine.py _NODEFILE.csv _ELEMFILE.csv cont_DT_coords_mask_aligned.txt XiTable_<model>_DT_maskcoords.txt
+
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from mesh_io import LoadMeshArrays
+
+# Provisional, used when there is no Continuity written table to copy the layout from
+XI_TABLE_HEADER = 'Data\tElement\tXi1\tXi2\tXi3'
+# Continuity's basis number for trilinear fields (FieldFit3D.py's nb_linear)
+LINEAR_BASIS = 3
+# xi of the 8 nodes in Continuity's local node order: xi1 fastest, then xi2, then xi3
+CORNER_XI = np.array([[i & 1, (i >> 1) & 1, (i >> 2) & 1] for i in range(8)], dtype=np.float64)
+
+""" Refuses models the engine can't find xi for: the coordinates (field variables 1-3)
+have to be trilinear.
+basisValues -> the basis of each field variable (nodes.getGeomBasisValues())
+"""
+def CheckTrilinearGeometry(basisValues):
+    bases = list(basisValues)[:3]
+    if any(basis != LINEAR_BASIS for basis in bases):
+        raise ValueError('The numpy xi engine only handles trilinear coordinates (basis %d), the model has '
+                         'coordinate bases %s; use Continuity\'s xi calculation' % (LINEAR_BASIS, bases))
+
+""" Reads the data points from the CalcXis data form (coord1_val, coord1_weight,
+coord2_val, coord2_weight, coord3_val, coord3_weight, Label, Data; one header line).
+Returns -> coordinates (N x 3), data point numbers (N)
+"""
+def LoadDataPoints(dataFile):
+    data = np.loadtxt(dataFile, skiprows=1, usecols=(0, 2, 4, 7), ndmin=2, dtype=np.float64)
+    return data[:, :3], data[:, 3].astype(np.int64)
+
+## SPATIAL INDEX ***************************************************************
+
+""" Bins the elements' bounding boxes into a uniform grid of cells about the size of
+an element.
+corners -> node coordinates of every element (E x 8 x 3)
+pad -> how far to grow the boxes, so points on an element's faces aren't missed
+maxCells -> upper limit on the number of grid cells
+Returns -> (origin, cell size, grid dimensions, start of each cell's list in cellElems, cellElems)
+"""
+def BinElements(corners, pad=1e-6, maxCells=1 << 22):
+    lo, hi = corners.min(axis=1) - pad, corners.max(axis=1) + pad
+    origin = lo.min(axis=0)
+    extent = hi.max(axis=0) - origin
+    cellSize = max(np.median((hi - lo).max(axis=1)), 1e-12)
+    dims = np.ceil(extent / cellSize).astype(np.int64) + 1
+    while dims.prod() > maxCells:
+        cellSize *= 2.0
+        dims = np.ceil(extent / cellSize).astype(np.int64) + 1
+
+    # Every element is put in each cell its box overlaps
+    first = np.floor((lo - origin) / cellSize).astype(np.int64)
+    last = np.floor((hi - origin) / cellSize).astype(np.int64)
+    span = last - first + 1
+    counts = span.prod(axis=1)
+    elems = np.repeat(np.arange(len(corners)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    spanE, firstE = span[elems], first[elems]
+    i = firstE[:, 0] + local % spanE[:, 0]
+    j = firstE[:, 1] + (local // spanE[:, 0]) % spanE[:, 1]
+    k = firstE[:, 2] + local // (spanE[:, 0] * spanE[:, 1])
+    cells = (k * dims[1] + j) * dims[0] + i
+
+    order = np.argsort(cells, kind='mergesort')
+    cellStart = np.searchsorted(cells[order], np.arange(dims.prod() + 1))
+    return origin, cellSize, dims, cellStart, elems[order]
+
+""" Pairs every point with the elements binned in its grid cell.
+Returns -> point indices, element indices (one entry per pair)
+"""
+def CandidatePairs(points, index):
+    origin, cellSize, dims, cellStart, cellElems = index
+    ijk = np.floor((points - origin) / cellSize).astype(np.int64)
+    inside = np.all((ijk >= 0) & (ijk < dims), axis=1)
+    pointIdx = np.nonzero(inside)[0]
+    cells = (ijk[pointIdx, 2] * dims[1] + ijk[pointIdx, 1]) * dims[0] + ijk[pointIdx, 0]
+
+    counts = cellStart[cells + 1] - cellStart[cells]
+    pairPoints = np.repeat(pointIdx, counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return pairPoints, cellElems[np.repeat(cellStart[cells], counts) + local]
+
+## NEWTON SOLVE ****************************************************************
+
+""" Evaluates the trilinear map of many elements at once.
+corners -> node coordinates (P x 8 x 3)
+xi -> xi coordinates (P x 3)
+Returns -> x (P x 3), Jacobian dx/dxi (P x 3 x 3, J[p, c, d] = dx_c/dxi_d)
+"""
+def TrilinearMap(corners, xi):
+    # Per node and direction: xi for nodes at xi = 1, 1 - xi for nodes at xi = 0
+    factors = np.where(CORNER_XI[None] > 0, xi[:, None, :], 1.0 - xi[:, None, :])
+    x = np.einsum('pa,pac->pc', factors.prod(axis=2), corners)
+
+    sign = 2.0 * CORNER_XI - 1.0
+    dN = np.empty_like(factors)
+    for d in range(3):
+        dN[:, :, d] = sign[:, d] * factors[:, :, (d + 1) % 3] * factors[:, :, (d + 2) % 3]
+    return x, np.einsum('pad,pac->pcd', dN, corners)
+
+""" Solves J * delta = r for a batch of 3x3 systems by Cramer's rule.
+Returns -> delta (P x 3), and False for the systems whose J is singular
+"""
+def Solve3(J, r):
+    c0, c1, c2 = J[:, :, 0], J[:, :, 1], J[:, :, 2]
+    c12 = np.cross(c1, c2)
+    det = np.einsum('pc,pc->p', c0, c12)
+    ok = np.abs(det) > 1e-300
+    det = np.where(ok, det, 1.0)
+    delta = np.stack([np.einsum('pc,pc->p', r, c12),
+                      np.einsum('pc,pc->p', c0, np.cross(r, c2)),
+                      np.einsum('pc,pc->p', c0, np.cross(c1, r))], axis=1) / det[:, None]
+    return delta, ok
+
+""" Newton iterations for the xi of every (point, element) pair.
+corners -> node coordinates of each pair's element (P x 8 x 3)
+targets -> each pair's point (P x 3)
+xi0 -> starting xi (3,)
+tol -> stop once the xi update is smaller than this
+itmax -> most iterations
+vmax -> xi is kept within [1 - vmax, vmax] so far off guesses don't run away
+Returns -> xi (P x 3), converged (P)
+"""
+def NewtonXi(corners, targets, xi0, tol=1e-6, itmax=50, vmax=1.5):
+    xi = np.tile(np.asarray(xi0, dtype=np.float64), (len(targets), 1))
+    converged = np.zeros(len(targets), dtype=bool)
+    active = np.arange(len(targets))
+    for it in range(itmax):
+        if not len(active):
+            break
+        x, J = TrilinearMap(corners[active], xi[active])
+        delta, ok = Solve3(J, x - targets[active])
+        xi[active] = np.clip(xi[active] - delta, 1.0 - vmax, vmax)
+        done = ok & (np.abs(delta).max(axis=1) < tol)
+        converged[active[done]] = True
+        active = active[ok & ~done]
+    return xi, converged
+
+""" Finds the element and xi coordinates of each data point.
+nodes -> node coordinates (M x 3)
+elements -> zero-indexed node numbers per element in Continuity local node order (E x 8)
+points -> data point coordinates (N x 3)
+tol -> Newton tolerance, and how far outside [0, 1] xi can be for a point to count as inside
+chunkSize -> points handled at once, bounds the memory used
+Returns -> zero-indexed element per point (-1 when outside the mesh), xi (N x 3)
+"""
+def FindXis(nodes, elements, points, tol=1e-6, itmax=50, chunkSize=1 << 16):
+    corners = nodes[elements]
+    pad = tol * max(np.abs(corners).max(), 1.0)
+    index = BinElements(corners, pad)
+    pointElems = np.full(len(points), -1, dtype=np.int64)
+    pointXis = np.full((len(points), 3), np.nan)
+
+    for start in range(0, len(points), chunkSize):
+        pairPoints, pairElems = CandidatePairs(points[start:start + chunkSize], index)
+        pairPoints += start
+
+        # Only elements whose bounding box actually holds the point
+        pairCorners = corners[pairElems]
+        inBox = np.all((points[pairPoints] >= pairCorners.min(axis=1) - pad) &
+                       (points[pairPoints] <= pairCorners.max(axis=1) + pad), axis=1)
+        pairPoints, pairElems, pairCorners = pairPoints[inBox], pairElems[inBox], pairCorners[inBox]
+
+        # From the element centre first, then from around the corners for the pairs that didn't converge
+        xi = np.full((len(pairPoints), 3), np.nan)
+        pending = np.arange(len(pairPoints))
+        for xi0 in [(0.5, 0.5, 0.5)] + [tuple(0.25 + 0.5 * CORNER_XI[a]) for a in range(8)]:
+            if not len(pending):
+                break
+            xiTry, converged = NewtonXi(pairCorners[pending], points[pairPoints[pending]], xi0, tol, itmax)
+            xi[pending[converged]] = xiTry[converged]
+            pending = pending[~converged]
+
+        # Each point keeps the element it is furthest inside
+        outside = np.maximum(-xi, xi - 1.0).max(axis=1)
+        found = ~np.isnan(outside) & (outside <= tol)
+        pairPoints, pairElems, xi, outside = pairPoints[found], pairElems[found], xi[found], outside[found]
+        order = np.lexsort((outside, pairPoints))
+        first = order[np.r_[True, pairPoints[order][1:] != pairPoints[order][:-1]]] if len(order) else order
+        pointElems[pairPoints[first]] = pairElems[first]
+        pointXis[pairPoints[first]] = np.clip(xi[first], 0.0, 1.0)
+    return pointElems, pointXis
+
+## XI TABLE ********************************************************************
+
+""" Saves the xi table FieldFit3D.py reads: one row per data point inside the mesh
+with its data point number, element (numbered from 1 like Continuity) and xi1-3.
+Written to a temporary file first.
+layout -> (header, delimiter) from ReadXiTableLayout, the provisional one by default
+"""
+def WriteXiTable(outputPath, dataNumbers, pointElems, pointXis, layout=None):
+    header, delimiter = layout or (XI_TABLE_HEADER, '\t')
+    found = pointElems >= 0
+    table = np.column_stack([dataNumbers[found], pointElems[found] + 1, pointXis[found]])
+    of = open(outputPath + '.part', 'w')
+    try:
+        np.savetxt(of, table, fmt=['%d', '%d', '%.9f', '%.9f', '%.9f'], delimiter=delimiter,
+                   header=header, comments='')
+    finally:
+        of.close()
+    os.rename(outputPath + '.part', outputPath)
+
+""" Takes the layout of an xi table Continuity wrote: the lines before its first numeric
+row, verbatim, and the separator between the columns of that row. Raises ValueError
+if the table isn't the five columns WriteXiTable writes, in its order (data, element,
+xi1-3).
+Returns -> header, delimiter (None if the table has no numeric row)
+"""
+def ReadXiTableLayout(xiPath):
+    headerLines = []
+    f = open(xiPath)
+    try:
+        for line in f:
+            line = line.rstrip('\r\n')
+            fields = line.replace(',', ' ').split()
+            try:
+                numbers = [float(v) for v in fields[:5]]
+            except ValueError: # Header or other text
+                numbers = []
+            if len(numbers) < 5:
+                headerLines.append(line)
+                continue
+            if len(fields) != 5 or XiTableColumns(headerLines[-1] if headerLines else '') not in (None, list(range(5))):
+                raise ValueError('%s is not in the column order data, element, xi1-3 the numpy xi engine '
+                                 'writes: its layout is unknown' % xiPath)
+            delimiter = re.match(r'\s*[^\s,]+(\s*,\s*|\s+)', line).group(1)
+            return '\n'.join(headerLines), delimiter
+    finally:
+        f.close()
+    return None
+
+""" Finds the data, element and xi1-3 columns from the names in a header line (case,
+spaces and punctuation ignored: 'Data', 'Element', 'Xi1' or 'xi(1)', ...).
+Returns -> the five column indices, or None if the line doesn't name all of them
+"""
+def XiTableColumns(headerLine):
+    sep = '\t' if '\t' in headerLine else (',' if ',' in headerLine else None)
+    names = [re.sub(r'[^a-z0-9]', '', name.lower()) for name in headerLine.strip().split(sep)]
+    wanted = [lambda n: n.startswith('data') or n in ('point', 'dp'), lambda n: n.startswith('elem'),
+              lambda n: n == 'xi1', lambda n: n == 'xi2', lambda n: n == 'xi3']
+    columns = []
+    for match in wanted:
+        found = [k for k, name in enumerate(names) if match(name)]
+        if len(found) != 1:
+            return None
+        columns.append(found[0])
+    return columns
+
+""" Reads an xi table back (also a Continuity written one). The columns are taken by
+name from the header line just before the first numeric row if it names them
+(XiTableColumns); without such a header the rows have to be the five columns
+WriteXiTable writes, data, element, xi1-3, and a table with more columns is refused
+rather than guessed at.
+Returns -> data point numbers, elements (numbered from 1), xi (N x 3)
+"""
+def ReadXiTable(xiPath):
+    rows, columns, lastText = [], None, ''
+    f = open(xiPath)
+    try:
+        for line in f:
+            fields = line.replace(',', ' ').split()
+            if columns is None:
+                try:
+                    [float(v) for v in fields[:5]]
+                except ValueError: # Header or other text
+                    lastText = line if fields else lastText
+                    continue
+                if len(fields) < 5:
+                    lastText = line if fields else lastText
+                    continue
+                columns = XiTableColumns(lastText)
+                if columns is None and len(fields) != 5:
+                    raise ValueError('%s has %d columns and no header naming the data, element and xi1-3 '
+                                     'ones' % (xiPath, len(fields)))
+                columns = columns or range(5)
+            try:
+                rows.append([float(fields[k]) for k in columns])
+            except (ValueError, IndexError): # Other text
+                continue
+    finally:
+        f.close()
+    table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return table[:, 0].astype(np.int64), table[:, 1].astype(np.int64), table[:, 2:5]
+
+""" Computes the xi table for a mesh and a data file.
+nodes -> node coordinates (M x 3)
+elements -> zero-indexed node numbers per element (E x 8)
+dataFile -> CalcXis data form (cont_DT_coords_mask_aligned.txt)
+outputPath -> the XiTable to write
+referencePath -> a table Continuity wrote, whose layout is copied (ReadXiTableLayout)
+Returns -> number of points in the table, number of data points
+"""
+def CalcXiTable(nodes, elements, dataFile, outputPath, tol=1e-6, itmax=50, referencePath=None):
+    points, dataNumbers = LoadDataPoints(dataFile)
+    pointElems, pointXis = FindXis(np.asarray(nodes, dtype=np.float64), np.asarray(elements, dtype=np.int64),
+                                   points, tol, itmax)
+    layout = ReadXiTableLayout(referencePath) if referencePath else None
+    WriteXiTable(outputPath, dataNumbers, pointElems, pointXis, layout)
+    return int((pointElems >= 0).sum()), len(points)
+
+if __name__ == '__main__':
+    nodes, elements = LoadMeshArrays(sys.argv[1], sys.argv[2])
+    start = time.time()
+    numFound, numPoints = CalcXiTable(nodes, elements, sys.argv[3], sys.argv[4])
+    print('%d of %d data points inside the mesh, xi table %s written in %.1fs'
+          % (numFound, numPoints, sys.argv[4], time.time() - start))
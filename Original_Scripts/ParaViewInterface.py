@@ -1,7 +1,411 @@
-import xml.etree.cElementTree as XML
+try:
+    import xml.etree.cElementTree as XML
+except ImportError:
+    # cElementTree was removed in python 3.9, ElementTree is the C version there
+    import xml.etree.ElementTree as XML
 import os
+import zlib
+import tempfile
+import multiprocessing
+import hashlib
+import json
+from collections import OrderedDict
+from xml.sax.saxutils import quoteattr
 import numpy
 
+try:
+    rangeType = xrange # python 2, where range() returns a list
+except NameError:
+    rangeType = range
+
+
+class VTUWriter:
+    """
+        Streams a .vtu file to disk: the XML tags are written as they are
+        started and ended, and each DataArray is converted from its numpy array
+        chunkSize bytes at a time, so memory use does not grow with the mesh.
+        In "binary" mode each array is raw appended data after the XML (a UInt64
+        byte count then the little endian values, or zlib compressed blocks when
+        compress is set). Raw arrays are only read when the appended section is
+        written at close(), so views and ranges passed in never get copied whole;
+        compressed blocks are spooled to a temporary file until then.
+        "ascii" mode writes the values into the XML as readable text (slow and
+        big, for debugging).
+        The file is written as filename.part and renamed by close().
+    """
+    types = {"Float32": "<f4", "Float64": "<f8", "Int32": "<i4", "Int64": "<i8", "UInt8": "u1"}
+    # same block size vtkZLibDataCompressor uses
+    blockSize = 32768
+    chunkSize = 1 << 22
+
+    def __init__(self, filename, dataFormat="binary", compress=False):
+        if dataFormat not in ("binary", "ascii"):
+            raise ValueError("Unknown VTK data format '%s'" % dataFormat)
+        self.filename = filename
+        self.dataFormat = dataFormat
+        self.compress = compress
+        self.arrays = []
+        self.offset = 0
+        self.spool = None
+        self.openElements = []
+
+        self.file = open(filename + ".part", "wb")
+        self.file.write(b'<?xml version="1.0"?>\n')
+        attributes = {"type": "UnstructuredGrid", "version": "1.0",
+                      "byte_order": "LittleEndian", "header_type": "UInt64"}
+        if dataFormat == "binary" and compress:
+            attributes["compressor"] = "vtkZLibDataCompressor"
+        self.start("VTKFile", **attributes)
+
+    def tag(self, name, attributes, close=""):
+        text = "<" + name
+        for attribute in sorted(attributes):
+            text += " " + attribute + "=" + quoteattr(str(attributes[attribute]))
+        return (text + close + ">").encode("utf-8")
+
+    def start(self, name, **attributes):
+        self.file.write(self.tag(name, attributes) + b"\n")
+        self.openElements.append(name)
+
+    def end(self, name):
+        if self.openElements.pop() != name:
+            raise ValueError("Closing <%s> out of order" % name)
+        self.file.write(("</" + name + ">\n").encode("utf-8"))
+
+    def dataArray(self, array, vtkType, nanValue=None, **attributes):
+        """
+            Writes a DataArray for array, one row per tuple. array can be
+            anything numpy can convert a slice of (arrays, views, range objects).
+            nanValue -> value NaNs are written as (None leaves them as NaN)
+        """
+        dtype = numpy.dtype(self.types[vtkType])
+        attributes["type"] = vtkType
+        if self.dataFormat == "ascii":
+            attributes["format"] = "ascii"
+            self.file.write(self.tag("DataArray", attributes) + b"\n")
+            for chunk in self.chunks(array, dtype, nanValue):
+                numpy.savetxt(self.file, chunk.reshape(len(chunk), -1), fmt="%d" if dtype.kind in "iu" else "%.9g")
+            self.file.write(b"</DataArray>\n")
+            return
+
+        attributes["format"] = "appended"
+        attributes["offset"] = self.offset
+        self.file.write(self.tag("DataArray", attributes, close="/") + b"\n")
+        if self.compress:
+            header, start, length = self.spoolCompressed(array, dtype, nanValue)
+            self.arrays.append((header, start, length))
+            self.offset += len(header) + length
+        else:
+            self.arrays.append((array, dtype, nanValue))
+            self.offset += 8 + len(array) * self.valuesPerRow(array) * dtype.itemsize
+
+    def valuesPerRow(self, array):
+        if isinstance(array, rangeType):
+            return 1
+        return int(numpy.prod(numpy.shape(array[:1])[1:]))
+
+    def chunks(self, array, dtype, nanValue):
+        rows = max(1, self.chunkSize // (self.valuesPerRow(array) * dtype.itemsize))
+        if isinstance(array, rangeType) and len(array):
+            # python 2's xrange can't be sliced, its values follow from the first and the step
+            first = array[0]
+            step = array[1] - first if len(array) > 1 else 1
+        for start in rangeType(0, len(array), rows):
+            if isinstance(array, rangeType):
+                stop = min(start + rows, len(array))
+                chunk = (first + step * numpy.arange(start, stop, dtype=numpy.int64)).astype(dtype)
+            else:
+                chunk = numpy.array(array[start:start + rows], dtype=dtype)
+            if nanValue is not None and dtype.kind == "f":
+                chunk[numpy.isnan(chunk)] = nanValue
+            yield chunk
+
+    def spoolCompressed(self, array, dtype, nanValue):
+        """
+            Compresses array in blockSize blocks into the spool file.
+            Returns -> the block header, where the blocks start in the spool, their total size
+        """
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile()
+        start = self.spool.tell()
+        sizes = []
+        pending = b""
+        for chunk in self.chunks(array, dtype, nanValue):
+            data = pending + chunk.tobytes()
+            full = len(data) - len(data) % self.blockSize
+            for i in range(0, full, self.blockSize):
+                block = zlib.compress(data[i:i + self.blockSize])
+                self.spool.write(block)
+                sizes.append(len(block))
+            pending = data[full:]
+        if pending:
+            block = zlib.compress(pending)
+            self.spool.write(block)
+            sizes.append(len(block))
+
+        # header: number of blocks, block size, size of the last (partial) block,
+        # then the compressed size of each block
+        header = numpy.array([len(sizes), self.blockSize, len(pending)] + sizes, dtype="<u8").tobytes()
+        return header, start, self.spool.tell() - start
+
+    def close(self):
+        """
+            Writes the appended data section, closes the document and moves it
+            into place.
+        """
+        try:
+            if self.openElements != ["VTKFile"]:
+                raise ValueError("Elements left open: %s" % ", ".join(self.openElements[1:]))
+            if self.arrays:
+                self.file.write(b'<AppendedData encoding="raw">\n_')
+                if self.compress:
+                    for header, start, length in self.arrays:
+                        self.file.write(header)
+                        self.spool.seek(start)
+                        while length > 0:
+                            block = self.spool.read(min(length, self.chunkSize))
+                            self.file.write(block)
+                            length -= len(block)
+                else:
+                    for array, dtype, nanValue in self.arrays:
+                        self.file.write(numpy.array([len(array) * self.valuesPerRow(array) * dtype.itemsize], dtype="<u8").tobytes())
+                        for chunk in self.chunks(array, dtype, nanValue):
+                            self.file.write(chunk.tobytes())
+                self.file.write(b'\n</AppendedData>\n')
+            self.end("VTKFile")
+        except Exception:
+            self.abort()
+            raise
+        self.release()
+        os.rename(self.filename + ".part", self.filename)
+
+    def abort(self):
+        """
+            Gives up on the file, removing what was written of it.
+        """
+        self.release()
+        if os.path.exists(self.filename + ".part"):
+            os.remove(self.filename + ".part")
+
+    def release(self):
+        self.file.close()
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+def writeMeshVTU(filename, vertices, elements, dataFormat="binary", compress=False):
+    """
+        Writes a mesh out as a .vtu file.
+        vertices -> nodes, columns 0-2 are coordinates, the rest field variables
+        elements -> zero based node numbers, 8 per element (or 4 for 2D)
+    """
+    # determine if elements are 2D
+    elements2D = elements.shape[1] < 8
+
+    # top level header
+    writer = VTUWriter(filename, dataFormat, compress)
+    try:
+        # UnstructuredGrid top level
+        writer.start("UnstructuredGrid")
+
+        # made of multiple independent pieces, this is the base geometry
+        writer.start("Piece", NumberOfPoints=len(vertices), NumberOfCells=len(elements))
+
+        # contains points, cells, pointData(optional), cellData(optional)
+
+        # points level, NumberOfComponents = length of a vertex definition
+        writer.start("Points")
+        # all rows, columns 0, 1, 2
+        writer.dataArray(vertices[:, :3], "Float32", NumberOfComponents="3")
+        writer.end("Points")
+
+        # cells level
+        writer.start("Cells")
+
+        # connectivity of points to make the cells, all appended
+        if(not elements2D):
+            connectivity = elements[:, [0, 2, 3, 1, 4, 6, 7, 5]]
+        else:
+            connectivity = elements[:, [0, 2, 3, 1]]
+        writer.dataArray(connectivity, "Int32", Name="connectivity")
+
+        # delimiters of where each cell definition ends, ex for a cell def of 4
+        # points the first offset would be 4, then 8, then 12 and so on.
+        # 4 for quad, 8 for hexahedron
+        elementOffsetIncrement = 4 if elements2D else 8
+        offsets = rangeType(elementOffsetIncrement, elementOffsetIncrement * (len(elements) + 1), elementOffsetIncrement)
+        writer.dataArray(offsets, "Int32", Name="offsets")
+
+        # cell type of each cell in order 9 for quad, 12 for hexahedron
+        cellTypes = numpy.broadcast_to(numpy.uint8(9 if elements2D else 12), (len(elements),))
+        writer.dataArray(cellTypes, "UInt8", Name="types")
+        writer.end("Cells")
+
+        # pointData level, skip if no data fields
+        if(vertices.shape[1] > 3):
+            writer.start("PointData")
+            for fieldVar in range(3, vertices.shape[1]):  # these are the field variables that are not coordinates
+                writer.dataArray(vertices[:, fieldVar], "Float32", Name="FieldVariable " + str(fieldVar-2)) # -2 in order to start numbering at 1 (for variable index 3)
+            writer.end("PointData")
+
+        writer.end("Piece")
+        writer.end("UnstructuredGrid")
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def writeFiberVTU(filename, coordinates, tensors, dataFormat="binary", compress=False):
+    """
+        Writes fibres out as a .vtu file of vertex cells.
+        coordinates -> fibre positions, one row per fibre
+        tensors -> 3x3 fibre tensor per fibre
+    """
+    # views of the fibre arrays, the writer converts them a chunk at a time
+    coordinates = numpy.asarray(coordinates)
+    numFibers = len(coordinates)
+    if numFibers == 0:
+        # no fibres, still a valid piece with zero points
+        coordinates = numpy.zeros((0, 3))
+        tensors = numpy.zeros((0, 3, 3))
+    else:
+        coordinates = coordinates.reshape(numFibers, -1)
+
+    # top level header
+    writer = VTUWriter(filename, dataFormat, compress)
+    try:
+        # UnstructuredGrid top level
+        writer.start("UnstructuredGrid")
+
+        # made of multiple independent pieces, this is the fibers section
+        writer.start("Piece", NumberOfPoints=numFibers, NumberOfCells=numFibers)
+
+        # contains points, cells, pointData(optional), cellData(optional)
+
+        # points level, NumberOfComponents = length of a vertex definition
+        writer.start("Points")
+        writer.dataArray(coordinates[:, :3], "Float32", NumberOfComponents="3")
+        writer.end("Points")
+
+        # cells level
+        writer.start("Cells")
+
+        # connectivity of points to make the cells, all appended
+        writer.dataArray(rangeType(numFibers), "Int32", Name="connectivity")
+
+        # delimiters of where each cell definition ends, ex for a cell def of 4
+        # points the first offset would be 4, then 8, then 12 and so on.
+        writer.dataArray(rangeType(1, numFibers + 1), "Int32", Name="offsets")
+
+        # cell type of each cell in order 1 vertex
+        writer.dataArray(numpy.broadcast_to(numpy.uint8(1), (numFibers,)), "UInt8", Name="types")
+        writer.end("Cells")
+
+        # pointData level
+        writer.start("PointData", Vectors="Vector")
+
+        # row i of each fibre's tensor goes into its own vector array, NaNs as 0
+        tensors = numpy.asarray(tensors).reshape(numFibers, 3, 3)
+        for i in range(3):
+            writer.dataArray(tensors[:, i, :], "Float32", nanValue=0,
+                             Name=FIBER_ARRAYS[i], NumberOfComponents="3")
+        writer.end("PointData")
+
+        writer.end("Piece")
+        writer.end("UnstructuredGrid")
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+FIBER_ARRAYS = ("FibersX", "FibersY", "FibersZ")
+
+
+def writePiece(piece):
+    """
+        Pool worker: piece is (write function, its arguments...).
+    """
+    piece[0](*piece[1:])
+
+
+def writePieces(pieces, numWorkers=1):
+    """
+        Writes the pieces of a partitioned file, one after the other unless
+        numWorkers is more than 1. The pool forks the calling process, which
+        inside Continuity is the whole GUI (its threads and open windows
+        included), so only ask for workers when that is known to be safe, e.g.
+        from a batch run. If the pool can't be started the pieces are written
+        one after the other.
+        numWorkers -> number of processes (None for one per cpu)
+    """
+    if (numWorkers is not None and numWorkers <= 1) or len(pieces) < 2:
+        for piece in pieces:
+            writePiece(piece)
+        return
+    try:
+        pool = multiprocessing.Pool(numWorkers)
+    except (OSError, ImportError, NotImplementedError) as e:
+        print("Could not start %s processes to write the pieces (%r), writing them one by one."
+              % (numWorkers or "the", e))
+        for piece in pieces:
+            writePiece(piece)
+        return
+    try:
+        pool.map(writePiece, pieces, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def writePVTU(filename, pieceFiles, pointArrays, vectors=None):
+    """
+        Writes the .pvtu index that ties the pieces together.
+        pieceFiles -> the piece .vtu files, in the same directory as filename
+        pointArrays -> (name, number of components) of each PointData array
+        vectors -> name for the PointData Vectors attribute
+    """
+    vtkFile = XML.Element("VTKFile", type="PUnstructuredGrid", version="1.0",
+                          byte_order="LittleEndian", header_type="UInt64")
+    grid = XML.SubElement(vtkFile, "PUnstructuredGrid", GhostLevel="0")
+    pointData = XML.SubElement(grid, "PPointData")
+    if vectors is not None:
+        pointData.set("Vectors", vectors)
+    for name, numComponents in pointArrays:
+        XML.SubElement(pointData, "PDataArray", type="Float32", Name=name, NumberOfComponents=str(numComponents))
+    points = XML.SubElement(grid, "PPoints")
+    XML.SubElement(points, "PDataArray", type="Float32", NumberOfComponents="3")
+    for pieceFile in pieceFiles:
+        XML.SubElement(grid, "Piece", Source=os.path.basename(pieceFile))
+    XML.ElementTree(vtkFile).write(filename, xml_declaration=True)
+
+
+def modelFingerprint(vf, refineArgs):
+    """
+        Hash of the loaded model's elements, nodal field values (every field
+        variable and derivative) and the basis each field is interpolated with
+        (with the derivatives in use), together with the arguments the mesh is
+        refined with. Any edit to the model or the refinement changes it.
+    """
+    sha1 = hashlib.sha1(json.dumps(refineArgs, sort_keys=True).encode("utf-8"))
+    elements = numpy.ascontiguousarray(vf.stored_data.elem.obj.elements, dtype=numpy.int64)
+    sha1.update(str(elements.shape).encode("utf-8"))
+    sha1.update(elements.tobytes())
+    nodes = vf.stored_data.nodes.obj
+    # same nodal values interpolated with another basis (e.g. linear instead of cubic Hermite) refine differently
+    for basis in (nodes.getGeomBasisValues(), nodes.getEnabledDerivs()):
+        values = numpy.ascontiguousarray(basis, dtype=numpy.float64)
+        sha1.update(str(values.shape).encode("utf-8"))
+        sha1.update(values.tobytes())
+    for i in range(len(nodes)):
+        for deriv in nodes.nodes[i].derivs:
+            values = numpy.ascontiguousarray(deriv, dtype=numpy.float64)
+            sha1.update(str(values.shape).encode("utf-8"))
+            sha1.update(values.tobytes())
+    return sha1.hexdigest()
+
 
 class ParaViewOutput:
     """
@@ -11,6 +415,21 @@ class ParaViewOutput:
     fibers = None
     path = "ParaView/vtkFiles/"
     filename = path + "out"
+    # "binary" (raw appended data) or "ascii" (readable, for debugging)
+    dataFormat = "binary"
+    # zlib compress the binary arrays
+    compress = False
+    # more than 1 writes a .pvtu index and that many .vtu pieces
+    numPieces = 1
+    # processes writing the pieces (None for one per cpu); more than 1 forks the
+    # Continuity process, see writePieces()
+    numWorkers = 1
+    # refined meshes kept in memory, keyed on modelFingerprint()
+    meshCacheSize = 4
+    # directory to also keep refined meshes in across sessions (None for memory only)
+    meshCacheDir = None
+
+    __meshCache = OrderedDict()
 
     __elements = None
     __vertices = None
@@ -25,20 +444,26 @@ class ParaViewOutput:
         cls.getMesh(refinement=3)
 
         print("Outputting mesh data.")
-        cls.outputMeshVTU()
+        if(cls.numPieces > 1):
+            cls.outputMeshPVTU()
+        else:
+            cls.outputMeshVTU()
         if(cls.fibers != None):
             print("Outputting fiber data.")
-            cls.outputFiberVTU()
+            if(cls.numPieces > 1):
+                cls.outputFiberPVTU()
+            else:
+                cls.outputFiberVTU()
     @classmethod
     def removeExistingVTKFiles(cls):
         # remove any existing vtk files
         for file in os.listdir(cls.path):
-            if file.endswith(".vtu"):
+            if file.endswith(".vtu") or file.endswith(".pvtu"):
                 filepath = os.path.join(cls.path, file)
                 os.remove(filepath)
 
     @classmethod
-    def getMesh(cls, refinement=1):
+    def getMesh(cls, refinement=1, useCache=True):
         refineArgs = {
             'elemsPerElem': [refinement, refinement, refinement],
             'nodesPerElem': [2, 2, 2],
@@ -59,6 +484,10 @@ class ParaViewOutput:
             'preserveNodeNumbers': 0
         }
         from blenderScripts.Continuity.continuityShellAccess import getContVF
+        if(useCache):
+            key = modelFingerprint(getContVF(), refineArgs)
+            if(cls.loadCachedMesh(key)):
+                return
         if(not getContVF().calculatedMesh):
             getContVF().calc_mesh()
         # get elements and nodes (nodes are in xi(relative to element) form)
@@ -76,6 +505,57 @@ class ParaViewOutput:
         # from 0 to the last multiple of 8 that is in the node list
         fieldVarIndexList = list(range(0, len(nodes[0]), 8))
         cls.__vertices = numpy.array(nodes)[:, fieldVarIndexList]
+        if(useCache):
+            cls.storeCachedMesh(key)
+
+    @classmethod
+    def loadCachedMesh(cls, key):
+        """
+            Sets the refined mesh from the cache (memory first, then meshCacheDir).
+            Returns -> whether the mesh was cached
+        """
+        if(key in cls.__meshCache):
+            cls.__elements, cls.__vertices = cls.__meshCache.pop(key)
+            cls.__meshCache[key] = (cls.__elements, cls.__vertices) # most recently used
+            return True
+        if(cls.meshCacheDir is None):
+            return False
+        cachePath = os.path.join(cls.meshCacheDir, "mesh_" + key + ".npz")
+        if(not os.path.exists(cachePath)):
+            return False
+        try:
+            cache = numpy.load(cachePath)
+            try:
+                cls.__elements, cls.__vertices = cache["elements"], cache["vertices"]
+            finally:
+                cache.close()
+        except (IOError, ValueError, KeyError):
+            return False # unreadable, refine again and overwrite it
+        cls.storeCachedMesh(key, toDisk=False)
+        return True
+
+    @classmethod
+    def storeCachedMesh(cls, key, toDisk=True):
+        cls.__meshCache.pop(key, None)
+        cls.__meshCache[key] = (cls.__elements, cls.__vertices)
+        while(len(cls.__meshCache) > cls.meshCacheSize):
+            cls.__meshCache.popitem(last=False)
+
+        if(toDisk and cls.meshCacheDir is not None):
+            if(not os.path.isdir(cls.meshCacheDir)):
+                os.makedirs(cls.meshCacheDir)
+            # written to a temporary file first, so a reader never sees half a cache
+            cachePath = os.path.join(cls.meshCacheDir, "mesh_" + key + ".npz")
+            of = open(cachePath + ".part", "wb")
+            try:
+                numpy.savez(of, elements=cls.__elements, vertices=cls.__vertices)
+            finally:
+                of.close()
+            os.rename(cachePath + ".part", cachePath)
+
+    @classmethod
+    def clearMeshCache(cls):
+        cls.__meshCache.clear()
 
     """
     @classmethod
@@ -99,164 +579,48 @@ class ParaViewOutput:
     def outputMeshVTU(cls):
         #from blenderScripts.Continuity.continuityShellAccess import getContVF
         #contVF = getContVF()
+        writeMeshVTU(cls.filename + ".vtu", cls.__vertices, cls.__elements, cls.dataFormat, cls.compress)
 
-        # determine if elements are 2D
-        elements2D = False
-        try:
-            cls.__elements[0][7]
-        except IndexError as e:
-            elements2D = True
-
-        # top level header
-        vtkFile = XML.Element("VTKFile", type="UnstructuredGrid",
-                              version="0.1", byte_order="LittleEndian")
-        # UnstructuredGrid top level
-        unstructuredGrid = XML.SubElement(vtkFile, "UnstructuredGrid")
-
-        # made of multiple independent pieces, this is the base geometry
-        pieceBase = XML.SubElement(unstructuredGrid, "Piece", NumberOfPoints=str(
-            len(cls.__vertices)), NumberOfCells=str(len(cls.__elements)))
-
-        # contains points, cells, pointData(optional), cellData(optional)
-
-        # points level, NumberOfComponents = length of a vertex definition
-        points = XML.SubElement(pieceBase, "Points")
-        pointString = []
-        # all rows, columns 0, 1, 2
-        for x, y, z in cls.__vertices[:, list(range(3))]:
-            pointString.append("" + str(x) + " " +
-                               str(y) + " " + str(z) + "\n")
-        pointString = ''.join(pointString)
-        dataArrayPoints = XML.SubElement(
-            points, "DataArray", type="Float32", NumberOfComponents="3", format="ascii").text = pointString
-
-        # cells level
-        cells = XML.SubElement(pieceBase, "Cells")
-
-        # connectivity of points to make the cells, all appended
-        connectivityString = []
-        for element in cls.__elements:
-            cellString = None
-            if(not elements2D):
-                cellString = str(element[0]) + " " + str(element[2]) + " " + str(element[3]) + " " + str(element[1]) + " " + str(
-                    element[4]) + " " + str(element[6]) + " " + str(element[7]) + " " + str(element[5]) + "\n"
-            else:
-                cellString = str(element[0]) + " " + str(element[2]) + \
-                    " " + str(element[3]) + " " + str(element[1]) + "\n"
-            connectivityString.append(cellString)
-        connectivityString = ''.join(connectivityString)
-        dataArrayCellsConnectivity = XML.SubElement(
-            cells, "DataArray", type="Int32", Name="connectivity", format="ascii").text = connectivityString
-
-        # delimiters of where each cell definition ends, ex for a cell def of 4
-        # points the first offset would be 4, then 8, then 12 and so on.
-        offsetsString = []
-        # 4 for quad, 8 for hexahedron
-        elementOffsetIncrement = 4 if elements2D else 8
-        elementOffsetNumber = elementOffsetIncrement
-        while(elementOffsetNumber <= elementOffsetIncrement * len(cls.__elements)):
-            offsetsString.append(str(elementOffsetNumber) + "\n")
-            elementOffsetNumber += elementOffsetIncrement
-        offsetsString = ''.join(offsetsString)
-        dataArrayCellsOffsets = XML.SubElement(
-            cells, "DataArray", type="Int32", Name="offsets", format="ascii").text = offsetsString
-
-        # cell type of each cell in order 9 for quad, 12 for hexahedron
-        cellType = "9\n" if elements2D else "12\n"
-        cellTypesString = [cellType] * len(cls.__elements)
-        cellTypesString = ''.join(cellTypesString)
-        dataArrayCellsOffsets = XML.SubElement(
-            cells, "DataArray", type="UInt8", Name="types", format="ascii").text = cellTypesString
-
-        # pointData level, skip if no data fields
-        if(len(cls.__vertices[0]) > 3):
-            pointData = XML.SubElement(pieceBase, "PointData")
-            for fieldVar in range(3, len(cls.__vertices[0])):  # these are the field variables that are not coordinates
-                fieldString = []
-                for i in range(len(cls.__vertices)):
-                    fieldString.append(str(cls.__vertices[i, fieldVar]) + "\n")
-                fieldString = ''.join(fieldString)
-                field = XML.SubElement(pointData, "DataArray", type="Float32", Name="FieldVariable " + str(fieldVar-2), format="ascii").text = fieldString # -2 in order to start numbering at 1 (for variable index 3)
-
-        # get the tree starting at the root of the vtkFile level, then write to
-        # file
-        vtuFile = XML.ElementTree(vtkFile)
-        vtuFile.write(cls.filename + ".vtu", xml_declaration=True)
+    @classmethod
+    def outputMeshPVTU(cls):
+        # blocks of consecutive elements, each with only the nodes it uses
+        pieces = []
+        for block in numpy.array_split(cls.__elements, cls.numPieces):
+            if len(block) == 0:
+                continue
+            used, local = numpy.unique(block, return_inverse=True)
+            pieceFile = cls.filename + "_" + str(len(pieces)) + ".vtu"
+            pieces.append((writeMeshVTU, pieceFile, cls.__vertices[used],
+                           local.reshape(block.shape).astype(numpy.int32), cls.dataFormat, cls.compress))
+        writePieces(pieces, cls.numWorkers)
+
+        fieldVars = [("FieldVariable " + str(fieldVar-2), 1) for fieldVar in range(3, cls.__vertices.shape[1])]
+        writePVTU(cls.filename + ".pvtu", [piece[1] for piece in pieces], fieldVars)
 
     @classmethod
     def outputFiberVTU(cls):
-        # top level header
-        vtkFile = XML.Element("VTKFile", type="UnstructuredGrid",
-                              version="0.1", byte_order="LittleEndian")
-        # UnstructuredGrid top level
-        unstructuredGrid = XML.SubElement(vtkFile, "UnstructuredGrid")
-
-        # made of multiple independent pieces, this is the fibers section
-        pieceFibers = XML.SubElement(unstructuredGrid, "Piece", NumberOfPoints=str(len(
-            cls.fibers['coordinates'])), NumberOfCells=str(len(cls.fibers['coordinates'])))
-
-        # contains points, cells, pointData(optional), cellData(optional)
+        writeFiberVTU(cls.filename + "Fiber.vtu", cls.fibers['coordinates'], cls.fibers['tensors'],
+                      cls.dataFormat, cls.compress)
 
-        # points level, NumberOfComponents = length of a vertex definition
-        points = XML.SubElement(pieceFibers, "Points")
-        pointString = []
-        for vertex in cls.fibers['coordinates']:
-            pointString.append(
-                "" + str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n")
-        pointString = ''.join(pointString)
-        dataArrayPoints = XML.SubElement(
-            points, "DataArray", type="Float32", NumberOfComponents="3", format="ascii").text = pointString
-
-        # cells level
-        cells = XML.SubElement(pieceFibers, "Cells")
-
-        # connectivity of points to make the cells, all appended
-        connectivityString = []
-        for i in range(len(cls.fibers['coordinates'])):
-            connectivityString.append(str(i) + "\n")
-        connectivityString = ''.join(connectivityString)
-        dataArrayCellsConnectivity = XML.SubElement(
-            cells, "DataArray", type="Int32", Name="connectivity", format="ascii").text = connectivityString
-
-        # delimiters of where each cell definition ends, ex for a cell def of 4
-        # points the first offset would be 4, then 8, then 12 and so on.
-        offsetsString = []
-        for i in range(1, len(cls.fibers['coordinates']) + 1):
-            offsetsString.append(str(i) + "\n")
-        offsetsString = ''.join(offsetsString)
-        dataArrayCellsOffsets = XML.SubElement(
-            cells, "DataArray", type="Int32", Name="offsets", format="ascii").text = offsetsString
-
-        # cell type of each cell in order 1 vertex
-        cellTypesString = ["1\n"] * len(cls.fibers['coordinates'])
-        cellTypesString = ''.join(cellTypesString)
-        dataArrayCellsOffsets = XML.SubElement(
-            cells, "DataArray", type="UInt8", Name="types", format="ascii").text = cellTypesString
-
-        # pointData level
-        pointData = XML.SubElement(pieceFibers, "PointData", Vectors="Vector")
-
-        tensorData = ([], [], [])
-        tensorName = ("FibersX", "FibersY", "FibersZ")
-        for tensor in cls.fibers['tensors']:
-            for i in range(3):
-                tensorLine = ""
-                for j in range(3):
-                    value = str(tensor[i][j])
-                    if value == "nan":
-                        value = "0"
-                    tensorLine = tensorLine + value + " "
-                tensorLine += "\n"
-                tensorData[i].append(tensorLine)
-
-        for i in range(3):
-            XML.SubElement(pointData, "DataArray", type="Float32",
-                           Name=tensorName[i], format="ascii", NumberOfComponents="3").text = ''.join(tensorData[i])
-
-        # get the tree starting at the root of the vtkFile level, then write to
-        # file
-        vtuFile = XML.ElementTree(vtkFile)
-        vtuFile.write(cls.filename + "Fiber.vtu", xml_declaration=True)
+    @classmethod
+    def outputFiberPVTU(cls):
+        coordinates = numpy.asarray(cls.fibers['coordinates'])
+        tensors = numpy.asarray(cls.fibers['tensors']).reshape(len(coordinates), 3, 3)
+        pieces = []
+        for rows in numpy.array_split(numpy.arange(len(coordinates)), cls.numPieces):
+            if len(rows) == 0:
+                continue
+            pieceFile = cls.filename + "Fiber_" + str(len(pieces)) + ".vtu"
+            pieces.append((writeFiberVTU, pieceFile, coordinates[rows[0]:rows[-1] + 1],
+                           tensors[rows[0]:rows[-1] + 1], cls.dataFormat, cls.compress))
+        if not pieces:
+            # no fibres, one empty piece
+            pieces.append((writeFiberVTU, cls.filename + "Fiber_0.vtu", coordinates, tensors,
+                           cls.dataFormat, cls.compress))
+        writePieces(pieces, cls.numWorkers)
+
+        writePVTU(cls.filename + "Fiber.pvtu", [piece[1] for piece in pieces],
+                  [(name, 3) for name in FIBER_ARRAYS], vectors="Vector")
 
     @classmethod
     def openParaview(cls):
@@ -292,12 +656,10 @@ class ParaViewOutput:
         elem_array = vf.stored_data.elem.obj.elements - 1
 
         # Nodes
-        node_list = []
-        for i in range(len(vf.stored_data.nodes.obj)):
-            # x, y, z stored in field variable 1, 2, 3 which is stored at
-            # index 0-2, and the value is the first index of the field
-            # variable's array
-            nodeDerivs = vf.stored_data.nodes.obj.nodes[i].derivs
-            node_list.append(
-                (nodeDerivs[0][0], nodeDerivs[1][0], nodeDerivs[2][0]))
-        return numpy.array(node_list), elem_array
+        # x, y, z stored in field variable 1, 2, 3 which is stored at
+        # index 0-2, and the value is the first index of the field
+        # variable's array
+        nodes = vf.stored_data.nodes.obj.nodes
+        node_array = numpy.array([(nodes[i].derivs[0][0], nodes[i].derivs[1][0], nodes[i].derivs[2][0])
+                                  for i in range(len(vf.stored_data.nodes.obj))], dtype=numpy.float64).reshape(-1, 3)
+        return node_array, elem_array